@@ -9,10 +9,24 @@ except ImportError:
     Image = None
 
 from brukerimage import brukerimage
-from readbytestream import readbytestream 
 
 class bruker100image(brukerimage):
+    """
+    Read Bruker frames of the format 100 (SFRM), made of:
 
+    * the image block: NROWS*NCOLS pixels of NPIXELB[0] bytes
+    * the underflow table: NOVERFL[0] values of NPIXELB[1] bytes for the
+      pixels stored as 0 (NOVERFL[0] = -1 when there is no underflow table)
+    * the 1-byte overflow table: NOVERFL[1] values of 2 bytes for the pixels
+      stored as 255
+    * the 2-byte overflow table: NOVERFL[2] values of 4 bytes for the pixels
+      stored as (or overflowing to) 65535
+
+    each table being padded to a multiple of 16 bytes. When there is an
+    underflow table, the baseline offset NEXP[2] was subtracted before
+    storage: it is added back to all pixels but the underflows, whose table
+    holds the actual values.
+    """
 
     def toPIL16(self, filename=None):
         if not Image:
@@ -28,7 +42,11 @@ class bruker100image(brukerimage):
         return PILimage
 
     def read(self, fname, frame=None):
-        f = open(fname, "rb")
+        """
+        Read in and unpack the pixels, including the underflow and overflow
+        tables and the baseline offset (format 100)
+        """
+        f = self._open(fname, "rb")
         try:
             self._readheader(f)
         except:
@@ -36,49 +54,98 @@ class bruker100image(brukerimage):
 
         rows = int(self.header['NROWS'])
         cols = int(self.header['NCOLS'])
-        npixelb = int(self.header['NPIXELB'][0])
-        # you had to read the Bruker docs to know this!
+        npixelb = [int(i) for i in self.header['NPIXELB'].split()]
+        if len(npixelb) < 2:
+            npixelb.append(1)
+        noverfl = [int(i) for i in self.header['NOVERFL'].split()]
+        noverfl += [0] * (3 - len(noverfl))
+        baseline = 0
+        if noverfl[0] >= 0 and "NEXP" in self.header:
+            nexp = self.header["NEXP"].split()
+            if len(nexp) > 2:
+                baseline = int(nexp[2])
 
-        # We are now at the start of the image - assuming 
+        # We are now at the start of the image - assuming
         #   readbrukerheader worked
-        # size = rows * cols * npixelb
-        self.data = readbytestream(f, f.tell(), rows, cols, npixelb,
-                                    datatype="int", signed='n', swap='n')
-
-        noverfl = self.header['NOVERFL'].split() # now process the overflows
-        #read the set of "underflow pixels" - these will be completely 
-        # disregarded for now
-        data = self.data
-        k = 0
-
-        while k < 2:#for the time being things - are done in 16 bits
-            datatype = {'1' : numpy.uint8,
-                        '2' : numpy.uint16,
-                        '4' : numpy.uint32 }[("%d" % 2 ** k)]
-            ar = numpy.array(numpy.fromstring(f.read(int(noverfl[k]) * (2 ** k)),
-                                        datatype), numpy.uint16)
-            #insert the the overflow pixels in the image array:
-            #this is probably a memory intensive way of doing this - 
-            # might be done in a more clever way
-            lim = 2 ** (8 * k) - 1
-            #generate an array comprising of the indices into data.ravel() 
-            # where its value equals lim.
-            M = numpy.compress(numpy.equal(data.ravel(), lim), numpy.arange(rows * cols))
-            #now put values from ar into those indices
-            numpy.put(data.ravel(), M, ar)
-            padding = 16 * int(math.ceil(int(noverfl[k]) * (2 ** k) / 16.)) - \
-                         int(noverfl[k]) * (2 ** k)
-            f.seek(padding, 1)
-            print noverfl[k] + " bytes read + %d bytes padding" % padding
-            k = k + 1
-
+        image = numpy.fromstring(f.read(rows * cols * npixelb[0]), dtype=self.bpp_to_numpy[npixelb[0]])
+        # each table is read at once
+        underflows = self._readtable(f, noverfl[0], npixelb[1])
+        overflows1 = self._readtable(f, noverfl[1], 2)
+        overflows2 = self._readtable(f, noverfl[2], 4)
         f.close()
 
+        # decode directly into the smallest unsigned type holding the result
+        top = int(image.max()) if image.size else 0
+        for values in (overflows1, overflows2):
+            if values is not None:
+                top = max(top, int(values.max()))
+        top += baseline
+        if underflows is not None:
+            top = max(top, int(underflows.max()))
+        if top < 2 ** 8:
+            dtype = numpy.uint8
+        elif top < 2 ** 16:
+            dtype = numpy.uint16
+        elif top < 2 ** 32:
+            dtype = numpy.uint32
+        else:
+            dtype = numpy.uint64
+        data = image.astype(dtype)
+        if underflows is not None:
+            where_under = numpy.flatnonzero(image == 0)
+        # overflows, pixels equal to 255 then 65535 (possibly from the first
+        # table), limits smaller than the pixel size of the image are not flags
+        for values, limit in ((overflows1, 2 ** 8 - 1), (overflows2, 2 ** 16 - 1)):
+            if values is not None:
+                if limit < 2 ** (8 * npixelb[0]) - 1:
+                    logger.warning("Ignoring the overflow table for %s with %s bytes per pixel" % (limit, npixelb[0]))
+                    continue
+                self._scatter(data, numpy.flatnonzero(data == limit), values)
+        if baseline:
+            data += baseline
+        if underflows is not None:
+            self._scatter(data, where_under, underflows)
+
+        self.data = self._linear(data).reshape(rows, cols)
         (self.dim1, self.dim2) = (rows, cols)
-        print self.dim1, self.dim2
         self.resetvals()
+        self.pilimage = None
         return self
 
+    def _readtable(self, infile, nentries, bpp):
+        """
+        Read one underflow/overflow table, padded to 16 bytes
+
+        @param infile: opened file, at the start of the table
+        @param nentries: number of entries (-1 or 0 for no table)
+        @param bpp: number of bytes per entry
+        @return: numpy array or None
+        """
+        if nentries <= 0:
+            return None
+        nbytes = nentries * bpp
+        values = numpy.fromstring(infile.read(nbytes), dtype=self.bpp_to_numpy[bpp])
+        padding = 16 * int(math.ceil(nbytes / 16.)) - nbytes
+        infile.read(padding)
+        logger.debug("%s entries of %s bytes read + %d bytes padding", nentries, bpp, padding)
+        return values
+
+    @staticmethod
+    def _scatter(data, where, values):
+        """
+        Put the values of a table in place of the flagged pixels
+
+        @param data: flat array of pixels, modified in place
+        @param where: indices of the flagged pixels
+        @param values: values from the table
+        """
+        if where.size != values.size:
+            logger.warning("%s flagged pixels for %s entries in the table" % (where.size, values.size))
+            size = min(where.size, values.size)
+            where = where[:size]
+            values = values[:size]
+        data[where] = values
+
 if __name__ == '__main__':
     import sys, time
     I = bruker100image()
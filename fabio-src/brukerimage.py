@@ -154,42 +154,51 @@ class brukerimage(fabioimage):
         are in the total header. The header is always n*5*512 bytes,
         otherwise it wont contain whole key: value pairs
         """
-        line = 80
         blocksize = 512
         nhdrblks = 5 #by default we always read 5 blocks of 512
         self.__headerstring__ = infile.read(blocksize * nhdrblks)
         self.header = {}
-        for i in range(0, nhdrblks * blocksize, line):
-            if self.__headerstring__[i: i + line].find(":") > 0:
-                key, val = self.__headerstring__[i: i + line].split(":", 1)
-                key = key.strip()         # remove the whitespace (why?)
-                val = val.strip()
-                if key in self.header:
-                    # append lines if key already there
-                    self.header[key] = self.header[key] + os.linesep + val
-                else:
-                    self.header[key] = val
-                    self.header_keys.append(key)
+        self._parseheader(self.__headerstring__)
         # we must have read this in the first 5*512 bytes.
         nhdrblks = int(self.header['HDRBLKS'])
         # Now read in the rest of the header blocks, appending
-        self.__headerstring__ += infile.read(blocksize * (nhdrblks - 5))
-        for i in range(5 * blocksize, nhdrblks * blocksize, line):
-            if self.__headerstring__[i: i + line].find(":") > 0: # as for first 512 bytes of header
-                key, val = self.__headerstring__[i: i + line].split(":", 1)
-                key = key.strip()
-                val = val.strip()
-                if key in self.header:
-                    self.header[key] = self.header[key] + os.linesep + val
-                else:
-                    self.header[key] = val
-                    self.header_keys.append(key)
+        rest = infile.read(blocksize * (nhdrblks - 5))
+        self.__headerstring__ += rest
+        self._parseheader(rest)
         # make a (new) header item called "datastart"
         self.header['datastart'] = blocksize * nhdrblks
         #set the image dimensions
         self.dim1 = int(self.header['NROWS'])
         self.dim2 = int(self.header['NCOLS'])
 
+    def _parseheader(self, block):
+        """
+        Parse a block of 80 char lines "KEY    :value" at once: the block is
+        viewed as a 2D array of characters (one line per row) to find the
+        separators, lines without colon (padding) are skipped.
+        Keys already present get the new value appended on a new line.
+
+        @param block: string, part of the header (512 bytes blocks)
+        """
+        line = 80
+        if len(block) % line:
+            block += " " * (line - len(block) % line)
+        if not block:
+            return
+        chars = numpy.frombuffer(block, dtype=numpy.uint8).reshape(-1, line)
+        first = (chars == ord(":")).argmax(axis=1)
+        valid = numpy.flatnonzero(first)
+        for row, sep in zip(valid.tolist(), first[valid].tolist()):
+            start = row * line
+            key = block[start:start + sep].strip() # remove the whitespace (why?)
+            val = block[start + sep + 1:start + line].strip()
+            if key in self.header:
+                # append lines if key already there
+                self.header[key] = self.header[key] + os.linesep + val
+            else:
+                self.header[key] = val
+                self.header_keys.append(key)
+
     def read(self, fname, frame=None):
         """
         Read in and unpack the pixels (including overflow table
@@ -220,39 +229,60 @@ class brukerimage(fabioimage):
         if nov > 0:   # Read in the overflows
             # need at least int32 sized data I guess - can reach 2^21
             data = data.astype(numpy.uint32)
-            # 16 character overflows:
-            #      9 characters of intensity
-            #      7 character position
-            for i in range(nov):
-                ovfl = infile.read(16)
-                intensity = int(ovfl[0: 9])
-                position = int(ovfl[9: 16])
-                data[position] = intensity
+            position, intensity = self._readoverflow(infile.read(16 * nov), nov)
+            data[position] = intensity
         infile.close()
-        # Handle Float images ...
+        self.data = self._linear(data)
+        self.data.shape = self.dim1, self.dim2
+
+        self.resetvals()
+        self.pilimage = None
+        return self
+
+    def _linear(self, data):
+        """
+        Handle Float images: apply the "LINEAR" slope and offset, if any
+
+        @param data: integer pixel values
+        @return: data or float32 array
+        """
         if "LINEAR" in self.header:
             try:
                 slope, offset = self.header["LINEAR"].split(None, 1)
                 slope = float(slope)
                 offset = float(offset)
-            except Except:
+            except Exception:
                 logger.warning("Error in converting to float data with linear parameter: %s" % self.header["LINEAR"])
-                self.data = data
-            else:
-                if slope == 1 and offset == 0:
-                    self.data = data
-                else:
-                    #TODO: check that the formula is OK, not reverted.
-                    logger.warning("performing correction with slope=%s, offset=%s (LINEAR=%s)" % (slope, offset, self.header["LINEAR"]))
-                    self.data = (data * slope + offset).astype(numpy.float32)
-        else:
-            self.data = data
-        self.data.shape = self.dim1, self.dim2
-
-        self.resetvals()
-        self.pilimage = None
-        return self
+                return data
+            if slope == 1 and offset == 0:
+                return data
+            #TODO: check that the formula is OK, not reverted.
+            logger.warning("performing correction with slope=%s, offset=%s (LINEAR=%s)" % (slope, offset, self.header["LINEAR"]))
+            return (data * slope + offset).astype(numpy.float32)
+        return data
+
+    @staticmethod
+    def _readoverflow(raw, nov):
+        """
+        Parse the overflow table of the format 86: 16 character records,
+        9 characters of intensity and 7 characters of position (zero padded),
+        all parsed at once as an array of digits.
 
+        @param raw: string with (at least) nov records
+        @param nov: number of overflow records
+        @return: positions, intensities as numpy arrays
+        """
+        digits = numpy.frombuffer(raw, dtype=numpy.uint8, count=16 * nov).reshape(nov, 16).astype(numpy.int64)
+        digits -= ord("0")
+        if (digits < 0).any() or (digits > 9).any():
+            # unusual records (blank padding, sign...): parse them one by one
+            records = [raw[16 * i:16 * (i + 1)] for i in range(nov)]
+            intensity = numpy.array([int(rec[0:9]) for rec in records], dtype=numpy.int64)
+            position = numpy.array([int(rec[9:16]) for rec in records], dtype=numpy.int64)
+        else:
+            intensity = numpy.dot(digits[:, :9], 10 ** numpy.arange(8, -1, -1, dtype=numpy.int64))
+            position = numpy.dot(digits[:, 9:], 10 ** numpy.arange(6, -1, -1, dtype=numpy.int64))
+        return position, intensity
 
     def write(self, fname):
         """
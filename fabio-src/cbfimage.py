@@ -19,11 +19,13 @@ __version__ = ["Generated by CIF.py: Jan 2005 - April 2012",
               "On-line data analysis / ISDD ", "ESRF Grenoble (France)"]
 
 
-import os, logging
+import os, re, logging, collections, multiprocessing, hashlib, base64
+from multiprocessing.pool import ThreadPool
 logger = logging.getLogger("cbfimage")
 import numpy
 from fabioimage import fabioimage
-from compression import decByteOffet_numpy, md5sum, compByteOffet_numpy
+from fabioutils import File
+from compression import decByteOffet_numpy, md5sum, compByteOffet_cython
 #import time
 
 DATA_TYPES = { "signed 8-bit integer"   : numpy.int8,
@@ -42,6 +44,10 @@ MINIMUM_KEYS = ["X-Binary-Size-Fastest-Dimension",
 
 STARTER = "\x0c\x1a\x04\xd5"
 PADDING = 512
+# Compressed data are written (and their MD5 computed) by slices of this size
+BINARY_CHUNK = 1 << 20
+# Stands for the base64 encoded MD5 (24 characters) until the data are written
+MD5_PLACEHOLDER = "?" * 24
 
 class cbfimage(fabioimage):
     """
@@ -56,6 +62,7 @@ class cbfimage(fabioimage):
         """
         fabioimage.__init__(self, data, header)
         self.cif = CIF()
+        self._sections = [] # offset and header of each binary section
         if fname is not None: #load the file)
             self.read(fname)
 
@@ -69,25 +76,43 @@ class cbfimage(fabioimage):
             return data.astype(int)
 
 
-    def _readheader(self, inStream):
+    def _readheader(self, inStream, headerOnly=False):
         """
         Read in a header in some CBF format from a string representing binary stuff
 
         @param inStream: file containing the Cif Binary part.
         @type inStream: opened file.
+        @param headerOnly: stop reading at the start of the binary data
+        @type headerOnly: boolean
         """
-        self.cif.loadCIF(inStream, _bKeepComment=True)
+        self.cif.loadCIF(inStream, _bKeepComment=True, _bHeaderOnly=headerOnly)
+        self._cifToHeader(self.cif, self.header, self.header_keys)
+        missing = []
+        for item in MINIMUM_KEYS:
+            if item not in self.header_keys:
+                missing.append(item)
+        if len(missing) > 0:
+            logger.debug("CBF file misses the keys " + " ".join(missing))
 
-#        backport contents of the CIF data to the headers
-        for key in self.cif:
-            if key != "_array_data.data":
-                self.header_keys.append(key)
-                self.header[key] = self.cif[key].strip(" \"\n\r\t")
+    def _cifToHeader(self, cif, header, header_keys):
+        """
+        Backport the contents of the CIF data and the MIME header of the
+        binary section to a header
+
+        @param cif: CIF dictionary with the "_array_data.data" key
+        @param header: dict to be updated
+        @param header_keys: list of the keys of the header, in order
+        """
+        for key in cif:
+            if key not in ("_array_data.data", "loop_"):
+                if key not in header:
+                    header_keys.append(key)
+                header[key] = cif[key].strip(" \"\n\r\t")
 
-        if not "_array_data.data" in self.cif:
-            raise Exception("cbfimage: CBF file %s is corrupt, cannot find data block with '_array_data.data' key" % self.fname)
+        if not "_array_data.data" in cif:
+            raise Exception("cbfimage: CBF file %s is corrupt, cannot find data block with '_array_data.data' key" % self.filename)
 
-        inStream2 = self.cif["_array_data.data"]
+        inStream2 = cif["_array_data.data"]
         sep = "\r\n"
         iSepPos = inStream2.find(sep)
         if iSepPos < 0 or iSepPos > 80:
@@ -102,33 +127,146 @@ class cbfimage(fabioimage):
             except ValueError:
                 key, val = oneLine.split('=' , 1)
             key = key.strip()
-            self.header_keys.append(key)
-            self.header[key] = val.strip(" \"\n\r\t")
-        missing = []
-        for item in MINIMUM_KEYS:
-            if item not in self.header_keys:
-                missing.append(item)
-        if len(missing) > 0:
-            logger.debug("CBF file misses the keys " + " ".join(missing))
+            if key not in header:
+                header_keys.append(key)
+            header[key] = val.strip(" \"\n\r\t")
 
-
-    def read(self, fname, frame=None):
+    def readheader(self, filename):
         """
-        Read in header into self.header and
-            the data   into self.data
+        Read only the header: the file is read up to the start of the binary
+        data, the MIME header of the binary section included. The data can
+        be read later with readData.
+
+        @param filename: name of the file
         """
-        self.filename = fname
+        self.filename = filename
         self.header = {}
+        self.header_keys = []
+        self.cif = CIF()
+        infile = self._open(filename, "rb")
+        try:
+            self._readheader(infile, headerOnly=True)
+        finally:
+            infile.close()
+
+    def readData(self, nthreads=None, mmap=True):
+        """
+        Read the data of a file whose header was read with readheader:
+        only the binary data are read, from their position in the file.
+
+        @param nthreads: number of threads decoding the data (sequential decoding by default)
+        @param mmap: map the compressed data of uncompressed files instead of reading them
+        @return: self
+        """
+        if self.cif.binary_offset is None:
+            raise IOError("CBF file %s: no binary data found in the header" % self.filename)
+        bytecode = self._readDims()
+        infile = self._open(self.filename, "rb")
+        try:
+            self._readBinary(infile, self.cif.binary_offset, bytecode, nthreads, mmap)
+        finally:
+            infile.close()
+        self.bytecode = self.data.dtype.type
         self.resetvals()
+        self.pilimage = None
+        return self
 
-        infile = self._open(fname, "rb")
-        self._readheader(infile)
-        # Compute image size
+    def _readBinary(self, infile, offset, bytecode, nthreads=None, mmap=True):
+        """
+        Decode the binary data located at offset into self.data: the
+        compressed data of uncompressed files are memory-mapped and decoded
+        without any copy. The file is left at the end of the binary data.
+
+        @param infile: opened file
+        @param offset: position of the binary data in the file
+        @param bytecode: numpy type of the data
+        @param nthreads: number of threads decoding the data (sequential decoding by default)
+        @param mmap: map the compressed data of uncompressed files instead of reading them
+        """
+        if self.header["conversions"] != "x-CBF_BYTE_OFFSET":
+            raise Exception(IOError, "Compression scheme not yet supported, please contact FABIO development team")
+        nbytes = int(self.header["X-Binary-Size"])
+        if mmap and (nbytes > 0) and isinstance(infile, File) and os.path.isfile(infile.name) \
+                and (offset + nbytes <= os.path.getsize(infile.name)):
+            data = numpy.memmap(infile.name, dtype=numpy.uint8, mode="r", offset=offset, shape=(nbytes,))
+        else:
+            infile.seek(offset)
+            data = infile.read(nbytes)
+        self.data = self._decode_byte_offset(data, bytecode, nthreads).reshape((self.dim2, self.dim1))
+        infile.seek(offset + nbytes)
+
+    def _indexSections(self, infile):
+        """
+        Index the binary sections following the last one indexed: the CIF
+        text between sections is parsed, the binary data are skipped.
+        The header of a section is the one of the previous section updated
+        with the CIF items and the MIME header preceding its binary data.
+        CIF items after the last binary section are added to the header of
+        the last section.
+
+        @param infile: opened file
+        """
+        section = self._sections[-1]
+        while True:
+            infile.seek(section["offset"] + int(section["header"]["X-Binary-Size"]))
+            text, offset = CIF._readUntilBinary(infile)
+            end = CIF.TEXT_END.search(text)
+            if end is None:
+                break
+            cif = CIF()
+            cif._parseCIF(text[end.end():])
+            if offset is None:
+                for key in cif._ordered:
+                    if key == "loop_":
+                        self.cif["loop_"] = self.cif.get("loop_", []) + cif["loop_"]
+                    else:
+                        self.cif[key] = cif[key]
+                        if key not in section["header"]:
+                            section["header_keys"].append(key)
+                        section["header"][key] = cif[key].strip(" \"\n\r\t")
+                break
+            header = dict(section["header"])
+            header_keys = list(section["header_keys"])
+            self._cifToHeader(cif, header, header_keys)
+            section = {"offset": offset, "header": header, "header_keys": header_keys}
+            self._sections.append(section)
+        self.nframes = len(self._sections)
+
+    def _setSection(self, num):
+        """
+        Make the header of the binary section num the header of the image
+
+        @return: numpy type of the data
+        """
+        section = self._sections[num]
+        self.header = dict(section["header"])
+        self.header_keys = list(section["header_keys"])
+        self.currentframe = num
+        return self._readDims()
+
+    def _readSection(self, infile, num, nthreads=None, mmap=True):
+        """
+        Decode the binary section num, its header becomes the header of the image
+
+        @param infile: opened file
+        """
+        bytecode = self._setSection(num)
+        self._readBinary(infile, self._sections[num]["offset"], bytecode, nthreads, mmap)
+        self.bytecode = self.data.dtype.type
+        self.resetvals()
+        self.pilimage = None
+
+    def _readDims(self):
+        """
+        Set the dimensions and the bytes per pixel from the header
+
+        @return: numpy type of the data
+        """
         try:
             self.dim1 = int(self.header['X-Binary-Size-Fastest-Dimension'])
             self.dim2 = int(self.header['X-Binary-Size-Second-Dimension'])
         except:
-            raise Exception(IOError, "CBF file %s is corrupt, no dimensions in it" % fname)
+            raise Exception(IOError, "CBF file %s is corrupt, no dimensions in it" % self.filename)
         try:
             bytecode = DATA_TYPES[self.header['X-Binary-Element-Type']]
             self.bpp = len(numpy.array(0, bytecode).tostring())
@@ -136,37 +274,126 @@ class cbfimage(fabioimage):
             bytecode = numpy.int32
             self.bpp = 32
             logger.warning("Defaulting type to int32")
-        if self.header["conversions"] == "x-CBF_BYTE_OFFSET":
-            self.data = self._readbinary_byte_offset(self.cif["_array_data.data"]).astype(bytecode).reshape((self.dim2, self.dim1))
-        else:
-            raise Exception(IOError, "Compression scheme not yet supported, please contact FABIO development team")
+        return bytecode
 
-        self.bytecode = self.data.dtype.type
+    def read(self, fname, frame=None, nthreads=None, mmap=True, keepCif=True):
+        """
+        Read in header into self.header and
+            the data   into self.data
+
+        The CIF is parsed up to the binary section, the compressed data are
+        then decoded from their position in the file and are not kept.
+        Files with several binary sections are indexed in the same pass,
+        other sections are decoded by getframe.
+
+        @param frame: number of the binary section to read (the first one by default)
+        @param nthreads: number of threads decoding the data (sequential decoding by default)
+        @param mmap: map the compressed data of uncompressed files instead of reading them
+        @param keepCif: keep the CIF dictionary in self.cif, if False only self.header is kept
+        """
+        self.filename = fname
+        self.header = {}
+        self.header_keys = []
         self.resetvals()
-#        # ensure the PIL image is reset
-        self.pilimage = None
+
+        infile = self._open(fname, "rb")
+        try:
+            self._readheader(infile, headerOnly=True)
+            if self.cif.binary_offset is None:
+                raise IOError("CBF file %s: no binary data found" % fname)
+            self._sections = [{"offset": self.cif.binary_offset,
+                               "header": dict(self.header),
+                               "header_keys": list(self.header_keys)}]
+            if not frame:
+                self._readSection(infile, 0, nthreads, mmap)
+                self._indexSections(infile)
+            else:
+                self._indexSections(infile)
+                if frame >= self.nframes:
+                    logger.error("Reading file %s You requested frame %s but only %s frames are available", fname, frame, self.nframes)
+                    frame = 0
+                self._readSection(infile, frame, nthreads, mmap)
+            # CIF items after the last binary section
+            self._setSection(self.currentframe)
+        finally:
+            infile.close()
+        if not keepCif:
+            self.cif = CIF()
         return self
 
+    def getframe(self, num):
+        """
+        returns the file numbered 'num' in the series as a fabioimage,
+        or the binary section 'num' for files with several binary sections:
+        only this section is read, using the index built by read
+        """
+        if self.nframes == 1:
+            return fabioimage.getframe(self, num)
+        if num not in xrange(self.nframes):
+            txt = "Cannot access frame: %s/%s" % (num, self.nframes)
+            logger.error(txt)
+            raise ValueError("cbfimage.getframe:" + txt)
+        newImage = cbfimage()
+        newImage.cif = self.cif
+        newImage._sections = self._sections
+        newImage.nframes = self.nframes
+        infile = newImage._open(self.filename, "rb")
+        try:
+            newImage._readSection(infile, num)
+        finally:
+            infile.close()
+        return newImage
+
+    def previous(self):
+        """ returns the previous file in the series as a fabioimage """
+        if self.nframes == 1:
+            return fabioimage.previous(self)
+        return self.getframe(self.currentframe - 1)
+
+    def next(self):
+        """ returns the next file in the series as a fabioimage """
+        if self.nframes == 1:
+            return fabioimage.next(self)
+        return self.getframe(self.currentframe + 1)
 
 
-    def _readbinary_byte_offset(self, inStream):
+
+    def _readbinary_byte_offset(self, inStream, dtype=None, nthreads=None):
         """
         Read in a binary part of an x-CBF_BYTE_OFFSET compressed image
 
         @param inStream: the binary image (without any CIF decorators)
         @type inStream: python string.
-        @return: a linear numpy array without shape and dtype set
+        @param dtype: type of the array, the data are decoded directly into it (int64 by default)
+        @param nthreads: number of threads decoding the data (sequential decoding by default)
+        @return: a linear numpy array without shape set
         @rtype: numpy array
         """
         startPos = inStream.find(STARTER) + 4
         data = inStream[ startPos: startPos + int(self.header["X-Binary-Size"])]
+        return self._decode_byte_offset(data, dtype, nthreads)
+
+    def _decode_byte_offset(self, data, dtype=None, nthreads=None):
+        """
+        Decode the binary data of an x-CBF_BYTE_OFFSET compressed image
+
+        @param data: the compressed data, without the MIME header
+        @type data: python string.
+        @param dtype: type of the array, the data are decoded directly into it (int64 by default)
+        @param nthreads: number of threads decoding the data (sequential decoding by default)
+        @return: a linear numpy array without shape set
+        @rtype: numpy array
+        """
         try:
             import byte_offset
         except ImportError:
             logger.warning("Error in byte_offset part: Falling back to Numpy implementation")
-            myData = decByteOffet_numpy(data, size=self.dim1 * self.dim2)
+            myData = decByteOffet_numpy(data, size=self.dim1 * self.dim2, dtype=dtype)
         else:
-            myData = byte_offset.analyseCython(data, size=self.dim1 * self.dim2)
+            if nthreads:
+                myData = byte_offset.analyseParallel(data, size=self.dim1 * self.dim2, dtype=dtype, nthreads=nthreads)
+            else:
+                myData = byte_offset.analyseCython(data, size=self.dim1 * self.dim2, dtype=dtype)
 
         assert len(myData) == self.dim1 * self.dim2
         return myData
@@ -174,7 +401,8 @@ class cbfimage(fabioimage):
 
     def write(self, fname):
         """
-        write the file in CBF format
+        write the file in CBF format: the CIF and MIME headers are written
+        first, then the compressed data straight from their buffer.
         @param fname: name of the file
         @type: string
         """
@@ -182,16 +410,26 @@ class cbfimage(fabioimage):
             self.dim2, self.dim1 = self.data.shape
         else:
             raise RuntimeError("CBF image contains no data")
-        binary_blob = compByteOffet_numpy(self.data)
-#        l = len(binary_blob)
-#        if (l % PADDING) != 0:
-#            rem = PADDING - (l % PADDING)
-#            binary_blob += "\x00" * rem
+        binary_blob = compByteOffet_cython(self.data)
+        with open(fname, "wb") as outfile:
+            self._writeStream(outfile, binary_blob, fname)
+
+    def _writeStream(self, outfile, binary_blob, fname=None):
+        """
+        Write the CBF file into an opened file: the CIF text is assembled
+        without the compressed data, which are written from their own buffer.
+        The MD5 is computed on the slices as they are written, then filled in
+        the MIME header which precedes the data.
+
+        @param outfile: file opened for writing in binary mode, seekable
+        @param binary_blob: data compressed with the byte-offset algorithm
+        @param fname: name of the file, used for the data_ block name
+        """
         dtype = "Unknown"
         for key, value in DATA_TYPES.iteritems():
             if value == self.data.dtype:
                 dtype = key
-        binary_block = [
+        mime_header = "\r\n".join([
                         "--CIF-BINARY-FORMAT-SECTION--",
                         "Content-Type: application/octet-stream;",
                         '     conversions="x-CBF_BYTE_OFFSET"',
@@ -200,16 +438,12 @@ class cbfimage(fabioimage):
                         "X-Binary-ID: 1",
                         'X-Binary-Element-Type: "%s"' % (dtype),
                         "X-Binary-Element-Byte-Order: LITTLE_ENDIAN" ,
-                        "Content-MD5: %s" % md5sum(binary_blob),
+                        "Content-MD5: %s" % MD5_PLACEHOLDER,
                         "X-Binary-Number-of-Elements: %s" % (self.dim1 * self.dim2),
                         "X-Binary-Size-Fastest-Dimension: %d" % self.dim1,
                         "X-Binary-Size-Second-Dimension: %d" % self.dim2,
                         "X-Binary-Size-Padding: %d" % 1,
-                        "",
-                        STARTER + binary_blob,
-                        "",
-                        "--CIF-BINARY-FORMAT-SECTION----"
-                        ]
+                        ])
 
         if "_array_data.header_contents" not in self.header:
             nonCifHeaders = []
@@ -236,8 +470,119 @@ class cbfimage(fabioimage):
         if len(nonCifHeaders) > 0:
             self.cif["_array_data.header_contents"] = "\r\n".join(["# %s" % i for i in nonCifHeaders])
 
-        self.cif["_array_data.data"] = "\r\n".join(binary_block)
-        self.cif.saveCIF(fname, linesep="\r\n", binary=True)
+        # the CIF text is cut after the starter of the binary data
+        self.cif["_array_data.data"] = mime_header + "\r\n\r\n" + STARTER
+        text = self.cif.tostring(fname, linesep="\r\n")
+        idx = text.index(STARTER) + len(STARTER)
+        md5_pos = outfile.tell() + text.rindex("Content-MD5: " + MD5_PLACEHOLDER, 0, idx) + len("Content-MD5: ")
+        outfile.write(text[:idx])
+        digest = hashlib.md5()
+        for start in xrange(0, len(binary_blob), BINARY_CHUNK):
+            piece = buffer(binary_blob, start, BINARY_CHUNK)
+            digest.update(piece)
+            outfile.write(piece)
+        outfile.write("\r\n\r\n" + CIF.BINARY_MARKER + "--")
+        outfile.write(text[idx:])
+        md5 = base64.b64encode(digest.digest())
+        end = outfile.tell()
+        outfile.seek(md5_pos)
+        outfile.write(md5)
+        outfile.seek(end)
+        self.cif["_array_data.data"] = mime_header.replace(MD5_PLACEHOLDER, md5)
+
+
+class CbfWriter(object):
+    """
+    Batch writer for series of CBF files, e.g. frames coming from a detector:
+    the frames are compressed and written in a pool of threads (byte-offset
+    compression, MD5 and file writes release the GIL) while new frames are
+    queued. The number of frames waiting is bounded so that memory stays
+    under control when frames come faster than they are written.
+
+    Frames must not be modified until they are written (flush).
+    """
+    def __init__(self, header=None, nthreads=None, max_pending=None):
+        """
+        @param header: dict with the header common to all frames
+        @param nthreads: number of threads, by default the number of CPUs (1: frames are written synchronously)
+        @param max_pending: maximum number of frames queued, 4 per thread by default
+        """
+        self.header = header or {}
+        if nthreads is None:
+            nthreads = multiprocessing.cpu_count()
+        self.nthreads = max(1, nthreads)
+        self.max_pending = max_pending or 4 * self.nthreads
+        self.nframes = 0
+        self._pending = collections.deque()
+        if self.nthreads > 1:
+            self.pool = ThreadPool(self.nthreads)
+        else:
+            self.pool = None
+
+    def write(self, filename, data, header=None):
+        """
+        Queue a frame to be written
+
+        @param filename: name of the CBF file
+        @param data: 2D numpy array of integers
+        @param header: dict with the header specific to this frame
+        @return: number of the frame
+        """
+        frameHeader = dict(self.header)
+        if header:
+            frameHeader.update(header)
+        if self.pool is None:
+            _writeFrame(filename, data, frameHeader)
+        else:
+            while len(self._pending) >= self.max_pending:
+                self._pending.popleft().get()
+            self._pending.append(self.pool.apply_async(_writeFrame, (filename, data, frameHeader)))
+        self.nframes += 1
+        return self.nframes - 1
+
+    def writeFrames(self, filenames, frames, headers=None):
+        """
+        Queue several frames and wait until they are written
+
+        @param filenames: list of file names
+        @param frames: list of 2D arrays (or 3D array)
+        @param headers: list of dict with the header specific to each frame
+        """
+        if headers is None:
+            headers = [None] * len(filenames)
+        for filename, data, header in zip(filenames, frames, headers):
+            self.write(filename, data, header)
+        self.flush()
+
+    def flush(self):
+        """
+        Wait until all the frames queued are written, errors are raised here
+        """
+        while self._pending:
+            self._pending.popleft().get()
+
+    def close(self):
+        if self.pool is not None:
+            try:
+                self.flush()
+            finally:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _writeFrame(filename, data, header):
+    """
+    Write one frame of a CbfWriter (in a thread of the pool)
+    """
+    cbfimage(data=data, header=header).write(filename)
+
 
 ################################################################################
 # CIF class
@@ -251,6 +596,14 @@ class CIF(dict):
     BLANK = [" ", "\t"] + EOL
     START_COMMENT = ["\"", "\'"]
     BINARY_MARKER = "--CIF-BINARY-FORMAT-SECTION--"
+    RESERVED = set(["loop_", "stop_", "global_", "data_", "save_"])
+    # one field: quoted string (closing quote followed by a blank),
+    # start of a text field (semicolon at the beginning of a line) or plain word
+    TOKEN = re.compile(r"""\s*(?:'(.*?)'(?=[ \t\r\n]|\Z)|"(.*?)"(?=[ \t\r\n]|\Z)|(?:^|(?<=[\r\n]))(;)|(\S+))""", re.S | re.M)
+    TEXT_END = re.compile(r"[\r\n];")
+    START_SPECIAL = ("'", '"', ";")
+    SPECIAL = re.compile(r"""(?<!\S)['"]|(?:^|(?<=[\r\n]));""", re.M)
+    BINARY_START = re.compile(r"\s*" + BINARY_MARKER)
 
     def __init__(self, _strFilename=None):
         """
@@ -261,6 +614,7 @@ class CIF(dict):
         """
         dict.__init__(self)
         self._ordered = []
+        self.binary_offset = None # position of the binary data in the file, when read header-only
         if _strFilename is not None: #load the file)
             self.loadCIF(_strFilename)
 
@@ -280,12 +634,14 @@ class CIF(dict):
         return dict.popitem(self, key)
 
 
-    def loadCIF(self, _strFilename, _bKeepComment=False):
+    def loadCIF(self, _strFilename, _bKeepComment=False, _bHeaderOnly=False):
         """Load the CIF file and populates the CIF dictionary into the object
         @param _strFilename: the name of the file to open
         @type  _strFilename: string
-        @param _strFilename: the name of the file to open
-        @type  _strFilename: string
+        @param _bKeepComment: keep the comments (no pre-processing of the text)
+        @type  _bKeepComment: boolean
+        @param _bHeaderOnly: stop reading at the start of the binary data, its position is kept in binary_offset
+        @type  _bHeaderOnly: boolean
         @return: None
         """
 
@@ -299,12 +655,40 @@ class CIF(dict):
             infile = _strFilename
         else:
             raise RuntimeError("CIF.loadCIF: what is %s type %s" % (_strFilename, type(_strFilename)))
-        if _bKeepComment:
+        if _bHeaderOnly:
+            sText, self.binary_offset = CIF._readUntilBinary(infile)
+            self._parseCIF(sText)
+        elif _bKeepComment:
             self._parseCIF(infile.read())
         else:
             self._parseCIF(CIF._readCIF(infile))
     readCIF = loadCIF
 
+    @staticmethod
+    def _readUntilBinary(_instream, _iChunk=4096):
+        """
+        Read the CIF text up to the start of the binary data, by chunks:
+        the binary data themselves are never read.
+        The text field containing the MIME header of the binary section
+        is closed so that the text can be parsed as usual.
+
+        @param _instream: the file containing the CIF data
+        @type _instream: open file in read mode
+        @return: the text and the position of the binary data in the file (None if there are no binary data)
+        @rtype: 2-tuple
+        """
+        start = _instream.tell()
+        sText = ""
+        while True:
+            sChunk = _instream.read(_iChunk)
+            if not sChunk:
+                return sText, None
+            iFrom = max(len(sText) - len(STARTER) + 1, 0)
+            sText += sChunk
+            idx = sText.find(STARTER, iFrom)
+            if idx >= 0:
+                return sText[:idx] + "\n;\n", start + idx + len(STARTER)
+
     @staticmethod
     def isAscii(_strIn):
         """
@@ -383,9 +767,16 @@ class CIF(dict):
                 looplen.append(length)
 
 
-            for i in range(len(loopidx) - 1, -1, -1):
-                f1 = lFields[:loopidx[i]] + lFields[loopidx[i] + looplen[i]:]
-                lFields = f1
+            if all(i + length <= j for i, length, j in zip(loopidx, looplen, loopidx[1:])):
+                lKept = []
+                iLast = 0
+                for i, length in zip(loopidx, looplen):
+                    lKept += lFields[iLast:i]
+                    iLast = i + length
+                lFields = lKept + lFields[iLast:]
+            else: #overlapping loops ("LOOP_" within the data of a loop)
+                for i in range(len(loopidx) - 1, -1, -1):
+                    lFields = lFields[:loopidx[i]] + lFields[loopidx[i] + looplen[i]:]
 
             self["loop_"] = loop
 
@@ -406,71 +797,39 @@ class CIF(dict):
         @rtype: list
         """
         lFields = []
+        append = lFields.append
+        token = CIF.TOKEN.match
+        special = CIF.SPECIAL.search
+        iPos = 0
         while True:
-            if len(sText) == 0:
+            if sText[iPos:iPos + 1] not in CIF.START_SPECIAL:
+                # plain words up to the next quoted string or text field are split in bulk
+                nextSpecial = special(sText, iPos)
+                if nextSpecial is None:
+                    lFields += sText[iPos:].split()
+                    break
+                lFields += sText[iPos:nextSpecial.start()].split()
+                iPos = nextSpecial.start()
+            match = token(sText, iPos)
+            if match is None:
                 break
-            elif sText[0] == "'":
-                idx = 0
-                bFinished = False
-                while not  bFinished:
-                    idx += 1 + sText[idx + 1:].find("'")
-    ##########debuging    in case we arrive at the end of the text
-                    if idx >= len(sText) - 1:
-    #                    print sText,idx,len(sText)
-                        lFields.append(sText[1:-1].strip())
-                        sText = ""
-                        bFinished = True
-                        break
-
-                    if sText[idx + 1] in CIF.BLANK:
-                        lFields.append(sText[1:idx].strip())
-                        sText1 = sText[idx + 1:]
-                        sText = sText1.strip()
-                        bFinished = True
-
-            elif sText[0] == '"':
-                idx = 0
-                bFinished = False
-                while not  bFinished:
-                    idx += 1 + sText[idx + 1:].find('"')
-    ##########debuging    in case we arrive at the end of the text
-                    if idx >= len(sText) - 1:
-    #                    print sText,idx,len(sText)
-                        lFields.append(sText[1:-1].strip())
-#                        print lFields[-1]
-                        sText = ""
-                        bFinished = True
-                        break
-
-                    if sText[idx + 1] in CIF.BLANK:
-                        lFields.append(sText[1:idx].strip())
-#                        print lFields[-1]
-                        sText1 = sText[idx + 1:]
-                        sText = sText1.strip()
-                        bFinished = True
-            elif sText[0] == ';':
-                if sText[1:].strip().find(CIF.BINARY_MARKER) == 0:
-                    idx = sText[32:].find(CIF.BINARY_MARKER)
-                    if idx == -1:
-                        idx = 0
-                    else:
-                        idx += 32 + len(CIF.BINARY_MARKER)
-                else:
-                    idx = 0
-                bFinished = False
-                while not  bFinished:
-                    idx += 1 + sText[idx + 1:].find(';')
-                    if sText[idx - 1] in CIF.EOL:
-                        lFields.append(sText[1:idx - 1].strip())
-                        sText1 = sText[idx + 1:]
-                        sText = sText1.strip()
-                        bFinished = True
-            else:
-                f = sText.split(None, 1)[0]
-                lFields.append(f)
-#                print lFields[-1]
-                sText1 = sText[len(f):].strip()
-                sText = sText1
+            iPos = match.end()
+            if match.lastindex == 3: #text field, ends with a semicolon at the beginning of a line
+                iStart = iPos
+                if CIF.BINARY_START.match(sText, iStart):
+                    idx = sText.find(CIF.BINARY_MARKER, iStart + 31)
+                    if idx >= 0:
+                        iStart = idx + len(CIF.BINARY_MARKER)
+                end = CIF.TEXT_END.search(sText, iStart)
+                if end is None:
+                    append(sText[iPos:].strip())
+                    break
+                append(sText[iPos:end.start()].strip())
+                iPos = end.end()
+            elif match.lastindex == 4:
+                append(match.group(4))
+            else: #quoted string
+                append(match.group(match.lastindex).strip())
         return lFields
 
 
@@ -485,57 +844,23 @@ class CIF(dict):
             extracted from the lFields and the list of all the keys of the loop.
         @rtype: tuple
         """
-    #    in earch loop we first search the length of the loop
-    #    print lFields
-#        curloop = {}
-        loop = []
         keys = []
         i = iStart + 1
-        bFinished = False
-        while not bFinished:
-            if lFields[i][0] == "_":
-                keys.append(lFields[i])#.lower())
-                i += 1
-            else:
-                bFinished = True
-        data = []
-        while True:
-            if i >= len(lFields):
-                break
-            elif len(lFields[i]) == 0:
+        while lFields[i][0] == "_":
+            keys.append(lFields[i])
+            i += 1
+        iData = i
+        while i < len(lFields):
+            field = lFields[i]
+            if (len(field) == 0) or (field[0] == "_") or (field in CIF.RESERVED):
                 break
-            elif lFields[i][0] == "_":
-                break
-            elif lFields[i] in ["loop_", "stop_", "global_", "data_", "save_"]:
-                break
-            else:
-                data.append(lFields[i])
-                i += 1
-        #print len(keys), len(data)
-        k = 0
-
-        if len(data) < len(keys):
-            element = {}
-            for j in keys:
-                if k < len(data):
-                    element[j] = data[k]
-                else :
-                    element[j] = "?"
-                k += 1
-            #print element
-            loop.append(element)
-
+            i += 1
+        data = lFields[iData:i]
+        nkeys = len(keys)
+        if len(data) < nkeys:
+            loop = [dict(zip(keys, data + ["?"] * (nkeys - len(data))))]
         else:
-            #print data
-            #print keys
-            for i in range(len(data) / len(keys)):
-                element = {}
-                for j in keys:
-                    element[j] = data[k]
-                    k += 1
-    #            print element
-                loop.append(element)
-    #    print loop
+            loop = [dict(zip(keys, data[k:k + nkeys])) for k in xrange(0, len(data) - nkeys + 1, nkeys)]
         return loop, 1 + len(keys) + len(data), keys
 
 
@@ -12,7 +12,7 @@ __license__ = "GPLv3+"
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 
 
-import logging, struct, hashlib, base64, StringIO, sys
+import logging, struct, hashlib, base64, StringIO, sys, mmap
 if sys.version_info >= (3,):
     str = bytes
 logger = logging.getLogger("compression")
@@ -62,6 +62,19 @@ def decGzip(stream):
 
     if gzip is None:
         raise ImportError("gzip module is not available")
+    if zlib is not None:
+        # zlib works on the buffer directly (no file-like object) and releases the GIL
+        try:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            rawData = decompressor.decompress(stream)
+            # concatenated gzip members
+            while decompressor.unused_data.startswith("\x1f\x8b"):
+                stream = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                rawData += decompressor.decompress(stream)
+            return rawData
+        except zlib.error, error:
+            logger.debug("zlib unable to decompress the gzip stream (%s), using gzip" % error)
     fileobj = StringIO.StringIO(stream)
     try:
         rawData = gzip.GzipFile(fileobj=fileobj).read()
@@ -215,65 +228,171 @@ return_val=0;
 
 
 
-def decByteOffet_numpy(stream, size=None):
+def decByteOffet_numpy(stream, size=None, dtype=None, out=None):
     """
     Analyze a stream of char with any length of exception:
                 2, 4, or 8 bytes integers
 
-    @param stream: string representing the compressed data
+    Vectorized version: the 0x80 markers are classified by width, the bytes
+    of the exceptions are gathered and the deltas are summed with cumsum.
+    Returns the same values as analyseCython.
+
+    @param stream: string or buffer representing the compressed data
     @param size: the size of the output array (of longInts)
+    @param dtype: type of the output array, int64 by default
+    @param out: C-contiguous array to decode the data into (its size is the default size)
     @return: 1D-ndarray
 
     """
     logger.debug("CBF decompression using Numpy")
-    listnpa = []
-    key16 = "\x80"
-    key32 = "\x00\x80"
-    key64 = "\x00\x00\x00\x80"
-    shift = 1
-    while True:
-        idx = stream.find(key16)
-        if idx == -1:
-            listnpa.append(numpy.fromstring(stream, dtype="int8"))
-            break
-        listnpa.append(numpy.fromstring(stream[:idx], dtype="int8"))
-
-        if stream[idx + 1:idx + 3] == key32:
-            if stream[idx + 3:idx + 7] == key64:
-#                        long int 64 bits
-                listnpa.append(numpy.fromstring(stream[idx + 7:idx + 15],
-                                             dtype="int64"))
-                shift = 15
-            else: #32 bit int
-                listnpa.append(numpy.fromstring(stream[idx + 3:idx + 7],
-                                             dtype="int32"))
-                shift = 7
-        else:  # int16
-            listnpa.append(numpy.fromstring(stream[idx + 1:idx + 3],
-                                         dtype="int16"))
-            shift = 3
-        stream = stream[idx + shift:]
-    return  (numpy.hstack(listnpa)).astype("int64").cumsum()
-
-
-def decByteOffet_cython(stream, size=None):
+    if (out is not None) and (size is None):
+        size = out.size
+    length = len(stream)
+    # padding with zeros: exceptions truncated by the end of the stream read 0
+    raw = numpy.zeros(length + 16, dtype="uint8")
+    raw[:length] = numpy.frombuffer(stream, dtype="uint8")
+    markers, widths = _byteOffsetMarkers(raw, length)
+    # bytes of the exceptions are not values on their own
+    keep = numpy.ones(length + 16, dtype=bool)
+    for width in (7, 15):
+        where = markers[widths == width]
+        keep[(where[:, None] + numpy.arange(1, width)).ravel()] = False
+    keep[markers + 1] = False
+    keep[markers + 2] = False
+    delta = raw[:length][keep[:length]].view("int8").astype("int64")
+    position = markers - (numpy.cumsum(widths - 1) - (widths - 1))
+    for width, offset, exception in ((3, 1, "<i2"), (7, 3, "<i4"), (15, 7, "<i8")):
+        selected = (widths == width)
+        if selected.any():
+            nbytes = numpy.dtype(exception).itemsize
+            gathered = raw[markers[selected][:, None] + numpy.arange(offset, offset + nbytes)]
+            delta[position[selected]] = gathered.view(exception).ravel()
+    if size is not None:
+        delta = delta[:size]
+    if (dtype is None) and (out is None):
+        return delta.cumsum()
+    return _castDecoded(delta.cumsum(), dtype, out)
+
+
+def _castDecoded(decoded, dtype=None, out=None):
+    """
+    Convert decoded byte-offset data to dtype, or copy them into out
+
+    @param decoded: 1D-ndarray of int64
+    @param dtype: type of the output array
+    @param out: C-contiguous array to copy the data into
+    @return: 1D-ndarray
+    """
+    if out is not None:
+        if not out.flags.c_contiguous:
+            raise ValueError("Output array must be C-contiguous")
+        if decoded.size > out.size:
+            raise ValueError("Output array is too small: %s < %s" % (out.size, decoded.size))
+        dtype = out.dtype
+    dtype = numpy.dtype(dtype)
+    if (dtype.kind in "iu") and decoded.size:
+        limits = numpy.iinfo(dtype)
+        if (decoded.min() < limits.min) or (decoded.max() > limits.max):
+            raise OverflowError("Values of the byte-offset stream do not fit into %s" % dtype)
+    if out is None:
+        return decoded.astype(dtype)
+    flat = out.reshape(-1)
+    flat[:decoded.size] = decoded
+    return flat[:decoded.size]
+
+
+def _byteOffsetMarkers(raw, length):
+    """
+    Find the 0x80 bytes starting an exception, i.e. not part of the payload
+    of a previous exception.
+
+    Every 0x80 byte (candidate) gives the first candidate after its exception
+    (successor). The markers are the candidates on the path of successors
+    starting at the first one: list ranking by pointer jumping gives the
+    distance of each candidate to the end of the stream, and the candidate at
+    the same distance on the path from the first one is compared to it.
+
+    @param raw: the compressed data as uint8, padded with 16 zeros
+    @param length: the size of the compressed data
+    @return: positions of the markers, size of the exceptions (3, 7 or 15 bytes)
+    """
+    candidates = numpy.flatnonzero(raw[:length] == 0x80)
+    ncand = candidates.size
+    width = numpy.empty(ncand, dtype="int64")
+    width.fill(3)
+    if ncand == 0:
+        return candidates, width
+    is32 = (raw[candidates + 1] == 0x00) & (raw[candidates + 2] == 0x80)
+    width[is32] = 7
+    width[is32 & (raw[candidates + 3] == 0x00) & (raw[candidates + 4] == 0x00) & \
+          (raw[candidates + 5] == 0x00) & (raw[candidates + 6] == 0x80)] = 15
+    successor = numpy.searchsorted(candidates, candidates + width)
+    if (successor == numpy.arange(1, ncand + 1)).all():
+        # no 0x80 inside an exception: all candidates are markers
+        return candidates, width
+    # ncand is the end of the list
+    successor = numpy.append(successor, ncand)
+    rank = numpy.ones(ncand + 1, dtype="int64")
+    rank[ncand] = 0
+    jump = successor
+    while (jump[:ncand] != ncand).any():
+        rank += rank[jump]
+        jump = jump[jump]
+    steps = rank[0] - rank
+    reachable = (steps >= 0)
+    steps[~reachable] = 0
+    node = numpy.zeros(ncand + 1, dtype="int64")
+    jump = successor
+    bit = 0
+    while (steps >> bit).any():
+        move = ((steps >> bit) & 1).astype(bool)
+        node[move] = jump[node[move]]
+        jump = jump[jump]
+        bit += 1
+    onpath = ((node == numpy.arange(ncand + 1)) & reachable)[:ncand]
+    return candidates[onpath], width[onpath]
+
+
+def decByteOffet_cython(stream, size=None, dtype=None, out=None, nthreads=None):
     """
     Analyze a stream of char with any length of exception:
                 2, 4, or 8 bytes integers
 
     @param stream: string representing the compressed data
     @param size: the size of the output array (of longInts)
+    @param dtype: type of the output array, int64 by default
+    @param out: C-contiguous array to decode the data into (its size is the default size)
+    @param nthreads: number of threads decoding large streams (sequential decoding by default)
     @return: 1D-ndarray
 
     """
     logger.debug("CBF decompression using cython")
     try:
-        from fabio.byte_offset import analyseCython
+        from fabio.byte_offset import analyseCython, analyseParallel
     except ImportError, error:
         logger.error("Failed to import byte_offset cython module, falling back on numpy method")
-        return decByteOffet_numpy(stream, size)
+        return decByteOffet_numpy(stream, size, dtype, out)
+    else:
+        if nthreads:
+            return analyseParallel(stream, size, dtype, out, nthreads)
+        return analyseCython(stream, size, dtype, out)
+
+
+def compByteOffet_cython(data):
+    """
+    Compress a dataset into a string using the byte_offet algorithm
+
+    @param data: ndarray
+    @return: string/bytes with compressed data
+    """
+    try:
+        from fabio.byte_offset import compressCython
+    except ImportError, error:
+        logger.error("Failed to import byte_offset cython module, falling back on numpy method")
+        return compByteOffet_numpy(data)
     else:
-        return analyseCython(stream, size)
+        return compressCython(data)
+
 
 def compByteOffet_numpy(data):
     """
@@ -326,6 +445,27 @@ def compByteOffet_numpy(data):
 
 
 def decTY1(raw_8, raw_16=None, raw_32=None):
+    """
+    Modified byte offset decompressor used in Oxford Diffraction images,
+    using the Cython implementation when available
+
+    @param raw_8:  strings containing raw data with integer 8 bits
+    @param raw_16: strings containing raw data with integer 16 bits
+    @param raw_32: strings containing raw data with integer 32 bits
+    @return: numpy.ndarray
+
+    """
+    try:
+        from fabio.byte_offset import analyseTY1
+    except ImportError, error:
+        logger.error("Failed to import byte_offset cython module, falling back on numpy method")
+        return decTY1_numpy(raw_8, raw_16, raw_32)
+    else:
+        return analyseTY1(raw_8, raw_16, raw_32)
+decKM4CCD = decTY1
+
+
+def decTY1_numpy(raw_8, raw_16=None, raw_32=None):
     """
     Modified byte offset decompressor used in Oxford Diffraction images
     
@@ -347,19 +487,39 @@ def decTY1(raw_8, raw_16=None, raw_32=None):
     if raw_32:
         data[exception32] = int32
     summed = data.cumsum()
-    smax = summed.max()
-    if (smax > (2 ** 31 - 1)):
+    # smallest type holding both the minimum and the maximum, as the Cython decoder
+    smin = summed.min() if summed.size else 0
+    smax = summed.max() if summed.size else 0
+    if (smax > (2 ** 31 - 1)) or (smin < -2 ** 31):
         bytecode = "int64"
-    elif (smax > (2 ** 15 - 1)):
+    elif (smax > (2 ** 15 - 1)) or (smin < -2 ** 15):
         bytecode = "int32"
-    elif (smax > (2 ** 7 - 1)):
+    elif (smax > (2 ** 7 - 1)) or (smin < -2 ** 7):
         bytecode = "int16"
     else:
         bytecode = "int8"
     return summed.astype(bytecode)
-decKM4CCD = decTY1
+
 
 def compTY1(data):
+    """
+    Modified byte offset compressor used in Oxford Diffraction images,
+    using the Cython implementation (single pass) when available
+
+    @param data: numpy.ndarray with the input data (integers!)
+    @return: 3-tuple of strings: raw_8,raw_16,raw_32 containing raw data with integer of the given size
+
+    """
+    try:
+        from fabio.byte_offset import compressTY1
+    except ImportError, error:
+        logger.error("Failed to import byte_offset cython module, falling back on numpy method")
+        return compTY1_numpy(data)
+    else:
+        return compressTY1(data)
+
+
+def compTY1_numpy(data):
     """
     Modified byte offset compressor used in Oxford Diffraction images
 
@@ -373,7 +533,7 @@ def compTY1(data):
     diff[1:] = fdata[1:] - fdata[:-1]
     adiff = abs(diff)
     exception32 = (adiff > 32767)#2**15-1
-    exception16 = (adiff >= 127) - exception32 #2**7-1)
+    exception16 = (adiff >= 127) & ~exception32 #2**7-1)
     we16 = numpy.where(exception16)
     we32 = numpy.where(exception32)
     raw_16 = diff[we16].astype("int16").tostring()
@@ -388,7 +548,7 @@ def decPCK(stream, dim1=None, dim2=None, overflowPix=None, version=None):
     """
     Modified CCP4  pck decompressor used in MAR345 images
 
-    @param stream: string or file
+    @param stream: string, file or any buffer (bytearray, memoryview, mmap...)
     @return: numpy.ndarray (square array)
 
     """
@@ -397,11 +557,11 @@ def decPCK(stream, dim1=None, dim2=None, overflowPix=None, version=None):
         from mar345_IO import uncompress_pck
     except ImportError, error:
         raise RuntimeError("Unable to import mar345_IO to read compressed dataset")
-    if "seek" in dir(stream):
+    if "seek" in dir(stream) and not isinstance(stream, mmap.mmap):
         stream.seek(0)
         raw = stream.read()
     else:
-        raw = str(stream)
+        raw = stream
 
     return uncompress_pck(raw, dim1, dim2, overflowPix, version)
 
@@ -19,15 +19,20 @@ Authors:
 
 """
 from __future__ import with_statement
-import os, logging, types
+import os, re, logging, types, threading, array, multiprocessing, time
+from multiprocessing.pool import ThreadPool
 logger = logging.getLogger("edfimage")
 import numpy
 from fabioimage import fabioimage
-from fabioutils import isAscii, toAscii, nice_int
+from fabioutils import isAscii, toAscii, nice_int, File
 from compression import decBzip2, decGzip, decZlib
 
 
 BLOCKSIZE = 512
+# Item of a header block: (key, "=", value) or (text, "", "") when there is no "="
+HEADER_ITEM = re.compile(r"([^;=]*)(=?)([^;]*);?")
+INDEX_EXTENSION = ".idx.npz" # sidecar file with the position of all frames
+INDEX_VERSION = 1
 DATA_TYPES = {  "SignedByte"    :  numpy.int8,
                 "Signed8"       :  numpy.int8,
                 "UnsignedByte"  :  numpy.uint8,
@@ -95,24 +100,27 @@ class Frame(object):
     A class representing a single frame in an EDF file
     """
     def __init__(self, data=None, header=None, header_keys=None, number=None):
+        self._block = None # header block not parsed yet (frame created by a FrameTable)
+        self._template = None # [(header_keys, capsHeader)] shared by the frames of a FrameTable
+        # nothing to parse yet: the attributes behind the properties are set directly
         if header is None:
-            self.header = {}
+            self._header = {}
         else:
-            self.header = dict(header)
+            self._header = dict(header)
 
         if header_keys is None:
-            self.header_keys = self.header.keys()
+            self._header_keys = self._header.keys()
         else:
-            self.header_keys = header_keys[:]
+            self._header_keys = header_keys[:]
             for key in header_keys:
-                if key not in self.header:
+                if key not in self._header:
                     logger.warning("Header key %s, in header_keys is not in header dictionary, poping !!!" % key)
-                    self.header_keys.remove(key)
+                    self._header_keys.remove(key)
 
-        self.capsHeader = {}
-        for key in self.header_keys:
+        self._capsHeader = {}
+        for key in self._header_keys:
             try:
-                self.capsHeader[key.upper()] = key
+                self._capsHeader[key.upper()] = key
             except AttributeError:
                 logger.warning("Header key %s is not a string" % key)
         self._data = data
@@ -122,6 +130,7 @@ class Frame(object):
         self.start = None # Position of start of raw data in file
         self.size = None  # size of raw data in file
         self.file = None  # opened file object with locking capabilities !!!
+        self.mmap = False # map uncompressed data instead of reading them
         self.bpp = None
         self._bytecode = None
         if (number is not None) and isinstance(number, int):
@@ -129,52 +138,64 @@ class Frame(object):
         else:
             self.iFrame = 0
 
-    def parseheader(self, block):
+    def parseheader(self, block, template=None):
         """
         Parse the header in some EDF format from an already open file
 
+        All "key = value" pairs are extracted by a single pass of a compiled
+        regular expression over the block.
+        When the keys are the same, in the same order, as in the template,
+        the key list and the upper-case mapping of the template are re-used
+        and only the values are taken from the block.
+
         @param block: string representing the header block
         @type block: string, should be full ascii
+        @param template: (header_keys, capsHeader) of a previous frame, usually of the same file
+        @type template: 2-tuple (list, dict)
         @return: size of the binary blob
         """
         #reset values ...
-        self.header = {}
-        self.capsHeader = {}
-        self.header_keys = []
+        self._block = None # a header block still pending is replaced
         self.size = None
         calcsize = 1
         self.dims = []
 
-        for line in block.split(';'):
-            if '=' in line:
-                key, val = line.split('=' , 1)
-                # Why would someone put null bytes in a header?
-                key = key.replace("\x00"," ").strip()
-                self.header[key] = val.replace("\x00"," ").strip()
-                self.capsHeader[key.upper()] = key
-                self.header_keys.append(key)
+        if "\x00" in block:
+            # Why would someone put null bytes in a header?
+            block = block.replace("\x00", " ")
+        items = HEADER_ITEM.findall(block)
+        keys = [key.strip() for key, equal, value in items if equal]
+        if (template is not None) and (keys == template[0]):
+            keys = list(template[0])
+            capsHeader = template[1].copy()
+        else:
+            capsHeader = dict(zip([key.upper() for key in keys], keys))
+        header = dict(zip(keys, [value.strip() for key, equal, value in items if equal]))
+        self._header_keys = keys
+        self._header = header
+        self._capsHeader = capsHeader
 
         # Compute image size
-        if "SIZE" in self.capsHeader:
+        if "SIZE" in capsHeader:
             try:
-                self.size = nice_int(self.header[self.capsHeader["SIZE"]])
+                self.size = nice_int(header[capsHeader["SIZE"]])
             except ValueError:
-                logger.warning("Unable to convert to integer : %s %s " % (self.capsHeader["SIZE"], self.header[self.capsHeader["SIZE"]]))
-        if "DIM_1" in self.capsHeader:
+                logger.warning("Unable to convert to integer : %s %s " % (capsHeader["SIZE"], header[capsHeader["SIZE"]]))
+        if "DIM_1" in capsHeader:
             try:
-                dim1 = nice_int(self.header[self.capsHeader['DIM_1']])
+                dim1 = nice_int(header[capsHeader['DIM_1']])
             except ValueError:
-                logger.error("Unable to convert to integer Dim_1: %s %s" % (self.capsHeader["DIM_1"], self.header[self.capsHeader["DIM_1"]]))
+                logger.error("Unable to convert to integer Dim_1: %s %s" % (capsHeader["DIM_1"], header[capsHeader["DIM_1"]]))
             else:
                 calcsize *= dim1
                 self.dims.append(dim1)
         else:
             logger.error("No Dim_1 in headers !!!")
-        if "DIM_2" in self.capsHeader:
+        if "DIM_2" in capsHeader:
             try:
-                dim2 = nice_int(self.header[self.capsHeader['DIM_2']])
+                dim2 = nice_int(header[capsHeader['DIM_2']])
             except ValueError:
-                logger.error("Unable to convert to integer Dim_3: %s %s" % (self.capsHeader["DIM_2"], self.header[self.capsHeader["DIM_2"]]))
+                logger.error("Unable to convert to integer Dim_3: %s %s" % (capsHeader["DIM_2"], header[capsHeader["DIM_2"]]))
             else:
                 calcsize *= dim2
                 self.dims.append(dim2)
@@ -184,12 +205,12 @@ class Frame(object):
         # JON: this appears to be for nD images, but we don't treat those
         while iDim is not None:
             strDim = "DIM_%i" % iDim
-            if strDim in self.capsHeader:
+            if strDim in capsHeader:
                 try:
-                    dim3 = nice_int(self.header[self.capsHeader[strDim]])
+                    dim3 = nice_int(header[capsHeader[strDim]])
                 except ValueError:
                     logger.error("Unable to convert to integer %s: %s %s"
-                                  % (strDim, self.capsHeader[strDim], self.header[self.capsHeader[strDim]]))
+                                  % (strDim, capsHeader[strDim], header[capsHeader[strDim]]))
                     dim3 = None
                     iDim = None
                 else:
@@ -203,8 +224,8 @@ class Frame(object):
                 logger.debug("No Dim_3 -> it is a 2D image")
                 iDim = None
         if self._bytecode is None:
-            if "DATATYPE" in self.capsHeader:
-                self._bytecode = DATA_TYPES[self.header[self.capsHeader['DATATYPE']]]
+            if "DATATYPE" in capsHeader:
+                self._bytecode = DATA_TYPES[header[capsHeader['DATATYPE']]]
             else:
                 self._bytecode = numpy.uint16
                 logger.warning("Defaulting type to uint16")
@@ -213,7 +234,7 @@ class Frame(object):
         if (self.size is None):
             self.size = calcsize
         elif (self.size != calcsize):
-            if ("COMPRESSION" in self.capsHeader) and (self.header[self.capsHeader['COMPRESSION']].upper().startswith("NO")):
+            if ("COMPRESSION" in capsHeader) and (header[capsHeader['COMPRESSION']].upper().startswith("NO")):
                 logger.info("Mismatch between the expected size %s and the calculated one %s" % (self.size, calcsize))
                 self.size = calcsize
 
@@ -223,6 +244,45 @@ class Frame(object):
         return self.size
 
 
+    def _parsePending(self):
+        """
+        Parse the header block kept aside when the frame was created by a
+        FrameTable, with the keys of the other frames of the file as template
+        """
+        if self._block is not None:
+            block = self._block
+            size = self.size
+            self._block = None
+            self.parseheader(block, self._template[0])
+            if self._template[0] is None:
+                self._template[0] = (list(self._header_keys), self._capsHeader.copy())
+            # keep the size of the data block found when reading the file
+            self.size = size
+
+    def getHeader(self):
+        self._parsePending()
+        return self._header
+    def setHeader(self, _dictHeader):
+        self._parsePending()
+        self._header = _dictHeader
+    header = property(getHeader, setHeader)
+
+    def getHeaderKeys(self):
+        self._parsePending()
+        return self._header_keys
+    def setHeaderKeys(self, _listHeader):
+        self._parsePending()
+        self._header_keys = _listHeader
+    header_keys = property(getHeaderKeys, setHeaderKeys)
+
+    def getCapsHeader(self):
+        self._parsePending()
+        return self._capsHeader
+    def setCapsHeader(self, _dictHeader):
+        self._parsePending()
+        self._capsHeader = _dictHeader
+    capsHeader = property(getCapsHeader, setCapsHeader)
+
     def swap_needed(self):
         """
         Decide if we need to byteswap
@@ -250,68 +310,88 @@ class Frame(object):
         elif self.file is None:
             data = self._data
         else:
-            if self._bytecode is None:
-                if "DATATYPE" in self.capsHeader:
-                    self._bytecode = DATA_TYPES[self.header[self.capsHeader["DATATYPE"]]]
-                else:
-                    self._bytecode = numpy.uint16
-            dims = self.dims[:]
-            dims.reverse()
+            data = self._decode()
+            if data is not None:
+                self._data = data
+                self._bytecode = data.dtype.type
+        return data
+
+    def _decode(self, out=None):
+        """
+        Read and decode the data block from the file, without caching the result.
+        The read is positional when possible: no lock is held while decoding.
+
+        @param out: array to decode the data into (of shape dims)
+        @return: dataset as numpy.ndarray or None if the file is closed
+        """
+        dims = self._prepareDecode()
+        if self.mmap:
+            data = self._mapData(dims)
+            if data is not None:
+                if out is None:
+                    return data
+                out[...] = data
+                return out
+        if self.file.closed:
+            logger.error("file: %s from %s is closed. Cannot read data." % (self.file, self.file.name))
+            return
+        if isinstance(self.file, File):
+            fileData = self.file.pread(self.start, self.size)
+        else:
             with self.file.lock:
-                if self.file.closed:
-                    logger.error("file: %s from %s is closed. Cannot read data." % (self.file, self.file.filename))
-                    return
-                else:
-                    self.file.seek(self.start)
-                    fileData = self.file.read(self.size)
-
-            if ("COMPRESSION" in self.capsHeader):
-                compression = self.header[self.capsHeader["COMPRESSION"]].upper()
-                uncompressed_size = self.bpp
-                for i in dims:
-                    uncompressed_size *= i
-                if "OFFSET" in compression :
-                    try:
-                        import byte_offset#IGNORE:F0401
-                    except ImportError, error:
-                        logger.error("Unimplemented compression scheme:  %s (%s)" % (compression, error))
-                    else:
-                        myData = byte_offset.analyseCython(fileData, size=uncompressed_size)
-                        rawData = myData.astype(self._bytecode).tostring()
-                        self.size = uncompressed_size
-                elif compression == "NONE":
-                    rawData = fileData
-                elif "GZIP" in compression:
-                    rawData = decGzip(fileData)
-                    self.size = uncompressed_size
-                elif "BZ" in compression :
-                    rawData = decBzip2(fileData)
-                    self.size = uncompressed_size
-                elif "Z" in compression :
-                    rawData = decZlib(fileData)
-                    self.size = uncompressed_size
-                else:
-                    logger.warning("Unknown compression scheme %s" % compression)
-                    rawData = fileData
+                self.file.seek(self.start)
+                fileData = self.file.read(self.size)
+        return decode_datablock(fileData, self.compression, self._bytecode, dims, self.swap_needed(), out)
 
+    def _prepareDecode(self):
+        """
+        Sets the type of the data from the header if needed
+
+        @return: the shape of the dataset (slowest dimension first)
+        """
+        if self._bytecode is None:
+            if "DATATYPE" in self.capsHeader:
+                self._bytecode = DATA_TYPES[self.header[self.capsHeader["DATATYPE"]]]
             else:
-                rawData = fileData
-
-            expected = self.size
-            obtained = len(rawData)
-            if expected > obtained:
-                logger.error("Data stream is incomplete: %s < expected %s bytes" % (obtained, expected))
-                rawData += "\x00" * (expected - obtained)
-            elif expected < len(rawData):
-                logger.info("Data stream contains trailing junk : %s > expected %s bytes" % (obtained, expected))
-                rawData = rawData[:expected]
-            if self.swap_needed():
-                data = numpy.fromstring(rawData, self._bytecode).byteswap().reshape(tuple(dims))
-            else:
-                data = numpy.fromstring(rawData, self._bytecode).reshape(tuple(dims))
-            self._data = data
-            self._bytecode = data.dtype.type
-        return data
+                self._bytecode = numpy.uint16
+        dims = self.dims[:]
+        dims.reverse()
+        return dims
+
+    def getCompression(self):
+        """
+        @return: the compression scheme of the data block in upper case, or None
+        """
+        if "COMPRESSION" in self.capsHeader:
+            return self.header[self.capsHeader["COMPRESSION"]].upper()
+    compression = property(getCompression)
+
+    def _mapData(self, dims):
+        """
+        Map the uncompressed data block of a file on disk, without any copy:
+        the byte order is handled by the dtype of the (read-only) array
+
+        @param dims: shape of the dataset, slowest dimension first
+        @return: numpy.memmap or None if the data block cannot be mapped
+        """
+        if ("COMPRESSION" in self.capsHeader) and \
+                (self.header[self.capsHeader["COMPRESSION"]].upper() != "NONE"):
+            return
+        if not isinstance(self.file, File) or not os.path.isfile(self.file.name):
+            logger.debug("Frame %s: data block cannot be mapped from %s" % (self.iFrame, self.file))
+            return
+        dtype = numpy.dtype(self._bytecode)
+        if self.swap_needed():
+            dtype = dtype.newbyteorder()
+        nbytes = dtype.itemsize
+        for i in dims:
+            nbytes *= i
+        if self.start + nbytes > self.file.size:
+            logger.warning("Data block is incomplete, reading it instead of mapping it")
+            return
+        return numpy.memmap(self.file.name, dtype=dtype, mode="r",
+                            offset=self.start, shape=tuple(dims))
+
     def setData(self, npa=None):
         """Setter for data in edf frame"""
         self._data = npa
@@ -338,6 +418,9 @@ class Frame(object):
             data = self.data.astype(force_type)
         else:
             data = self.data
+        if not data.dtype.isnative:
+            # e.g. memory-mapped frames: always written in native byte order
+            data = data.astype(data.dtype.newbyteorder("="))
         fit2dMode = bool(fit2dMode)
         for key in self.header:
             KEY = key.upper()
@@ -433,6 +516,257 @@ class Frame(object):
         return "".join(listHeader) + data.tostring()
 
 
+def decode_datablock(fileData, compression, bytecode, dims, swap=False, out=None):
+    """
+    Decode the binary data block of an EDF frame
+
+    @param fileData: data block as read from the file
+    @param compression: compression scheme in upper case (None for uncompressed data)
+    @param bytecode: numpy type of the dataset
+    @param dims: shape of the dataset, slowest dimension first
+    @param swap: True if the data need to be byte-swapped
+    @param out: array of shape dims to decode the data into
+    @return: dataset as numpy.ndarray (out when provided)
+    """
+    bpp = numpy.dtype(bytecode).itemsize
+    expected = bpp
+    for i in dims:
+        expected *= i
+    if compression is None:
+        rawData = fileData
+    elif "OFFSET" in compression :
+        try:
+            import byte_offset#IGNORE:F0401
+        except ImportError, error:
+            logger.error("Unimplemented compression scheme:  %s (%s)" % (compression, error))
+            rawData = fileData
+        else:
+            count = expected // bpp
+            target = None
+            if (out is not None) and (out.dtype == numpy.dtype(bytecode)) and out.flags.c_contiguous:
+                target = out
+            myData = byte_offset.analyseCython(fileData, size=count, dtype=bytecode, out=target)
+            if myData.size == count:
+                # decoded directly in the type of the dataset, no other copy
+                return out if (target is not None) else myData.reshape(tuple(dims))
+            rawData = myData.tostring()
+            swap = False # decoded in native byte order
+    elif compression == "NONE":
+        rawData = fileData
+    elif "GZIP" in compression:
+        rawData = decGzip(fileData)
+    elif "BZ" in compression :
+        rawData = decBzip2(fileData)
+    elif "Z" in compression :
+        rawData = decZlib(fileData)
+    else:
+        logger.warning("Unknown compression scheme %s" % compression)
+        rawData = fileData
+
+    obtained = len(rawData)
+    if expected > obtained:
+        logger.error("Data stream is incomplete: %s < expected %s bytes" % (obtained, expected))
+        rawData += "\x00" * (expected - obtained)
+    elif expected < len(rawData):
+        logger.info("Data stream contains trailing junk : %s > expected %s bytes" % (obtained, expected))
+        rawData = rawData[:expected]
+    if out is None:
+        data = numpy.fromstring(rawData, bytecode).reshape(tuple(dims))
+        if swap:
+            data.byteswap(True)
+    else:
+        # single copy, from the decompressed buffer to the output array
+        dtype = numpy.dtype(bytecode)
+        if swap:
+            dtype = dtype.newbyteorder()
+        out[...] = numpy.frombuffer(rawData, dtype).reshape(tuple(dims))
+        data = out
+    return data
+
+
+def _decode_frame(args):
+    """
+    Read and decode a frame in a worker process of edfimage.readFrames
+
+    @param args: filename, start, size, compression, dtype, dims, swap
+    @return: dataset as numpy.ndarray
+    """
+    filename, start, size, compression, dtype, dims, swap = args
+    with open(filename, "rb") as infile:
+        infile.seek(start)
+        fileData = infile.read(size)
+    return decode_datablock(fileData, compression, numpy.dtype(dtype).type, dims, swap)
+
+
+def _column(values, dtype):
+    """
+    Convert a column of the frame table to a numpy array of type dtype,
+    without copy when possible. array.array are read through their buffer
+    (numpy.asarray iterates over the items).
+    """
+    if isinstance(values, array.array):
+        if len(values) == 0:
+            return numpy.zeros(0, dtype)
+        values = numpy.frombuffer(values, values.typecode)
+    if isinstance(values, numpy.ndarray):
+        if values.dtype == dtype:
+            return values
+        return values.astype(dtype)
+    return numpy.asarray(values, dtype=dtype)
+
+
+class FrameTable(object):
+    """
+    Compact, column-wise description of the frames of an EDF file.
+
+    Behaves like the list of frames: Frame objects are only created when
+    accessed, their header being parsed on demand (except for the first
+    frames, whose headers are kept as parsed when reading the file).
+    """
+    COLUMNS = ("start", "size", "bpp", "dtype", "dims", "header_start", "header_end")
+    PARSED_HEADERS = 16 # number of frames kept parsed by edfimage._readheader
+
+    def __init__(self, infile, start, size, bpp, dtype, dims,
+                 header_start, header_end, headers=None, frames=None):
+        """
+        @param infile: opened file object with locking capabilities
+        @param start, size: position and size of the data blocks
+        @param bpp: number of bytes per pixel
+        @param dtype: numpy type of each frame, as a string like "<u2"
+        @param dims: 2D array with the dimensions of each frame, padded with 0,
+                or list of the dimensions of each frame as tuples
+        @param header_start, header_end: position of each header block
+                in the headers string, or in the file if headers is None
+        @param headers: all header blocks concatenated (when read from an index)
+        @param frames: dict index -> Frame of the frames already created
+        """
+        self.file = infile
+        # converted to numpy arrays on first access, see __getattr__
+        self._columns = (start, size, bpp, dtype, dims, header_start, header_end)
+        self.headers = headers
+        self._frames = frames or {}
+        self._template = [None] # keys of the headers parsed on demand
+        self.mmap = False
+
+    def getMmap(self):
+        return self._mmap
+    def setMmap(self, value):
+        self._mmap = value
+        for frame in self._frames.itervalues():
+            frame.mmap = value
+    mmap = property(getMmap, setMmap)
+
+    def __getattr__(self, name):
+        """
+        The columns are only converted to numpy arrays when first used: they
+        are not needed as long as all frames are kept as objects
+        """
+        columns = self.__dict__.get("_columns")
+        if (columns is None) or (name not in self.COLUMNS):
+            raise AttributeError(name)
+        self._columns = None
+        start, size, bpp, dtype, dims, header_start, header_end = columns
+        self.start = _column(start, numpy.int64)
+        self.size = _column(size, numpy.int64)
+        self.bpp = _column(bpp, numpy.int32)
+        self.dtype = numpy.asarray(dtype, dtype="S")
+        if not isinstance(dims, numpy.ndarray):
+            # tuples of various lengths, padded with 0 (each shape once)
+            shapes = set(dims)
+            ndim = max([2] + [len(i) for i in shapes])
+            padded = dict((i, i + (0,) * (ndim - len(i))) for i in shapes)
+            dims = [padded[i] for i in dims]
+        self.dims = _column(dims, numpy.int64)
+        if len(self.start):
+            self.dims = self.dims.reshape((len(self.start), -1))
+        else:
+            # no frame (empty file or no header)
+            self.dims = self.dims.reshape((0, 0))
+        self.header_start = _column(header_start, numpy.int64)
+        self.header_end = _column(header_end, numpy.int64)
+        return getattr(self, name)
+
+    def __len__(self):
+        if self._columns is not None:
+            return len(self._columns[0])
+        return len(self.start)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def __getitem__(self, index):
+        nframes = len(self)
+        if index < 0:
+            index += nframes
+        if not 0 <= index < nframes:
+            raise IndexError("frame index out of range")
+        frame = self._frames.get(index)
+        if frame is None:
+            frame = self._frames[index] = self._makeFrame(index)
+        return frame
+
+    def _makeFrame(self, index):
+        """
+        Create the Frame object from the columns
+        """
+        frame = Frame(number=index)
+        frame.file = self.file
+        frame.mmap = self.mmap
+        frame.start = int(self.start[index])
+        frame.size = int(self.size[index])
+        frame.bpp = int(self.bpp[index])
+        frame._bytecode = numpy.dtype(self.dtype[index]).type
+        frame.dims = [int(n) for n in self.dims[index] if n > 0]
+        for i, n in enumerate(frame.dims):
+            setattr(frame, "dim%i" % (i + 1), n)
+        frame._block = self.getHeaderBlock(index)
+        frame._template = self._template
+        return frame
+
+    def getHeaderBlock(self, index):
+        """
+        @return: the raw header block of the frame (without curly brackets)
+        """
+        start = self.header_start[index]
+        end = self.header_end[index]
+        if self.headers is not None:
+            return self.headers[start:end]
+        if isinstance(self.file, File):
+            raw = self.file.pread(start, end - start)
+        else:
+            with self.file.lock:
+                self.file.seek(start)
+                raw = self.file.read(end - start)
+        return raw[raw.find("{") + 1:raw.find("}")]
+
+    def append(self, frame):
+        """
+        Append a frame (kept as an object)
+        """
+        index = len(self)
+        self.start = numpy.append(self.start, -1)
+        self.size = numpy.append(self.size, 0)
+        self.bpp = numpy.append(self.bpp, 0)
+        self.dtype = numpy.append(self.dtype, "")
+        self.dims = numpy.append(self.dims, numpy.zeros((1, self.dims.shape[1]), self.dims.dtype), axis=0)
+        self.header_start = numpy.append(self.header_start, 0)
+        self.header_end = numpy.append(self.header_end, 0)
+        self._frames[index] = frame
+
+    def pop(self, index= -1):
+        """
+        Remove a frame and return it
+        """
+        frame = self[index]
+        if index < 0:
+            index += len(self)
+        for name in self.COLUMNS:
+            setattr(self, name, numpy.delete(getattr(self, name), index, axis=0))
+        self._frames = dict(((i - (i > index)), frm) for i, frm in self._frames.items() if i != index)
+        return frame
+
+
 
 class edfimage(fabioimage):
     """ Read and try to write the ESRF edf data format """
@@ -508,7 +842,12 @@ class edfimage(fabioimage):
                     logger.info("Redefining MAX_HEADER_SIZE to %s" % new_max_header_size)
                     MAX_HEADER_SIZE = new_max_header_size
         while '}' not in block:
-            block = block + infile.read(BLOCKSIZE)
+            chunk = infile.read(BLOCKSIZE)
+            if not chunk:
+                # e.g. header of a frame still being written
+                logger.warning("Truncated header at the end of EDF file %s" % infile.name)
+                return
+            block = block + chunk
             if len(block) > MAX_HEADER_SIZE:
                 logger.warning("Runaway header in EDF file MAX_HEADER_SIZE: %s \n%s" % (MAX_HEADER_SIZE, block))
                 return
@@ -528,59 +867,108 @@ class edfimage(fabioimage):
         return block[start:end]
 
 
-    def _readheader(self, infile):
+    def _readheader(self, infile, blocks=None):
         """
         Read all headers in a file and populate self.header
         data is not yet populated
         @type infile: file object open in read mode
+        @param blocks: list to be populated with the header block of each frame
         """
-        self.__frames = []
+        # no 64 bits integers in array under python 2: doubles are exact up to 2**53
+        start = array.array("d")
+        size = array.array("d")
+        bpp = array.array("i")
+        dtype = []
+        dtypes = {} # numpy type -> dtype string
+        dims = []
+        header_start = array.array("d")
+        header_end = array.array("d")
+        frames = {} # the first frames are kept with their header parsed
+        scratch = None # re-used to parse the headers of the other frames
+        template = None # keys of the previous frame
         bContinue = True
         while bContinue:
+            position = infile.tell()
             block = self._readHeaderBlock(infile)
             if block is None:
                 bContinue = False
                 break
-            frame = Frame(number=self.nframes)
-            size = frame.parseheader(block)
+            if blocks is not None:
+                blocks.append(block)
+            index = len(start)
+            if index < FrameTable.PARSED_HEADERS:
+                frame = frames[index] = Frame(number=index)
+            else:
+                if scratch is None:
+                    scratch = Frame()
+                frame = scratch
+                frame._bytecode = None
+            frame_size = frame.parseheader(block, template)
+            template = (frame._header_keys, frame._capsHeader)
+            missing = [item for item in MINIMUM_KEYS if item not in frame._capsHeader]
+            if len(missing) > 0:
+                logger.info("EDF file %s frame %i misses mandatory keys: %s " % (self.filename, index, " ".join(missing)))
+            frame_start = infile.tell()
             frame.file = infile
-            frame.start = infile.tell()
-            frame.size = size
-            self.__frames += [frame]
+            frame.start = frame_start
+            header_start.append(position)
+            header_end.append(frame_start)
+            start.append(frame_start)
+            size.append(frame_size)
+            bpp.append(frame.bpp)
+            if frame._bytecode not in dtypes:
+                dtypes[frame._bytecode] = intern(numpy.dtype(frame._bytecode).str)
+            dtype.append(dtypes[frame._bytecode])
+            frame_dims = tuple(frame.dims)
+            if dims and dims[-1] == frame_dims:
+                frame_dims = dims[-1] # shared tuple
+            dims.append(frame_dims)
             try:
-                infile.seek(size, os.SEEK_CUR)
+                infile.seek(frame_size, os.SEEK_CUR)
             except Exception, error:
                 logger.warning("infile is %s" % infile)
                 logger.warning("Position is %s" % infile.tell())
-                logger.warning("size is %s" % size)
+                logger.warning("size is %s" % frame_size)
                 logger.error("It seams this error occurs under windows when reading a (large-) file over network: %s ", error)
                 raise Exception(error)
 
-            if  frame.start + size > infile.size:
-                logger.warning("Non complete datablock: got %s, expected %s" % (infile.size - frame.start, size))
+            if  frame_start + frame_size > infile.size:
+                logger.warning("Non complete datablock: got %s, expected %s" % (infile.size - frame_start, frame_size))
                 bContinue = False
                 break
 
-        for i, frame in enumerate(self.__frames):
-            missing = []
-            for item in MINIMUM_KEYS:
-                if item not in frame.capsHeader:
-                    missing.append(item)
-            if len(missing) > 0:
-                logger.info("EDF file %s frame %i misses mandatory keys: %s " % (self.filename, i, " ".join(missing)))
+        self.__frames = FrameTable(infile, start, size, bpp, dtype, dims,
+                                   header_start, header_end, frames=frames)
+        if scratch is not None:
+            # keys of the last frame, parsed in the scratch frame (not exposed)
+            self.__frames._template[0] = template
         self.currentframe = 0
 
 
-    def read(self, fname, frame=None):
+    def read(self, fname, frame=None, mmap=False, index=False):
         """
         Read in header into self.header and
             the data   into self.data
+
+        @param mmap: map uncompressed data blocks in memory (read-only) instead of reading them
+        @param index: use the sidecar index of the file (fname + INDEX_EXTENSION)
+                      to locate the frames, build it if missing or outdated
         """
         self.resetvals()
         self.filename = fname
 
         infile = self._open(fname, "rb")
-        self._readheader(infile)
+        if not index:
+            self._readheader(infile)
+        elif not self._loadIndex(infile):
+            blocks = []
+            self._readheader(infile, blocks)
+            try:
+                self._saveIndex(blocks)
+            except (IOError, OSError), error:
+                logger.warning("Unable to write the index of %s: %s" % (fname, error))
+        if mmap:
+            self.__frames.mmap = True
         if frame is None:
             pass
         elif frame < self.nframes:
@@ -592,6 +980,74 @@ class edfimage(fabioimage):
         self.pilimage = None
         return self
 
+    def _saveIndex(self, blocks):
+        """
+        Write the sidecar index of the file: position, size, shape and type of
+        each frame together with its raw header block
+
+        @param blocks: header block of each frame, as read by _readheader
+        """
+        stat = os.stat(self.filename)
+        frames = self.__frames
+        offsets = numpy.zeros(len(blocks) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([len(block) for block in blocks])
+        idxname = self.filename + INDEX_EXTENSION
+        tmpname = idxname + ".tmp"
+        with open(tmpname, "wb") as idxfile:
+            numpy.savez(idxfile,
+                        version=numpy.array(INDEX_VERSION),
+                        filesize=numpy.array(stat.st_size, dtype=numpy.int64),
+                        mtime=numpy.array(stat.st_mtime, dtype=numpy.float64),
+                        start=frames.start,
+                        size=frames.size,
+                        bpp=frames.bpp,
+                        dtype=frames.dtype,
+                        dims=frames.dims,
+                        header_offsets=offsets,
+                        headers=numpy.fromstring("".join(blocks), dtype=numpy.uint8))
+        if os.path.exists(idxname):
+            os.unlink(idxname) # no atomic replace under windows
+        os.rename(tmpname, idxname)
+        logger.debug("Index of %s written with %s frames" % (self.filename, len(frames)))
+
+    def _loadIndex(self, infile):
+        """
+        Populate the frame table from the sidecar index of the file if it is
+        up to date (same size and modification time)
+
+        @param infile: file object open in read mode
+        @return: True if the index was used
+        """
+        idxname = self.filename + INDEX_EXTENSION
+        if not os.path.isfile(idxname):
+            return False
+        try:
+            idx = numpy.load(idxname)
+            try:
+                stat = os.stat(self.filename)
+                if (int(idx["version"]) != INDEX_VERSION) or \
+                        (int(idx["filesize"]) != stat.st_size) or \
+                        (float(idx["mtime"]) != stat.st_mtime):
+                    logger.info("Index %s is outdated" % idxname)
+                    return False
+                start = idx["start"]
+                size = idx["size"]
+                bpp = idx["bpp"]
+                dtype = idx["dtype"]
+                dims = idx["dims"]
+                offsets = idx["header_offsets"]
+                headers = idx["headers"].tostring()
+            finally:
+                idx.close()
+        except Exception, error:
+            logger.warning("Unable to read index %s: %s" % (idxname, error))
+            return False
+        frames = FrameTable(infile, start, size, bpp, dtype, dims,
+                            offsets[:-1], offsets[1:], headers)
+        self.__frames = frames
+        self.currentframe = 0
+        return True
+
     def swap_needed(self):
         """
         Decide if we need to byteswap
@@ -672,6 +1128,116 @@ class edfimage(fabioimage):
                 outfile.write(frame.getEdfBlock(force_type=force_type, fit2dMode=fit2dMode))
 
 
+    def readFrames(self, indices=None, out=None, nthreads=None, processes=False, stats=None):
+        """
+        Decode several frames concurrently into a 3D array.
+        Frames are read with positional I/O and decoded in a pool of threads
+        (decompression and byte-offset decoding release the GIL) or of
+        processes, straight into the output stack. The data are not kept in
+        the frames.
+
+        @param indices: list of frame numbers, by default all frames
+        @param out: preallocated array of shape (len(indices), dim2, dim1)
+        @param nthreads: number of threads (or processes), by default the number of CPUs
+        @param processes: decode in a pool of processes instead of threads
+        @param stats: dict to be populated with the number of frames, of
+                      bytes read and decoded, the time spent and the throughput
+        @return: the 3D array with the data of the frames
+        """
+        t0 = time.time()
+        if indices is None:
+            indices = range(self.nframes)
+        frames = self.__frames
+        first = frames[indices[0]]
+        if first._data is not None:
+            shape = (len(indices),) + first._data.shape
+        else:
+            shape = (len(indices),) + tuple(reversed(first.dims))
+        if out is None:
+            out = numpy.empty(shape, dtype=first.bytecode)
+        elif out.shape != shape:
+            raise ValueError("edfimage.readFrames: output array has shape %s, expected %s" % (out.shape, shape))
+
+        def decode(position):
+            frame = frames[indices[position]]
+            if frame._data is not None:
+                out[position] = frame._data
+            else:
+                frame._decode(out[position])
+
+        if nthreads is None:
+            nthreads = multiprocessing.cpu_count()
+        nthreads = max(1, min(nthreads, len(indices)))
+        positions = range(len(indices))
+        if processes and nthreads > 1:
+            # frames which can be re-opened by the worker processes
+            tasks = []
+            for position in positions:
+                frame = frames[indices[position]]
+                if (frame._data is None) and (not frame.mmap) and isinstance(frame.file, File) \
+                        and os.path.isfile(frame.file.name):
+                    dims = frame._prepareDecode()
+                    tasks.append((position, (frame.file.name, frame.start, frame.size, frame.compression,
+                                             numpy.dtype(frame._bytecode).str, dims, frame.swap_needed())))
+            delegated = set(task[0] for task in tasks)
+            positions = [i for i in positions if i not in delegated]
+            pool = multiprocessing.Pool(nthreads)
+            try:
+                for task, data in zip(tasks, pool.imap(_decode_frame, [task[1] for task in tasks])):
+                    out[task[0]] = data
+            finally:
+                pool.close()
+                pool.join()
+            nthreads = 1
+        if nthreads == 1:
+            for position in positions:
+                decode(position)
+        else:
+            pool = ThreadPool(nthreads)
+            try:
+                pool.map(decode, positions)
+            finally:
+                pool.close()
+                pool.join()
+        if stats is not None:
+            elapsed = time.time() - t0
+            stats["frames"] = len(indices)
+            stats["bytes_read"] = sum(frames[i].size for i in indices)
+            stats["bytes_decoded"] = out.nbytes
+            stats["time"] = elapsed
+            stats["throughput"] = out.nbytes / elapsed / 1e6 if elapsed > 0 else float("inf")
+            logger.info("Decoded %s frames (%.1f MB) in %.3fs: %.1f MB/s" %
+                        (len(indices), out.nbytes / 1e6, elapsed, stats["throughput"]))
+        return out
+
+    def getLastCompleteFrame(self):
+        """
+        Returns the last frame with a complete data block, e.g. of a file
+        still being written by an EdfWriter
+
+        @return: fabioimage or None if no frame is complete
+        """
+        num, end = self._completeFrames()
+        if num == 0:
+            return None
+        if len(self.__frames) == 1:
+            return self
+        return self.getframe(num - 1)
+
+    def _completeFrames(self):
+        """
+        Look for the last frame with a complete data block
+
+        @return: number of frames up to the last complete one, position of
+                 the end of its data block in the file (0, 0 if none)
+        """
+        frames = self.__frames
+        for num in xrange(len(frames) - 1, -1, -1):
+            frame = frames[num]
+            if (frame.file is None) or (frame.start + frame.size <= frame.file.size):
+                return num + 1, frame.start + frame.size
+        return 0, 0
+
     def appendFrame(self, frame=None, data=None, header=None):
         """
         Method used add a frame to an EDF file
@@ -932,3 +1498,136 @@ class edfimage(fabioimage):
                 self.__frames[self.currentframe].bpp = _iVal
     bpp = property(getBpp, setBpp)
 
+
+class EdfWriter(object):
+    """
+    Streaming writer for multi-frame EDF files: the file is opened once and
+    each frame (header block and data) is appended as soon as it comes,
+    without keeping the stack in memory nor rewriting previous frames.
+
+    A reader can process the file while it is written, using
+    edfimage.getLastCompleteFrame.
+    """
+    def __init__(self, filename, append=False, flush_frames=1, flush_time=None,
+                 force_type=None, fit2dMode=False):
+        """
+        @param filename: name of the EDF file
+        @param append: append frames to an existing file instead of overwriting it
+        @param flush_frames: flush the file every flush_frames frames (None to disable)
+        @param flush_time: flush the file when the last flush is older than flush_time seconds
+        @param force_type: type of the dataset to be enforced like "float64" or "uint16"
+        @param fit2dMode: enforce compatibility with fit2d (frame numbers start at 1)
+        """
+        self.filename = filename
+        self.flush_frames = flush_frames
+        self.flush_time = flush_time
+        self.force_type = force_type
+        self.fit2dMode = fit2dMode
+        self.nframes = 0
+        if append and os.path.exists(filename):
+            self.nframes, end = self._scan(filename)
+            self.file = open(filename, "r+b")
+            self.file.seek(end)
+            if end < os.path.getsize(filename):
+                # left by a writer interrupted in the middle of a frame
+                logger.warning("EdfWriter: truncating %s after the last complete frame (%s bytes)" % (filename, end))
+                self.file.truncate()
+        else:
+            self.file = open(filename, "wb")
+        self._unflushed = 0
+        self._last_flush = time.time()
+
+    @staticmethod
+    def _scan(filename):
+        """
+        Scan the headers of an existing file, without reading any data
+
+        @return: number of complete frames, position of the end of the last one
+        """
+        img = edfimage()
+        img.filename = filename
+        infile = img._open(filename, "rb")
+        try:
+            img._readheader(infile)
+            return img._completeFrames()
+        finally:
+            infile.close()
+
+    def write(self, data, header=None):
+        """
+        Append a frame to the file
+
+        @param data: 2D numpy array
+        @param header: dict with the header of the frame
+        @return: number of the frame written
+        """
+        if self.file is None:
+            raise RuntimeError("EdfWriter: file %s is closed" % self.filename)
+        frame = Frame(data=data, header=header, number=self.nframes)
+        self.file.write(frame.getEdfBlock(force_type=self.force_type, fit2dMode=self.fit2dMode))
+        self.nframes += 1
+        self._unflushed += 1
+        if ((self.flush_frames is not None) and (self._unflushed >= self.flush_frames)) or \
+           ((self.flush_time is not None) and (time.time() - self._last_flush >= self.flush_time)):
+            self.flush()
+        return self.nframes - 1
+
+    def flush(self):
+        """
+        Make the frames written so far visible to readers
+        """
+        self.file.flush()
+        self._unflushed = 0
+        self._last_flush = time.time()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def build_index(filename):
+    """
+    (Re-)build the sidecar index of an EDF file, used by edfimage.read(filename, index=True)
+
+    @param filename: name of the EDF file
+    @return: number of frames indexed
+    """
+    img = edfimage()
+    img.filename = filename
+    infile = img._open(filename, "rb")
+    try:
+        blocks = []
+        img._readheader(infile, blocks)
+        img._saveIndex(blocks)
+    finally:
+        infile.close()
+    return img.nframes
+
+
+def build_index_background(filename, callback=None):
+    """
+    Build the sidecar index of an EDF file in a background thread
+
+    @param filename: name of the EDF file
+    @param callback: function called with the filename and the number of frames once done
+    @return: the (started) thread
+    """
+    def run():
+        try:
+            nframes = build_index(filename)
+        except Exception, error:
+            logger.error("Unable to build the index of %s: %s" % (filename, error))
+        else:
+            if callback is not None:
+                callback(filename, nframes)
+    thread = threading.Thread(target=run, name="build_index %s" % filename)
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -32,6 +32,7 @@ class fabioimage(object):
 
     _need_a_seek_to_read = False
     _need_a_real_file = False
+    _prefetched = None  # (filename, stream) opened by openimage while sniffing
 
     def __init__(self, data=None , header=None):
         """
@@ -380,7 +381,11 @@ class fabioimage(object):
             return fname
         if isinstance(fname, (str, unicode)):
             self.header["filename"] = fname
-            if os.path.splitext(fname)[1] == ".gz":
+            prefetched = self._prefetched
+            self._prefetched = None
+            if (prefetched is not None) and (prefetched[0] == fname) and (mode[0] == "r"):
+                fileObject = self._reuse_stream(fname, prefetched[1], prefetched[2], mode)
+            elif os.path.splitext(fname)[1] == ".gz":
                 fileObject = self._compressed_stream(fname,
                                        fabioutils.COMPRESSORS['.gz'],
                                        fabioutils.GzipFile,
@@ -397,38 +402,95 @@ class fabioimage(object):
             # FIXME - should we fix that or complain about the daft naming?
             else:
                 fileObject = fabioutils.File(fname, mode)
-            if "name" not in dir(fileObject):
+            if not hasattr(fileObject, "name"):
                 fileObject.name = fname
 
+            if prefetched is not None and prefetched[1] is not fileObject:
+                prefetched[1].close()
+
         return fileObject
 
+    def _prefetch(self, fname, stream, head=""):
+        """
+        Hand over a stream already opened (and partially read) on fname,
+        typically by openimage while sniffing the magic bytes, so that the
+        next call to _open on the same file re-uses it instead of opening
+        (and decompressing) the file a second time.
+
+        @param fname: name of the file the stream was opened on
+        @param stream: file-like object as returned by fabioimage._open
+        @param head: bytes already read from the start of the stream
+        """
+        self._prefetched = (fname, stream, head)
+
+    def _close_prefetched(self):
+        """
+        Close the stream handed over by _prefetch if it was not used, i.e.
+        when the class opened the file by its own means (h5py, numpy...)
+        """
+        prefetched = self._prefetched
+        self._prefetched = None
+        if prefetched is not None:
+            prefetched[1].close()
+
+    def _reuse_stream(self, fname, stream, head="", mode="rb"):
+        """
+        Adapt a prefetched stream to the needs of the class (seekable or real
+        file) exactly as _open would have done, without decompressing twice
+        the beginning of the file.
+        """
+        ext = os.path.splitext(fname)[1]
+        if ext == ".gz":
+            return self._compressed_stream(fname,
+                                           fabioutils.COMPRESSORS['.gz'],
+                                           fabioutils.GzipFile,
+                                           mode, stream, head)
+        elif ext == ".bz2":
+            return self._compressed_stream(fname,
+                                           fabioutils.COMPRESSORS['.bz2'],
+                                           fabioutils.BZ2File,
+                                           mode, stream, head)
+        stream.seek(0)
+        return stream
+
     def _compressed_stream(self,
                            fname,
                            system_uncompress,
                            python_uncompress,
-                           mode='rb'):
+                           mode='rb',
+                           stream=None,
+                           head=""):
         """
         Try to transparently handle gzip / bzip without always getting python
         performance
+
+        @param stream: python decompressor already opened on fname (optional)
+        @param head: bytes already read from stream, if any
         """
         # assert that python modules are always OK based on performance benchmark
         # Try to fix the way we are using them?
         fobj = None
+        if stream is None:
+            stream = python_uncompress(fname, mode)
         if self._need_a_real_file and mode[0] == "r":
-            fo = python_uncompress(fname, mode)
+            fo = stream
 #            fobj = os.tmpfile()
             #problem when not administrator under certain flavors of windows
             tmpfd, tmpfn = tempfile.mkstemp()
             os.close(tmpfd)
             fobj = fabioutils.File(tmpfn, "w+b")
+            fobj.write(head)
             fobj.write(fo.read())
             fo.close()
             fobj.seek(0)
         elif self._need_a_seek_to_read and mode[0] == "r":
-            fo = python_uncompress(fname, mode)
-            fobj = fabioutils.StringIO(fo.read(), fname, mode)
+            fo = stream
+            fobj = fabioutils.StringIO(head + fo.read(), fname, mode)
+            fo.close()
         else:
-            fobj = python_uncompress(fname, mode)
+            fobj = stream
+            if head:
+                fobj.seek(0)
         return fobj
 
     def convert(self, dest):
@@ -438,30 +500,21 @@ class fabioimage(object):
         """
         if type(dest) in types.StringTypes:
             dest = dest.lower()
-            modules = []
+            from openimage import get_klass
+            formats = []
             for val  in fabioutils.FILETYPES.values():
-                modules += [i + "image" for i in val if i not in modules]
+                formats += [i for i in val if i not in formats]
             klass = None
-            module = None
-            klass_name = None
-            for klass_name in modules:
-                if  klass_name.startswith(dest):
+            for fmt in formats:
+                if  (fmt + "image").startswith(dest):
                     try:
-                        module = sys.modules["fabio." + klass_name]
-                    except KeyError:
-                        try:
-                            module = __import__(klass_name)
-                        except:
-                            logger.error("Failed to import %s", klass_name)
-                        else:
-                            logger.debug("imported %simage", klass_name)
-                    if module is not None:
+                        klass = get_klass(fmt)
+                    except Exception, error:
+                        logger.error("Failed to import %simage: %s", fmt, error)
+                    else:
+                        logger.debug("imported %simage", fmt)
+                    if klass is not None:
                         break
-            if module is not None:
-                if hasattr(module, klass_name):
-                    klass = getattr(module, klass_name)
-                else:
-                    logger.error("Module %s has no image class" % module)
         elif isinstance(dest, self.__class__):
             klass = dest.__class__
         elif ("__new__" in dir(dest)) and isinstance(dest(), fabioimage):
@@ -5,7 +5,7 @@
 General purpose utilities functions for fabio
 """
 from __future__ import with_statement
-import re, os, logging, threading, sys
+import re, os, logging, threading, thread, sys
 import StringIO as stringIO
 logger = logging.getLogger("fabioutils")
 from compression import bz2, gzip
@@ -415,6 +415,7 @@ class File(file):
         file.__init__(self, name, mode, buffering)
         self.lock = threading.Semaphore()
         self.__size = None
+        self.__handles = {} # thread ident -> handle used for positional reads
     def getSize(self):
         if self.__size is None:
             logger.debug("Measuring size of %s" % self.name)
@@ -426,11 +427,36 @@ class File(file):
         return self.__size
     def setSize(self, size):
         self.__size = size
+    def pread(self, offset, size):
+        """
+        Positional read, which neither uses nor moves the shared file position:
+        threads can read concurrently without taking the lock.
+        Relies on os.pread when available, else on one read-only handle per thread.
+
+        @param offset: position of the first byte to read
+        @param size: number of bytes to read
+        @return: string (shorter than size at the end of the file)
+        """
+        if hasattr(os, "pread"):
+            return os.pread(self.fileno(), size, offset)
+        ident = thread.get_ident()
+        handle = self.__handles.get(ident)
+        if handle is None:
+            handle = self.__handles[ident] = open(self.name, "rb")
+        handle.seek(offset)
+        return handle.read(size)
+    def close(self):
+        """
+        Close the file, and the handles used for positional reads.
+        """
+        while self.__handles:
+            self.__handles.popitem()[1].close()
+        return file.close(self)
     def __exit__(self, *args, **kwargs):
         """
         Close the file.
         """
-        return file.close(self)
+        return self.close()
     def __enter__(self, *args, **kwargs):
         return self
     size = property(getSize, setSize)
@@ -19,31 +19,54 @@ Authors:
 """
 
 from fabioimage import fabioimage
-import numpy, struct, time, sys, traceback
+import numpy, struct, time, sys, traceback, multiprocessing
+from multiprocessing.pool import ThreadPool
 import logging
 logger = logging.getLogger("mar345image")
 from compression import compPCK, decPCK
+from fabioutils import StringIO
 
 
 class mar345image(fabioimage):
-    _need_a_real_file = True
+    _need_a_seek_to_read = True
     def __init__(self, *args, **kwargs):
         fabioimage.__init__(self, *args, **kwargs)
         self.numhigh = None
         self.numpixels = None
 
     def read(self, fname, frame=None):
-        """ Read a mar345 image"""
+        """
+        Read a mar345 image: the whole file is read (and decompressed for
+        .gz/.bz2 files) in memory, without temporary file
+        """
         self.filename = fname
         f = self._open(self.filename, "rb")
-        self._readheader(f)
+        raw = f.read()
+        f.close()
+        return self.readBuffer(raw, self.filename)
+
+    def readBuffer(self, raw, fname=None):
+        """
+        Decode a mar345 image already in memory
+
+        @param raw: content of the file: string or any buffer (bytearray,
+                    memoryview, mmap...), read in place
+        @param fname: name of the file, if any
+        @return: self
+        """
+        if fname is not None:
+            self.filename = fname
+        if isinstance(raw, memoryview):
+            header = raw[:4096].tobytes()
+        else:
+            header = str(buffer(raw, 0, 4096))
+        self._readheader(StringIO(header, self.filename))
         if 'compressed' in self.header['Format']:
-#            self.data = decPCK(f, self.dim1, self.dim2, self.numhigh, version=1)
+#            self.data = decPCK(raw, self.dim1, self.dim2, self.numhigh, version=1)
             try:
-                self.data = decPCK(f, self.dim1, self.dim2)
+                self.data = decPCK(raw, self.dim1, self.dim2)
             except Exception, error:
                 logger.error('%s. importing the mar345_io backend: generate an empty 1x1 picture' % error)
-                f.close()
                 self.dim1 = 1
                 self.dim2 = 1
                 self.bytecode = numpy.int #
@@ -55,7 +78,6 @@ class mar345image(fabioimage):
                 "due to lack of documentation")
             return None
         self.bytecode = numpy.uint
-        f.close()
         return self
 
     def _readheader(self, infile=None):
@@ -325,3 +347,37 @@ class mar345image(fabioimage):
             z[:shape[0], :shape[1]] = data
             return z
 
+
+def writeFrames(filenames, frames, headers=None, nthreads=None):
+    """
+    Write several mar345 files in parallel: the PCK compression and the file
+    writes release the GIL, so each thread of the pool writes one frame.
+
+    @param filenames: list of file names
+    @param frames: list of 2D arrays (or 3D array)
+    @param headers: list of dict with the header of each frame
+    @param nthreads: number of threads, by default the number of CPUs
+    """
+    if headers is None:
+        headers = [None] * len(filenames)
+    jobs = zip(filenames, frames, headers)
+    if nthreads is None:
+        nthreads = multiprocessing.cpu_count()
+    if nthreads <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            _writeFrame(job)
+        return
+    pool = ThreadPool(min(nthreads, len(jobs)))
+    try:
+        pool.map(_writeFrame, jobs, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _writeFrame(job):
+    """
+    Write one frame of writeFrames (in a thread of the pool)
+    """
+    filename, data, header = job
+    mar345image(data=data, header=header).write(filename)
@@ -10,32 +10,39 @@ Authors: Henning O. Sorensen & Erik Knudsen
 mods for fabio by JPW
 
 """
-import sys, logging
+import sys, struct, logging
 logger = logging.getLogger("openimage")
 from fabioutils  import FilenameObject
 from fabioimage import fabioimage
-import edfimage
-import adscimage
-import tifimage
-import marccdimage
-import mar345image
-import fit2dmaskimage
-import brukerimage
-import bruker100image
-import pnmimage
-import GEimage
-import OXDimage
-import dm3image
-import HiPiCimage
-import pilatusimage
-import fit2dspreadsheetimage
-import kcdimage
-import cbfimage
-import xsdimage
-import binaryimage
-import pixiimage
-import hdf5image
-import raxisimage
+
+# Registry of the formats known by fabio: the name of a format (as used in
+# MAGIC_NUMBERS and fabioutils.FILETYPES) gives the module of the fabio
+# package defining the class "<format>image".
+# Those modules are only imported when a file of this format is opened (or an
+# image converted to it) for the first time.
+FORMATS = {"edf"              : "edfimage",
+           "adsc"             : "adscimage",
+           "tif"              : "tifimage",
+           "marccd"           : "marccdimage",
+           "mar345"           : "mar345image",
+           "fit2dmask"        : "fit2dmaskimage",
+           "bruker"           : "brukerimage",
+           "bruker100"        : "bruker100image",
+           "pnm"              : "pnmimage",
+           "GE"               : "GEimage",
+           "OXD"              : "OXDimage",
+           "dm3"              : "dm3image",
+           "HiPiC"            : "HiPiCimage",
+           "pilatus"          : "pilatusimage",
+           "fit2dspreadsheet" : "fit2dspreadsheetimage",
+           "kcd"              : "kcdimage",
+           "cbf"              : "cbfimage",
+           "xsd"              : "xsdimage",
+           "binary"           : "binaryimage",
+           "pixi"             : "pixiimage",
+           "hdf5"             : "hdf5image",
+           "raxis"            : "raxisimage",
+           }
 
 MAGIC_NUMBERS = [
     # "\42\5a" : 'bzipped'
@@ -43,12 +50,11 @@ MAGIC_NUMBERS = [
     ("FORMAT :        86" , 'bruker'),
     ("\x4d\x4d\x00\x2a"   , 'tif') ,
     # The marCCD and Pilatus formats are both standard tif with a header
-    # hopefully these byte patterns are unique for the formats
-    # If not the image will be read, but the is missing 
+    # these byte patterns are only a first guess, refined by _validate_tiff
     ("\x49\x49\x2a\x00\x08\x00"   , 'marccd') ,
     ("\x49\x49\x2a\x00\x82\x00"   , 'pilatus') ,
     ("\x49\x49\x2a\x00"   , 'tif') ,
-    # ADSC must come before edf
+    # the longest matching signature wins: ADSC is tested before edf
     ("{\nHEA"             , 'adsc'),
     ("{"                  , 'edf'),
     ("\r{"                , 'edf'),
@@ -72,20 +78,164 @@ MAGIC_NUMBERS = [
 
 URL_PREFIX = {"file:":False, "hdf5:":True, "h5:":True} #Shall we split after the last ":"
 
-def do_magic(byts):
-    """ Try to interpret the bytes starting the file as a magic number """
-    for magic, format_type in MAGIC_NUMBERS:
-        if byts.find(magic) == 0:
+# Number of bytes read at the beginning of a file to identify its format
+MAGIC_LENGTH = 18
+
+# Secondary validators, indexed by the format name given by the magic number.
+# They are called as validator(format_type, head, stream, filename) and return
+# the (possibly refined) format together with the head, which they may extend
+# by reading further in the stream.
+VALIDATORS = {}
+
+# Signatures indexed by their first byte, longest signature first
+_MAGIC_INDEX = {}
+
+
+def register_magic(magic, format_type, validator=None):
+    """
+    Register the magic number (first bytes of the file) of a format
+
+    @param magic: string the file starts with
+    @param format_type: name of the format, key of FORMATS
+    @param validator: function refining the detection, see VALIDATORS
+    """
+    if (magic, format_type) not in MAGIC_NUMBERS:
+        MAGIC_NUMBERS.append((magic, format_type))
+    bucket = _MAGIC_INDEX.setdefault(magic[:1], [])
+    if (magic, format_type) not in bucket:
+        bucket.append((magic, format_type))
+        # stable sort: the longest (most specific) signature is tried first
+        bucket.sort(key=lambda entry:-len(entry[0]))
+    if validator is not None:
+        VALIDATORS[format_type] = validator
+
+
+def _match_magic(byts):
+    """ Format given by the longest signature matching the first bytes """
+    for magic, format_type in _MAGIC_INDEX.get(byts[:1], ()):
+        if byts.startswith(magic):
             return format_type
-        if 0: # debugging - bruker needed 18 bytes below
-            logger.debug("m: %s f: %s", magic, format_type)
-            logger.debug("bytes: %s len(bytes) %s", magic, len(magic))
-            logger.debug("found: %s", byts.find(magic))
-            for i in range(len(magic)):
-                logger.debug("%s %s %s %s ", ord(magic[i]), ord(byts[i]), magic[i], byts[i])
     raise Exception("Could not interpret magic string")
 
 
+def detect_format(byts, stream=None, filename=None):
+    """
+    Identify the format of a file from its first bytes
+
+    @param byts: first bytes of the file
+    @param stream: file object positioned after byts, used by the validators
+    @param filename: name of the file (optional)
+    @return: format name, bytes read from the beginning of the stream
+    """
+    format_type = _match_magic(byts)
+    validator = VALIDATORS.get(format_type)
+    if validator is not None:
+        format_type, byts = validator(format_type, byts, stream, filename)
+    return format_type, byts
+
+
+def do_magic(byts):
+    """ Try to interpret the bytes starting the file as a magic number """
+    return detect_format(byts)[0]
+
+
+def _read_more(head, stream, size):
+    """ Extend head up to size bytes by reading the stream """
+    if (stream is not None) and (len(head) < size):
+        head += stream.read(size - len(head))
+    return head
+
+
+# Bytes to read for validating TIFF files: MarCCD headers start at 1024 and
+# Pilatus headers are within the first 4096 bytes
+TIFF_PROBE = 4096
+TAG_IMAGE_DESCRIPTION = 270
+TAG_SOFTWARE = 305
+TAG_MARCCD = 34710
+
+def _tiff_tags(head):
+    """
+    Parse the first image file directory of a TIFF file
+
+    @param head: the first bytes of the TIFF file
+    @return: dict tag -> value, ASCII values are only provided when they are in head
+    """
+    endian = {"II": "<", "MM": ">"}[head[:2]]
+    offset = struct.unpack(endian + "I", head[4:8])[0]
+    tags = {}
+    if offset + 2 > len(head):
+        return tags
+    nentries = struct.unpack(endian + "H", head[offset:offset + 2])[0]
+    for i in range(nentries):
+        entry = head[offset + 2 + 12 * i: offset + 14 + 12 * i]
+        if len(entry) < 12:
+            break
+        tag, tag_type, count, value = struct.unpack(endian + "HHII", entry)
+        if tag_type == 2: #ASCII
+            if count <= 4:
+                value = entry[8:8 + count]
+            elif value + count <= len(head):
+                value = head[value:value + count]
+            else:
+                value = None
+            if value is not None:
+                value = value.rstrip("\x00")
+        tags[tag] = value
+    return tags
+
+
+def _validate_tiff(format_type, head, stream, filename):
+    """
+    Tell Pilatus, MarCCD and plain TIFF files apart using the first IFD
+    (Software, ImageDescription and MarCCD private tags)
+    """
+    head = _read_more(head, stream, TIFF_PROBE)
+    try:
+        tags = _tiff_tags(head)
+    except Exception, error:
+        logger.debug("Unable to parse TIFF header: %s", error)
+        tags = {}
+    software = (tags.get(TAG_SOFTWARE) or "").lower()
+    description = tags.get(TAG_IMAGE_DESCRIPTION) or ""
+    if ("camserver" in software) or ("pilatus" in software) or description.startswith("# "):
+        return "pilatus", head
+    if (TAG_MARCCD in tags) or software.startswith("marccd") or (head[1028:1031] == "MMX"):
+        return "marccd", head
+    if (format_type == "marccd") and (filename is not None) and (filename.find("mccd") == -1):
+        # No specific tag: only the file name distinguishes mccd from regular tif
+        return "tif", head
+    return format_type, head
+
+for _magic, _format_type in MAGIC_NUMBERS[:]:
+    register_magic(_magic, _format_type)
+for _format_type in ("tif", "marccd", "pilatus"):
+    VALIDATORS[_format_type] = _validate_tiff
+
+
+def get_klass(filetype):
+    """
+    Retrieve the image class of a format, importing its module on first use
+
+    @param filetype: name of the format, like "edf" or "OXD"
+    @return: the class "<filetype>image" or None if the format is unknown
+    """
+    klass_name = filetype + "image"
+    if filetype in FORMATS:
+        module_name = "fabio." + FORMATS[filetype]
+        if module_name not in sys.modules:
+            logger.debug("Importing %s", module_name)
+            __import__(module_name)
+        module = sys.modules[module_name]
+    else:
+        # formats imported by the user but not registered
+        module = sys.modules.get("fabio." + klass_name, None)
+    if module is None:
+        return None
+    if not hasattr(module, klass_name):
+        raise Exception("Module %s has no image class" % module)
+    return getattr(module, klass_name)
+
+
 def openimage(filename, frame=None):
     """ Try to open an image """
     if isinstance(filename, FilenameObject):
@@ -94,7 +244,7 @@ def openimage(filename, frame=None):
             obj = _openimage(filename.tostring())
             logger.debug("Attempting to read frame %s from %s" % (frame,
                 filename.tostring()))
-            obj = obj.read(filename.tostring(), frame)
+            obj = _read(obj, filename.tostring(), frame)
         except Exception, ex:
             # multiframe file
             #logger.debug( "DEBUG: multiframe file, start # %d"%(
@@ -102,19 +252,33 @@ def openimage(filename, frame=None):
             logger.debug("Exception %s, trying name %s" % (ex, filename.stem))
             obj = _openimage(filename.stem)
             logger.debug("Reading frame %s from %s" % (filename.num, filename.stem))
-            obj.read(filename.stem, frame=filename.num)
+            _read(obj, filename.stem, filename.num)
     else:
         logger.debug("Attempting to open %s" % (filename))
         obj = _openimage(filename)
         logger.debug("Attempting to read frame %s from %s" % (frame, filename))
-        obj = obj.read(filename, frame)
+        obj = _read(obj, filename, frame)
     return obj
 
 
+def _read(obj, filename, frame=None):
+    """
+    Read the image with the object given by _openimage, closing the file
+    opened while sniffing if the class did not re-use it
+    """
+    try:
+        return obj.read(filename, frame)
+    finally:
+        obj._close_prefetched()
+
+
 def openheader(filename):
     """ return only the header"""
     obj = _openimage(filename)
-    obj.readheader(filename)
+    try:
+        obj.readheader(filename)
+    finally:
+        obj._close_prefetched()
     return obj
 
 
@@ -136,14 +300,13 @@ def _openimage(filename):
                     col_split = filename.split(":")
                     filename = ":".join(col_split[:-1])
 
+    stream = None
+    byts = ""
     try:
         imo = fabioimage()
-        byts = imo._open(filename).read(18)
-        filetype = do_magic(byts)
-        if filetype == "marccd" and filename.find("mccd") == -1:
-            # Cannot see a way around this. Need to find something
-            # to distinguish mccd from regular tif...
-            filetype = "tif"
+        stream = imo._open(filename)
+        byts = stream.read(MAGIC_LENGTH)
+        filetype, byts = detect_format(byts, stream, filename)
     except IOError, error:
         logger.error("%s: File probably does not exist", error)
         raise error
@@ -164,16 +327,13 @@ def _openimage(filename):
             import traceback
             traceback.print_exc()
             raise Exception("Fabio could not identify " + filename)
-    klass_name = "".join(filetype) + 'image'
-    module = sys.modules.get("fabio." + klass_name, None)
-    if module is not None:
-        if hasattr(module, klass_name):
-            klass = getattr(module, klass_name)
-        else:
-            raise Exception("Module %s has no image class" % module)
-    else:
-        raise Exception("Filetype not known %s %s" % (filename, klass_name))
+    klass = get_klass("".join(filetype))
+    if klass is None:
+        raise Exception("Filetype not known %s %s" % (filename, "".join(filetype) + "image"))
     obj = klass()
+    if stream is not None:
+        # the file is already opened (and possibly decompressed): re-use it
+        obj._prefetch(filename, stream, byts)
     # skip the read for read header
     return obj
 
@@ -18,7 +18,8 @@
 #
 # 5) Register the file type (extension naming) in fabioutils.FILETYPES
 #
-# 6) Add your new module as an import into fabio.openimage
+# 6) Register your new module in the FORMATS dictionary of fabio.openimage (it is
+#    imported on demand, the first time a file of this format is opened)
 #
 # 7) Fill out the magic numbers for your format in fabio.openimage if you know them
 #    (the characteristic first few bytes in the file)
@@ -4,7 +4,11 @@ Email:        jerome.kieffer@esrf.eu
 
 Cif Binary Files images are 2D images written by the Pilatus detector and others.
 They use a modified (simplified) byte-offset algorithm.  This file contains the 
-decompression function from a string to an int64 numpy array. 
+decompression function from a string (or any buffer, e.g. a memory-mapped
+file) to an int64 numpy array, a decoder fed with pieces of the stream (e.g.
+read from a file) and the compression function.
+The TY1 codec of Oxford Diffraction images, a modified byte-offset
+algorithm, is here as well.
 
 This is Cython: convert it to pure C then compile it with gcc
 $ cython byte_offset.pyx 
@@ -20,102 +24,608 @@ __copyright__ = "2010-2012, European Synchrotron Radiation Facility, Grenoble, F
 cimport numpy
 import numpy
 import cython
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from libc.string cimport memcpy, memset
+from libc.stdlib cimport malloc, realloc, free
+from cpython.bytes cimport PyBytes_FromStringAndSize, PyBytes_AS_STRING
 
-@cython.boundscheck(False)
-def analyseCython(bytes stream not None, size=None):
+ctypedef fused output_t:
+    numpy.int8_t
+    numpy.uint8_t
+    numpy.int16_t
+    numpy.uint16_t
+    numpy.int32_t
+    numpy.uint32_t
+    numpy.int64_t
+
+ctypedef fused input_t:
+    numpy.int8_t
+    numpy.uint8_t
+    numpy.int16_t
+    numpy.uint16_t
+    numpy.int32_t
+    numpy.uint32_t
+    numpy.int64_t
+    numpy.uint64_t
+
+# integer types compressCython reads without conversion
+INPUT_TYPES = [numpy.dtype(t) for t in (numpy.int8, numpy.uint8, numpy.int16, numpy.uint16,
+                                        numpy.int32, numpy.uint32, numpy.int64, numpy.uint64)]
+
+# limits of the integer types analyseCython can decode into
+LIMITS = dict((numpy.dtype(t), (numpy.iinfo(t).min, numpy.iinfo(t).max))
+              for t in (numpy.int8, numpy.uint8, numpy.int16, numpy.uint16,
+                        numpy.int32, numpy.uint32, numpy.int64))
+
+# size of the pieces read from files
+CHUNK = 1 << 20
+# minimum size of the compressed data decoded by a thread
+MIN_SEGMENT = 1 << 20
+
+
+def analyseCython(stream not None, size=None, dtype=None, out=None):
     """
     Analyze a stream of char with any length of exception (2,4, or 8 bytes integers)
-    @param stream: string representing the compressed data
+    @param stream: string or buffer (numpy.memmap, ...) of bytes representing the compressed data
     @param size: the size of the output array (of longInts)
-    @return : int64 ndArrays 
+    @param dtype: type of the output array, int64 by default
+    @param out: C-contiguous array to decode the data into (its size is the default size)
+    @return : ndArrays of dtype (out.dtype when out is provided), 1D
     """
+    decoder = ByteOffsetDecoder(len(stream) if (size is None and out is None) else size, dtype, out)
+    decoder.feed(stream, final=True)
+    return decoder.result()
+
+
+def analyseFile(infile, size=None, nbytes=None, dtype=None, out=None, chunk=CHUNK):
+    """
+    Decode a byte-offset stream read from a file, piece by piece: the whole
+    compressed data never need to be in memory.
+
+    @param infile: file-like object positioned at the start of the compressed data
+    @param size: the size of the output array
+    @param nbytes: size of the compressed data (read until the end of the file by default)
+    @param dtype: type of the output array, int64 by default
+    @param out: C-contiguous array to decode the data into (its size is the default size)
+    @param chunk: number of bytes read at once
+    @return : ndArrays of dtype (out.dtype when out is provided), 1D
+    """
+    if size is None and out is None:
+        raise ValueError("Either the size or the output array is needed")
+    decoder = ByteOffsetDecoder(size, dtype, out)
+    while not decoder.full:
+        if nbytes is None:
+            piece = infile.read(chunk)
+        else:
+            piece = infile.read(min(chunk, nbytes))
+            nbytes -= len(piece)
+        if not piece:
+            break
+        decoder.feed(piece, final=(nbytes == 0))
+    decoder.feed("", final=True)
+    return decoder.result()
+
+
+def analyseParallel(stream not None, size=None, dtype=None, out=None, nthreads=None):
+    """
+    Analyze a stream of char with any length of exception, in parallel:
+    the stream is cut into segments starting on a value, the number of
+    values and the sum of the deltas of each segment are computed in
+    parallel, then each segment is decoded in parallel from its first value.
+    Results are identical to analyseCython.
+
+    @param stream: string or buffer (numpy.memmap, ...) of bytes representing the compressed data
+    @param size: the size of the output array (of longInts)
+    @param dtype: type of the output array, int64 by default
+    @param out: C-contiguous array to decode the data into (its size is the default size)
+    @param nthreads: number of threads (number of cores by default)
+    @return : ndArrays of dtype (out.dtype when out is provided), 1D
+    """
+    if nthreads is None:
+        nthreads = multiprocessing.cpu_count()
+    lenStream = len(stream)
+    nseg = min(nthreads, lenStream // MIN_SEGMENT)
+    if nseg < 2:
+        return analyseCython(stream, size, dtype, out)
+    decoder = ByteOffsetDecoder(lenStream if (size is None and out is None) else size, dtype, out)
+    bounds = [0]
+    for k in range(1, nseg):
+        boundary = _boundary(stream, max(k * lenStream // nseg, bounds[-1] + 1), lenStream)
+        if boundary < lenStream:
+            bounds.append(boundary)
+    bounds.append(lenStream)
+    segments = range(len(bounds) - 1)
+    pool = ThreadPool(min(nthreads, len(segments)))
+    try:
+        scans = pool.map(lambda k: _scan(stream, bounds[k], bounds[k + 1]), segments)
+        # prefix sums: index of the first value and value preceding each segment
+        first = [0]
+        last = [0]
+        for count, total in scans:
+            first.append(first[-1] + count)
+            last.append(last[-1] + total)
+        results = pool.map(lambda k: _analyse(stream, decoder.buffer, first[k], min(first[k + 1], decoder.size),
+                                              decoder.vmin, decoder.vmax, last[k], True,
+                                              bounds[k], bounds[k + 1]), segments)
+    finally:
+        pool.close()
+    for k, (consumed, nvalues, lastValue, overflow) in enumerate(results):
+        if overflow:
+            raise OverflowError("Value #%i of the byte-offset stream does not fit into %s" % (nvalues, decoder.out.dtype))
+        if nvalues < first[k + 1]:
+            # stopped by the size of the output
+            decoder.nvalues = nvalues
+            break
+        decoder.nvalues = nvalues
+    if decoder.buffer is not decoder.out:
+        decoder.out[:decoder.nvalues] = decoder.buffer[:decoder.nvalues]
+    return decoder.result()
+
+
+class ByteOffsetDecoder(object):
+    """
+    Resumable byte-offset decoder: the stream is fed in pieces of any size,
+    an exception cut by the end of a piece is kept until the next one.
+
+    decoder = ByteOffsetDecoder(size)
+    for piece in pieces:
+        decoder.feed(piece)
+    data = decoder.feed("", final=True).result()
+    """
+    def __init__(self, size=None, dtype=None, out=None):
+        """
+        @param size: the size of the output array
+        @param dtype: type of the output array, int64 by default
+        @param out: C-contiguous array to decode the data into (its size is the default size)
+        """
+        if out is not None:
+            if not out.flags.c_contiguous:
+                raise ValueError("Output array must be C-contiguous")
+            self.out = out.reshape(-1)
+            if size is None:
+                size = self.out.size
+            elif size > self.out.size:
+                raise ValueError("Output array is too small: %s < %s" % (self.out.size, size))
+        else:
+            if size is None:
+                raise ValueError("Either the size or the output array is needed")
+            self.out = numpy.zeros(size, dtype=numpy.int64 if dtype is None else dtype)
+        self.size = size
+        if self.out.dtype in LIMITS:
+            self.buffer = self.out
+        else:
+            # other types (floats, ...): decode in int64 then convert
+            self.buffer = numpy.zeros(size, dtype=numpy.int64)
+        self.vmin, self.vmax = LIMITS[self.buffer.dtype]
+        self.nvalues = 0    # number of values decoded so far
+        self.last = 0       # last value decoded
+        self.pending = ""   # beginning of an exception cut by the end of the previous piece
+
+    @property
+    def full(self):
+        """ True when all the values have been decoded """
+        return self.nvalues >= self.size
+
+    def feed(self, piece, final=False):
+        """
+        Decode the next piece of the stream
+
+        @param piece: string with the next bytes of the compressed data (any buffer of bytes for a single final piece)
+        @param final: True for the last piece: an exception cut by the end of the stream is completed with zeros
+        @return: the decoder itself
+        """
+        if self.pending:
+            piece = self.pending + piece
+        start = self.nvalues
+        consumed, self.nvalues, self.last, overflow = _analyse(piece, self.buffer, self.nvalues,
+                                                               self.size, self.vmin, self.vmax,
+                                                               self.last, final)
+        if overflow:
+            raise OverflowError("Value #%i of the byte-offset stream does not fit into %s" % (self.nvalues, self.out.dtype))
+        if self.full or final:
+            self.pending = ""
+        else:
+            self.pending = piece[consumed:]
+        if self.buffer is not self.out:
+            self.out[start:self.nvalues] = self.buffer[start:self.nvalues]
+        return self
+
+    def result(self):
+        """
+        @return: the values decoded so far, 1D view on the output array
+        """
+        return self.out[:self.nvalues]
 
-    cdef int                i = 0
-    cdef int                j = 0
+
+def compressCython(data not None):
+    """
+    Compress a dataset into a string using the byte_offet algorithm:
+    the size of the result is computed in a first pass, the string is
+    filled in a second one.
+
+    @param data: ndarray of integers (other types are converted to int64)
+    @return: string/bytes with compressed data, as compression.compByteOffet_numpy
+    """
+    data = numpy.ascontiguousarray(data).ravel()
+    if data.dtype not in INPUT_TYPES:
+        data = data.astype(numpy.int64)
+    return _compress(data)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _compress(input_t[::1] data):
+    """
+    Byte-offset compression of a contiguous array of integers
+    """
+    cdef Py_ssize_t         i
+    cdef Py_ssize_t         size = data.shape[0]
+    cdef Py_ssize_t         length = 0
     cdef long long          last = 0
+    cdef long long          current
+    cdef long long          delta
+    cdef unsigned char *    cstream
+    with nogil:
+        for i in range(size):
+            current = < long long > data[i]
+            # differences wrap around as in numpy
+            delta = < long long > (< unsigned long long > current - < unsigned long long > last)
+            length += _encodedSize(delta)
+            last = current
+    result = PyBytes_FromStringAndSize(NULL, length)
+    cstream = < unsigned char *> PyBytes_AS_STRING(result)
+    last = 0
+    length = 0
+    with nogil:
+        for i in range(size):
+            current = < long long > data[i]
+            delta = < long long > (< unsigned long long > current - < unsigned long long > last)
+            length += _encode(cstream + length, delta)
+            last = current
+    return result
+
+
+cdef inline int _encodedSize(long long delta) nogil:
+    """
+    Number of bytes needed to store delta: 1, 3, 7 or 15
+    """
+    if (delta >= -127) and (delta <= 127):
+        return 1
+    elif (delta >= -32767) and (delta <= 32767):
+        return 3
+    elif (delta >= -2147483647) and (delta <= 2147483647):
+        return 7
+    return 15
+
+
+cdef inline int _encode(unsigned char * cstream, long long delta) nogil:
+    """
+    Write delta at cstream, with its markers, in little endian
+
+    @return: number of bytes written
+    """
+    cdef int width = _encodedSize(delta)
+    cdef int k
+    cdef unsigned long long value = < unsigned long long > delta
+    if width == 1:
+        cstream[0] = < unsigned char > (value & 0xff)
+        return 1
+    # markers: 0x80, then 0x0080 and 0x00000080 for larger values
+    cstream[0] = 0x80
+    if width > 3:
+        cstream[1] = 0x00
+        cstream[2] = 0x80
+    if width > 7:
+        cstream[3] = 0x00
+        cstream[4] = 0x00
+        cstream[5] = 0x00
+        cstream[6] = 0x80
+    for k in range(width // 2, width):
+        cstream[k] = < unsigned char > (value & 0xff)
+        value >>= 8
+    return width
+
+
+cdef inline int _width(const unsigned char * cstream) nogil:
+    """
+    Size of the exception starting at cstream: 3, 7 or 15 bytes
+    """
+    if (cstream[1] == 0x00) and (cstream[2] == 0x80):
+        if (cstream[3] == 0x00) and (cstream[4] == 0x00) and (cstream[5] == 0x00) and (cstream[6] == 0x80):
+            return 15
+        return 7
+    return 3
+
+
+cdef inline long long _exception(const unsigned char * cstream, int width) nogil:
+    """
+    Value of the exception starting at cstream, stored in little endian after the markers
+    """
+    cdef long long value
+    cdef int k
+    # the value starts at width // 2, its most significant byte is signed
+    value = < signed char > cstream[width - 1]
+    for k in range(width - 2, width // 2 - 1, -1):
+        value = (value << 8) | cstream[k]
+    return value
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _analyse(const unsigned char[::1] stream, output_t[::1] dataOut, Py_ssize_t start, Py_ssize_t csize,
+             long long vmin, long long vmax, long long last, bint final,
+             Py_ssize_t begin=0, Py_ssize_t end=-1):
+    """
+    Decode the stream[begin:end] into dataOut[start:csize], checking that values lie in [vmin, vmax]
+
+    @param last: value preceding the stream
+    @param final: if False, stop before an exception cut by the end of the stream
+    @return: number of bytes consumed, number of values in dataOut, last value,
+             1 if the decoding stopped on an overflow else 0
+    """
+    cdef Py_ssize_t         i = begin
+    cdef Py_ssize_t         j = start
+    cdef Py_ssize_t         avail
     cdef long long          current = 0
-    cdef char               tmp8 = 0
-
-    cdef unsigned char      utmp8a = 0
-    cdef unsigned char      utmp8b = 0
-    cdef unsigned char      utmp8c = 0
-    cdef unsigned char      utmp8d = 0
-    cdef unsigned char      utmp8e = 0
-    cdef unsigned char      utmp8f = 0
-    cdef unsigned char      utmp8g = 0
-
-    cdef long long          tmp64 = 0
-    cdef long long          tmp64a = 0
-    cdef long long          tmp64b = 0
-    cdef long long          tmp64c = 0
-    cdef long long          tmp64d = 0
-    cdef long long          tmp64e = 0
-    cdef long long          tmp64f = 0
-    cdef long long          tmp64g = 0
-
-    cdef char               key8 = 0x80
-    cdef char               key0 = 0x00
-
-    cdef int csize
-    cdef int lenStream = < int > len(stream)
-    cdef char * cstream = stream
-    if size is None:
-        csize = lenStream
-    else:
-        csize = < int > size
-    cdef numpy.ndarray[ long long  , ndim = 1] dataOut = numpy.zeros(csize, dtype=numpy.int64)
+    cdef int                width
+    cdef int                overflow = 0
+    cdef unsigned char      padded[16]
+    cdef Py_ssize_t lenStream = stream.shape[0] if end < 0 else end
+    cdef const unsigned char * cstream = &stream[0] if stream.shape[0] else NULL
     with nogil:
         while (i < lenStream) and (j < csize):
-            if (cstream[i] == key8):
-                if ((cstream[i + 1] == key0) and (cstream[i + 2] == key8)):
-                    if (cstream[i + 3] == key0) and (cstream[i + 4] == key0) and (cstream[i + 5] == key0) and (cstream[i + 6] == key8):
-                        #Retrieve the interesting Bytes of data
-                        tmp8 = cstream[i + 14]
-                        utmp8a = cstream[i + 13]
-                        utmp8b = cstream[i + 12]
-                        utmp8c = cstream[i + 11]
-                        utmp8d = cstream[i + 10]
-                        utmp8e = cstream[i + 9]
-                        utmp8f = cstream[i + 8]
-                        utmp8g = cstream[i + 7]
-                        # cast them  in 64 bit
-                        tmp64 = tmp8
-                        tmp64a = utmp8a
-                        tmp64b = utmp8b
-                        tmp64c = utmp8c
-                        tmp64d = utmp8d
-                        tmp64e = utmp8e
-                        tmp64f = utmp8f
-                        tmp64g = utmp8g
-                        current = (tmp64 << 56) | (tmp64a << 48) | (tmp64b << 40) | (tmp64c << 32) | (tmp64d << 24) | (tmp64e << 16) | (tmp64f << 8) | (tmp64g)
-                        i += 15
-                    else:
-                        #Retrieve the interesting Bytes of data
-                        tmp8 = cstream[i + 6]
-                        utmp8a = cstream[i + 5]
-                        utmp8b = cstream[i + 4]
-                        utmp8c = cstream[i + 3]
-                        # cast them  in 64 bit
-                        tmp64 = tmp8
-                        tmp64a = utmp8a
-                        tmp64b = utmp8b
-                        tmp64c = utmp8c
-                        #Assemble data into a long long
-                        current = (tmp64 << 24) | (tmp64a << 16) | (tmp64b << 8) | (tmp64c);
-                        i += 7
+            if (cstream[i] == 0x80):
+                avail = lenStream - i
+                if avail >= 15:
+                    width = _width(cstream + i)
+                    current = _exception(cstream + i, width)
                 else:
-                    tmp8 = cstream[i + 2];
-                    utmp8a = cstream[i + 1]
-                    # cast them  in 64 bit
-                    tmp64 = tmp8
-                    tmp64a = utmp8a
-                    current = (tmp64 << 8) | (tmp64a);
-                    i += 3
+                    # close to the end of the stream: missing bytes read as zeros
+                    memset(padded, 0, 16)
+                    memcpy(padded, cstream + i, avail)
+                    width = _width(padded)
+                    if (width > avail) and not final:
+                        break
+                    current = _exception(padded, width)
+                i += width
             else:
-                tmp8 = cstream[i]
-                current = tmp8
+                current = < signed char > cstream[i]
                 i += 1
+            if (last + current < vmin) or (last + current > vmax):
+                overflow = 1
+                break
             last += current
-            dataOut[j] = last
+            dataOut[j] = < output_t > last
             j += 1
-    return dataOut[:j]
+    return min(i, lenStream) - begin, j, last, overflow
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _scan(const unsigned char[::1] stream, Py_ssize_t begin, Py_ssize_t end):
+    """
+    Count the values of stream[begin:end] and sum their deltas, without storing them
+
+    @return: number of values, sum of the deltas
+    """
+    cdef Py_ssize_t         i = begin
+    cdef Py_ssize_t         count = 0
+    cdef Py_ssize_t         avail
+    cdef long long          total = 0
+    cdef int                width
+    cdef unsigned char      padded[16]
+    cdef const unsigned char * cstream = &stream[0] if stream.shape[0] else NULL
+    with nogil:
+        while i < end:
+            if (cstream[i] == 0x80):
+                avail = end - i
+                if avail >= 15:
+                    width = _width(cstream + i)
+                    total += _exception(cstream + i, width)
+                else:
+                    memset(padded, 0, 16)
+                    memcpy(padded, cstream + i, avail)
+                    width = _width(padded)
+                    total += _exception(padded, width)
+                i += width
+            else:
+                total += < signed char > cstream[i]
+                i += 1
+            count += 1
+    return count, total
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _boundary(const unsigned char[::1] stream, Py_ssize_t start, Py_ssize_t end):
+    """
+    First position after start where a value begins for sure: an exception
+    is 15 bytes at most, a position with no 0x80 in the 14 bytes before
+    cannot be inside an exception.
+
+    @return: position in [start, end], end if none was found
+    """
+    cdef Py_ssize_t         i
+    cdef Py_ssize_t         free = 0  # number of bytes since the last 0x80
+    cdef const unsigned char * cstream = &stream[0] if stream.shape[0] else NULL
+    with nogil:
+        i = max(start - 14, 0)
+        while i < end:
+            if (free >= 14) and (i >= start):
+                break
+            if cstream[i] == 0x80:
+                free = 0
+            else:
+                free += 1
+            i += 1
+    return min(i, end)
+
+
+def analyseTY1(raw_8 not None, raw_16=None, raw_32=None):
+    """
+    Modified byte offset decompressor used in Oxford Diffraction images (TY1).
+    raw_8 is decoded in one pass into int32, overflow values being taken in
+    order from raw_16/raw_32; the pass is done again into int64 when values
+    do not fit. When the range of the data fits in int8/int16, the result
+    is converted afterwards: an extra pass, cheaper than a first pass
+    computing the range (the decoding loop costs as much as the range scan).
+
+    @param raw_8:  strings containing raw data with integer 8 bits
+    @param raw_16: strings containing raw data with integer 16 bits
+    @param raw_32: strings containing raw data with integer 32 bits
+    @return: 1D ndarray with the smallest signed integer type holding the data, as compression.decTY1
+    """
+    use16 = raw_16 is not None
+    use32 = bool(raw_32)
+    for dtype in (numpy.int32, numpy.int64):
+        data = numpy.empty(len(raw_8), dtype=dtype)
+        overflow, vmin, vmax = _analyseTY1(raw_8, raw_16 if use16 else b"", raw_32 if use32 else b"",
+                                           data, LIMITS[data.dtype][0], LIMITS[data.dtype][1], use16, use32)
+        if overflow <= 0:
+            break
+    if overflow < 0:
+        raise ValueError("TY1 stream: overflow value #%i is missing" % (-overflow))
+    for dtype in (numpy.int8, numpy.int16):
+        if (vmin >= LIMITS[numpy.dtype(dtype)][0]) and (vmax <= LIMITS[numpy.dtype(dtype)][1]):
+            return data.astype(dtype)
+    return data
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _analyseTY1(const unsigned char[::1] raw8, const unsigned char[::1] raw16, const unsigned char[::1] raw32,
+                output_t[::1] dataOut, long long vmin, long long vmax, bint use16, bint use32):
+    """
+    Decode a TY1 stream into dataOut, checking that values lie in [vmin, vmax]
+
+    @return: 1 if a value does not fit, -(number of the exception) if an overflow value is missing, else 0,
+             followed by the minimum and the maximum of the data
+    """
+    cdef Py_ssize_t         i
+    cdef Py_ssize_t         size = raw8.shape[0]
+    cdef Py_ssize_t         i16 = 0
+    cdef Py_ssize_t         i32 = 0
+    cdef Py_ssize_t         n16 = raw16.shape[0] // 2
+    cdef Py_ssize_t         n32 = raw32.shape[0] // 4
+    cdef long long          last = 0
+    cdef long long          delta
+    cdef long long          dmin = 0
+    cdef long long          dmax = 0
+    cdef numpy.int16_t      value16
+    cdef numpy.int32_t      value32
+    cdef int                status = 0
+    with nogil:
+        for i in range(size):
+            delta = < long long > raw8[i] - 127
+            if (delta == 127) and use16:
+                if i16 >= n16:
+                    status = -(i16 + i32 + 1)
+                    break
+                memcpy(&value16, &raw16[2 * i16], 2)
+                delta = value16
+                i16 += 1
+            elif (delta == 128) and use32:
+                if i32 >= n32:
+                    status = -(i16 + i32 + 1)
+                    break
+                memcpy(&value32, &raw32[4 * i32], 4)
+                delta = value32
+                i32 += 1
+            last += delta
+            if (last < vmin) or (last > vmax):
+                status = 1
+                break
+            dataOut[i] = < output_t > last
+            if i == 0:
+                dmin = dmax = last
+            elif last < dmin:
+                dmin = last
+            elif last > dmax:
+                dmax = last
+    return status, dmin, dmax
+
+
+def compressTY1(data not None):
+    """
+    Modified byte offset compressor used in Oxford Diffraction images (TY1),
+    in a single pass: 8 bits deltas are written in place, overflow values
+    are appended to growing buffers.
+
+    @param data: ndarray of integers (other types are converted to int64)
+    @return: 3-tuple of strings: raw_8, raw_16, raw_32 as compression.compTY1
+    """
+    data = numpy.ascontiguousarray(data).ravel()
+    if data.dtype not in INPUT_TYPES:
+        data = data.astype(numpy.int64)
+    return _compressTY1(data)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _compressTY1(input_t[::1] data):
+    """
+    TY1 compression of a contiguous array of integers
+    """
+    cdef Py_ssize_t         i
+    cdef Py_ssize_t         size = data.shape[0]
+    cdef Py_ssize_t         n16 = 0
+    cdef Py_ssize_t         n32 = 0
+    cdef Py_ssize_t         max16 = 1024
+    cdef Py_ssize_t         max32 = 1024
+    cdef long long          last = 0
+    cdef long long          current
+    cdef long long          delta
+    cdef numpy.int16_t      value16
+    cdef numpy.int32_t      value32
+    cdef unsigned char *    c8
+    cdef unsigned char *    c16 = < unsigned char *> malloc(2 * max16)
+    cdef unsigned char *    c32 = < unsigned char *> malloc(4 * max32)
+    cdef unsigned char *    grown
+    cdef int                failed = 0
+    if (c16 == NULL) or (c32 == NULL):
+        free(c16)
+        free(c32)
+        raise MemoryError("Unable to allocate the overflow buffers")
+    raw_8 = PyBytes_FromStringAndSize(NULL, size)
+    c8 = < unsigned char *> PyBytes_AS_STRING(raw_8)
+    with nogil:
+        for i in range(size):
+            current = < long long > data[i]
+            delta = < long long > (< unsigned long long > current - < unsigned long long > last)
+            last = current
+            if (delta > 32767) or (delta < -32767):
+                if n32 == max32:
+                    grown = < unsigned char *> realloc(c32, 8 * max32)
+                    if grown == NULL:
+                        failed = 1
+                        break
+                    c32 = grown
+                    max32 *= 2
+                value32 = < numpy.int32_t > delta
+                memcpy(c32 + 4 * n32, &value32, 4)
+                n32 += 1
+                c8[i] = 255
+            elif (delta >= 127) or (delta <= -127):
+                if n16 == max16:
+                    grown = < unsigned char *> realloc(c16, 4 * max16)
+                    if grown == NULL:
+                        failed = 1
+                        break
+                    c16 = grown
+                    max16 *= 2
+                value16 = < numpy.int16_t > delta
+                memcpy(c16 + 2 * n16, &value16, 2)
+                n16 += 1
+                c8[i] = 254
+            else:
+                c8[i] = < unsigned char > (delta + 127)
+    try:
+        if failed:
+            raise MemoryError("Unable to grow the overflow buffers")
+        raw_16 = PyBytes_FromStringAndSize(< char *> c16, 2 * n16)
+        raw_32 = PyBytes_FromStringAndSize(< char *> c32, 4 * n32)
+    finally:
+        free(c16)
+        free(c32)
+    return raw_8, raw_16, raw_32
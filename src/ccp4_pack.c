@@ -95,6 +95,15 @@
    used by the buffered io-routines given in <stdio.h>, but it could be
    anything. */
 
+/* Growing memory buffer in which an image is packed by
+   pack_wordimage_string() */
+typedef struct {
+  char *buffer;     /* start of the packed image */
+  char *buffree;    /* current byte */
+  int bitmark;      /* current bit in the current byte */
+  size_t allocated; /* size of the buffer */
+} ccp4_pack_buffer;
+
 #define DIFFBUFSIZ 16384L
 /* Size of the internal buffer in which the differences between neighbouring
    pixels are stored prior to compression. The image is therefore compressed
@@ -888,20 +897,22 @@ void pack_chunk(int32_t *lng,
     buffer = NULL;}}
 
 
-/* Pack image 'img', containing 'x * y' WORD-sized pixels into 'filename'. */
-void pack_wordimage_copen(short int *img,
+/* Chooses the size of the chunks of the DIFFBUFSIZ differences of 'img'
+   starting at 'done' and hands them over to 'pack' (either pack_chunk or
+   pack_chunk_string) with its context 'ctx'. Returns the index of the next
+   pixel to be differenced or -1 if 'pack' failed. */
+static int pack_wordimage_diffs(short int *img,
 		int x,
 		int y,
-		FILE *packfile){
+		int32_t done,
+		int (*pack)(int32_t *, int, int, void *),
+		void *ctx){
 	int chunksiz, packsiz, nbits, next_nbits, tot_nbits;
 	  int32_t buffer[DIFFBUFSIZ];
 	  int32_t *diffs = buffer;
-	  int32_t *end = diffs - 1;
-	  int32_t done = 0;
+	  int32_t *end;
 
-	  fprintf(packfile, PACKIDENTIFIER, x, y);
-	  while (done < (x * y))
-	  { end = diff_words(img, x, y, buffer, done);
+	  end = diff_words(img, x, y, buffer, done);
 		done += (end - buffer) + 1;
 		diffs = buffer;
 		while (diffs <= end)
@@ -922,9 +933,89 @@ void pack_wordimage_copen(short int *img,
 				  packsiz = 128;
 				else
 				  chunksiz *= 2;}}}
-		   pack_chunk(diffs, packsiz, nbits / packsiz, packfile);
-		   diffs += packsiz;}}
-		pack_chunk(NULL, 0, 0, packfile);
+		   if (pack(diffs, packsiz, nbits / packsiz, ctx))
+		     return -1;
+		   diffs += packsiz;}
+	  return done;
+}
+
+static int pack_chunk_file(int32_t *lng, int nmbr, int bitsize, void *packfile){
+  pack_chunk(lng, nmbr, bitsize, (FILE *) packfile);
+  return 0;
+}
+
+/* Pack image 'img', containing 'x * y' WORD-sized pixels into 'filename'. */
+void pack_wordimage_copen(short int *img,
+		int x,
+		int y,
+		FILE *packfile){
+	  int32_t done = 0;
+
+	  fprintf(packfile, PACKIDENTIFIER, x, y);
+	  while (done < (x * y))
+	    done = pack_wordimage_diffs(img, x, y, done, pack_chunk_file, packfile);
+	  pack_chunk(NULL, 0, 0, packfile);
+}
+
+/* Same as pack_chunk, but the packed array is stored in the growing memory
+   buffer 'pb' instead of being flushed to a file. All the state lives in
+   'pb' so that several images can be packed at the same time by different
+   threads. Returns 0 on success or -1 if the buffer could not be enlarged. */
+static int pack_chunk_string(int32_t *lng,
+		int nmbr,
+		int bitsize,
+		void *ctx){
+  static const int32_t bitsize_encode[33] = {0, 0, 0, 0, 1, 2, 3, 4, 5, 0, 0,
+                                    0, 0, 0, 0, 0, 6, 0, 0, 0, 0, 0,
+                                    0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 7};
+  ccp4_pack_buffer *pb = (ccp4_pack_buffer *) ctx;
+  int32_t descriptor[2], i, j;
+  size_t used = pb->buffree - pb->buffer;
+  char *grown;
+
+  for (i = nmbr, j = 0; i > 1; i /= 2, ++j);
+  descriptor[0] = j;
+  descriptor[1] = bitsize_encode[bitsize];
+  if (used > (pb->allocated - (130 * 4)))
+  { grown = (char *) realloc(pb->buffer, 2 * pb->allocated);
+    if (grown == NULL)
+      return -1;
+    pb->buffer = grown;
+    pb->buffree = grown + used;
+    pb->allocated *= 2;}
+  pack_longs(descriptor, 2, &pb->buffree, &pb->bitmark, 3);
+  pack_longs(lng, nmbr, &pb->buffree, &pb->bitmark, bitsize);
+  return 0;
+}
+
+/* Pack image 'img', containing 'x * y' WORD-sized pixels into a newly
+   allocated buffer, starting with the PACKIDENTIFIER line, exactly as
+   pack_wordimage_c would append it to a file. The size of the packed image
+   is stored in 'length'; the buffer is to be released with free(). Returns
+   NULL if memory could not be allocated. Does not use any global state. */
+char *pack_wordimage_string(short int *img,
+		int x,
+		int y,
+		size_t *length){
+  ccp4_pack_buffer pb;
+  int32_t done = 0;
+  int len;
+
+  /* a few bits per pixel for usual images: start with one byte per pixel */
+  pb.allocated = max((size_t) x * y, PACKBUFSIZ);
+  pb.buffer = (char *) malloc(pb.allocated);
+  if (pb.buffer == NULL)
+    return NULL;
+  len = sprintf(pb.buffer, PACKIDENTIFIER, x, y);
+  pb.buffree = pb.buffer + len;
+  pb.bitmark = 0;
+  while (done < (x * y))
+  { done = pack_wordimage_diffs(img, x, y, done, pack_chunk_string, &pb);
+    if (done < 0)
+    { free(pb.buffer);
+      return NULL;}}
+  *length = (pb.buffree - pb.buffer) + (pb.bitmark != 0);
+  return pb.buffer;
 }
 
 
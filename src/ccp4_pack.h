@@ -59,3 +59,4 @@ void *ccp4_unpack_string(void *unpacked_array, void *packed, size_t dim1, size_t
 void *ccp4_unpack_v2_string(void *unpacked_array, void *packed, size_t dim1, size_t dim2, size_t max_num_int);
 
 void pack_wordimage_c(short int *img, int x, int y, char *filename);
+char *pack_wordimage_string(short int *img, int x, int y, size_t *length);
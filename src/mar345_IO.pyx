@@ -5,8 +5,8 @@ Compressor & decompressor for "pack" algorithm by JPA, binding to CCP4 libraries
 
 Warning: decompressor is just a cython porting of mar345_io, but in cython so (soon) python3 compliant.
 
-Future: make those algorithm actually generate strings not go via files;
-        it will allow a broader use of the algorithm.
+The compressor packs the image in memory (no temporary file) and releases
+the GIL, so that several frames can be compressed by concurrent threads.
 
 """
 
@@ -18,13 +18,15 @@ __copyright__ = "2012, European Synchrotron Radiation Facility, Grenoble, France
 import cython
 cimport numpy
 import numpy
-import os,tempfile
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from libc.string cimport memcpy
-#from libc.stdlib cimport free, malloc
+from libc.stdlib cimport free
 
 cdef extern from "ccp4_pack.h":
     void* mar345_read_data_string(char *instream, int ocount, int dim1, int dim2) nogil
     void pack_wordimage_c(short int*, int , int , char*) nogil
+    char* pack_wordimage_string(short int*, int, int, size_t*) nogil
     void* ccp4_unpack_string   (void *, void *, size_t, size_t, size_t) nogil
     void* ccp4_unpack_v2_string(void *, void *, size_t, size_t, size_t) nogil
 
@@ -32,35 +34,93 @@ cdef extern from "ccp4_pack.h":
 @cython.boundscheck(False)
 def compress_pck(numpy.ndarray inputArray not None):
     """
+    Pack a 2D image with the CCP4 "pack" algorithm (version 1).
+    The packing is done in memory, without holding the GIL.
+
     @param inputArray: numpy array as input
-    @param filename: file to write data to
+    @return: packed image, starting with the "CCP4 packed image" line
     """
-    cdef long  size = inputArray.size
-    cdef int dim0, dim1, i, j, fd, ret
-    cdef char* name
+    cdef int dim0, dim1
+    cdef size_t length = 0
+    cdef char* packed
     assert inputArray.ndim == 2, "shape is 2D"
     dim0 = inputArray.shape[0]
     dim1 = inputArray.shape[1]
     cdef numpy.ndarray[numpy.uint16_t, ndim = 1] data = numpy.ascontiguousarray(inputArray.astype(numpy.uint16).ravel(), dtype=numpy.uint16)
     cdef short int * cdata
     cdata = < short int *> data.data
-    (fd,fname) = tempfile.mkstemp()
-    name = <char*>  fname
     with nogil:
-        pack_wordimage_c(cdata, dim1, dim0, name)
-    with open(name,"rb") as f:
-        f.seek(0)
-        output = f.read()
-    os.close(fd)
-    os.remove(name)
+        packed = pack_wordimage_string(cdata, dim1, dim0, &length)
+    if packed == NULL:
+        raise MemoryError("Unable to allocate the buffer for the packed image")
+    try:
+        output = packed[:length]
+    finally:
+        free(packed)
     return output
 
+def compress_pck_frames(frames, nthreads=None):
+    """
+    Pack several 2D images in parallel, each thread packing one image
+    without holding the GIL.
+
+    @param frames: list of 2D numpy arrays (or 3D array)
+    @param nthreads: number of threads, by default the number of CPUs
+    @return: list of packed images, in the same order as frames
+    """
+    if nthreads is None:
+        nthreads = multiprocessing.cpu_count()
+    frames = list(frames)
+    if nthreads <= 1 or len(frames) <= 1:
+        return [compress_pck(frame) for frame in frames]
+    pool = ThreadPool(min(nthreads, len(frames)))
+    try:
+        return pool.map(compress_pck, frames, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+def _as_uint8(raw):
+    """
+    View of a buffer as a 1D array of bytes, without copy
+
+    @param raw: string or any object exposing the buffer interface (old or new style)
+    @return: numpy.ndarray of uint8
+    """
+    try:
+        return numpy.frombuffer(raw, dtype=numpy.uint8)
+    except (AttributeError, TypeError):
+        # new style buffer only (memoryview under python2)
+        return numpy.asarray(memoryview(raw)).view(numpy.uint8).ravel()
+
+def _pck_header(raw):
+    """
+    Text of a packed image up to (at least) the end of the CCP4 identifier
+    line: the string itself or the shortest prefix of other buffers (only
+    this part is copied).
+
+    @param raw: string or any object exposing the buffer interface
+    @return: string
+    """
+    if isinstance(raw, bytes):
+        return raw
+    view = _as_uint8(raw)
+    size = 8192
+    while True:
+        text = view[:size].tostring()
+        idx = text.find("CCP4 packed image")
+        if (idx >= 0 and idx + 64 <= len(text)) or size >= view.size:
+            return text
+        size *= 2
+
 @cython.boundscheck(False)
 def uncompress_pck(raw not None, dim1=None, dim2=None, overflowPix=None, version=None, normal_start=None):
     """
     Unpack a mar345 compressed image
 
-    @param raw: input string (bytes in python3)
+    @param raw: input string (bytes in python3) or any buffer (bytearray,
+                memoryview, mmap, numpy array...) holding the whole file,
+                read in place without copy
     @param dim1,dim2: optional parameters size
     @param overflowPix: optional parameters: number of overflowed pixels
     @param version: PCK version 1 or 2
@@ -69,24 +129,26 @@ def uncompress_pck(raw not None, dim1=None, dim2=None, overflowPix=None, version
     """
     cdef int cdimx, cdimy, chigh, cversion, orecords, normal_offset
     cdef numpy.ndarray[numpy.uint32_t, ndim = 2] data
-    cdef numpy.ndarray[numpy.uint32_t, ndim = 1] flat 
-    cdef numpy.ndarray[numpy.uint8_t, ndim = 1] instream
+    cdef numpy.ndarray[numpy.uint32_t, ndim = 1] flat
+    cdef const numpy.uint8_t[::1] instream
     cdef void* out
     end=None
     key1 = "CCP4 packed image, X: "
     key2 = "CCP4 packed image V2, X: "
+    buf = _as_uint8(raw)
+    text = _pck_header(raw)
 
     if (dim1 is None) or (dim2 is None) or (version not in [1,2]) or (version is None) or (normal_start is None):
-        start = raw.find(key2)
+        start = text.find(key2)
         key = key2
         cversion = 2
         if start == -1:
-            start = raw.find(key1)
+            start = text.find(key1)
             key = key1
             cversion = 1
         lenkey = len(key)
-        start = raw.index(key) + lenkey
-        sizes = raw[start:start + 13]
+        start = text.index(key) + lenkey
+        sizes = text[start:start + 13]
         cdimx = < int > int(sizes[:4])
         cdimy = < int > int(sizes[-4:])
         normal_offset = start + 13
@@ -102,9 +164,9 @@ def uncompress_pck(raw not None, dim1=None, dim2=None, overflowPix=None, version
     if cversion not in [1,2]:
         raise RuntimeError("Cannot determine the compression scheme for PCK compression (either version 1 or 2)") 
     if (overflowPix is None):
-        end = raw.find("END OF HEADER")
-        start = raw[:end].find("HIGH")
-        hiLine = raw[start:end]
+        end = text.find("END OF HEADER")
+        start = text[:end].find("HIGH")
+        hiLine = text[start:end]
         hiLine = hiLine.split("\n")[0]
         word = hiLine.split()
         if len(word) > 1:
@@ -118,20 +180,23 @@ def uncompress_pck(raw not None, dim1=None, dim2=None, overflowPix=None, version
     orecords = <int> (chigh/8.0+0.875)
     data = numpy.empty((cdimy, cdimx), dtype=numpy.uint32)
     flat = data.ravel() #flat view on the data
-    instream = numpy.fromstring(raw[normal_offset:].lstrip(),dtype=numpy.uint8)
+    stop = normal_offset - lenkey - 14
+    # skip the blanks ending the identifier line, as str.lstrip did
+    while normal_offset < buf.size and buf[normal_offset] in (9, 10, 11, 12, 13, 32):
+        normal_offset += 1
+    instream = buf[normal_offset:]
     with nogil:
         ################################################################################
         #      relay to whichever version of ccp4_unpack is appropriate
         ################################################################################
         if cversion == 1:
-            ccp4_unpack_string( &data[0,0], &instream[0], cdimx, cdimy,0);
+            ccp4_unpack_string( &data[0,0], <void*> &instream[0], cdimx, cdimy,0);
         else:# cversion == 2:
-            ccp4_unpack_v2_string( &data[0,0], &instream[0], cdimx, cdimy,0);
+            ccp4_unpack_v2_string( &data[0,0], <void*> &instream[0], cdimx, cdimy,0);
     ################################################################################
     # handle overflows
     ################################################################################
-    stop = normal_offset-lenkey-14
-    odata = numpy.fromstring(raw[stop-64*orecords: stop],dtype=numpy.int32)
+    odata = buf[stop - 64 * orecords: stop].view(numpy.int32)
     odata.shape = -1,2 
     addresses = odata[:,0]
     values = odata[:,1]
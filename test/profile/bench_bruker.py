@@ -0,0 +1,78 @@
+"""
+Benchmark of the Bruker readers: parsing of the overflow table of the format
+86 (former loop reading and parsing 16 bytes at a time against the
+vectorized parser) and parsing of a 15 blocks header (former line by line
+parser against the 80 column block parser).
+
+usage: python bench_bruker.py
+"""
+
+import timeit, os, StringIO
+import numpy
+from fabio.brukerimage import brukerimage
+
+NB = 5
+LOOPS = 20
+
+
+def old_overflow(infile, nov, data):
+    """ what brukerimage.read used to do with the overflow table """
+    for i in range(nov):
+        ovfl = infile.read(16)
+        intensity = int(ovfl[0: 9])
+        position = int(ovfl[9: 16])
+        data[position] = intensity
+    return data
+
+
+def new_overflow(infile, nov, data):
+    position, intensity = brukerimage._readoverflow(infile.read(16 * nov), nov)
+    data[position] = intensity
+    return data
+
+
+def old_header(headerstring, nhdrblks):
+    """ what brukerimage._readheader used to do on a string """
+    line = 80
+    header = {}
+    header_keys = []
+    for i in range(0, nhdrblks * 512, line):
+        if headerstring[i: i + line].find(":") > 0:
+            key, val = headerstring[i: i + line].split(":", 1)
+            key = key.strip()
+            val = val.strip()
+            if key in header:
+                header[key] = header[key] + os.linesep + val
+            else:
+                header[key] = val
+                header_keys.append(key)
+    return header
+
+
+def new_header(headerstring):
+    obj = brukerimage()
+    obj._parseheader(headerstring)
+    return obj.header
+
+if __name__ == "__main__":
+    print "%10s %10s %10s %10s" % ("overflows", "old (ms)", "new (ms)", "speed-up")
+    for nov in (100, 1000, 10000, 100000):
+        data = numpy.zeros(2048 * 2048, dtype=numpy.uint32)
+        pos = numpy.random.permutation(data.size)[:nov]
+        table = "".join("%09i%07i" % (v, p) for p, v in zip(pos, numpy.random.randint(65535, 10 ** 8, nov)))
+        assert (old_overflow(StringIO.StringIO(table), nov, data.copy()) == new_overflow(StringIO.StringIO(table), nov, data.copy())).all()
+        told = min(timeit.Timer(lambda: old_overflow(StringIO.StringIO(table), nov, data)).repeat(NB, 1)) * 1e3
+        tnew = min(timeit.Timer(lambda: new_overflow(StringIO.StringIO(table), nov, data)).repeat(NB, 1)) * 1e3
+        print "%10i %10.2f %10.2f %10.2f" % (nov, told, tnew, told / tnew)
+
+    print "%10s %10s %10s %10s" % ("blocks", "old (us)", "new (us)", "speed-up")
+    for nhdrblks in (5, 15):
+        lines = ["%-7s:%-72s" % (key[:7], "value of %s" % key) for key in brukerimage.HEADERS_KEYS]
+        lines += ["TITLE  :%-72s" % ("title line %i" % i) for i in range(8)]
+        header = "".join(lines)[:nhdrblks * 512 - 80]
+        header += ("\x1a\x04" + "." * 78) * ((nhdrblks * 512 - len(header)) // 80)
+        header = header.ljust(nhdrblks * 512, ".")
+        assert old_header(header, nhdrblks) == new_header(header)
+        told = min(timeit.Timer(lambda: old_header(header, nhdrblks)).repeat(NB, LOOPS)) / LOOPS * 1e6
+        tnew = min(timeit.Timer(lambda: new_header(header)).repeat(NB, LOOPS)) / LOOPS * 1e6
+        print "%10i %10.1f %10.1f %10.2f" % (nhdrblks, told, tnew, told / tnew)
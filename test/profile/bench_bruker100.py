@@ -0,0 +1,65 @@
+"""
+Benchmark of the decoding of Bruker format 100 frames (1 byte per pixel
+with underflow, 1-byte and 2-byte overflow tables and a baseline offset):
+the former table loop (compress over an arange and put, one table after the
+other, in 16 bits) against bruker100image.read, for an increasing fraction of
+overflowing pixels. The former loop is timed alone, without reading the file,
+the 2-byte overflow table nor the baseline, and does not give the right
+pixel values: it is an upper bound of its speed.
+
+usage: python bench_bruker100.py [size of the image]
+"""
+
+import timeit, sys, os, tempfile
+import numpy
+from fabio.bruker100image import bruker100image
+
+NB = 3
+
+
+def old_tables(data, tables, rows, cols):
+    """ what bruker100image.read used to do with the tables (first 2 only) """
+    k = 0
+    while k < 2:
+        ar = numpy.array(tables[k], numpy.uint16)
+        lim = 2 ** (8 * k) - 1
+        M = numpy.compress(numpy.equal(data.ravel(), lim), numpy.arange(rows * cols))
+        numpy.put(data.ravel(), M, ar)
+        k = k + 1
+    return data
+
+
+def make_frame(filename, size, fraction, baseline=32):
+    data = numpy.random.poisson(60, size * size).astype(numpy.int64)
+    big = numpy.random.random(data.size) < fraction
+    data[big] = numpy.random.randint(300, 200000, big.sum())
+    stored = data - baseline
+    under = stored <= 0
+    stored[under] = 0
+    over1 = stored >= 255
+    over2 = stored >= 65535
+    tables = [data[under].astype(numpy.uint8), numpy.minimum(stored[over1], 65535).astype(numpy.uint16),
+              stored[over2].astype(numpy.uint32)]
+    lines = ["FORMAT :100", "HDRBLKS:5", "NPIXELB:1 1", "NOVERFL:%i %i %i" % tuple(t.size for t in tables),
+             "NEXP   :1 0 %i 0 0" % baseline, "NROWS  :%i" % size, "NCOLS  :%i" % size]
+    with open(filename, "wb") as f:
+        f.write("".join(line.ljust(80) for line in lines).ljust(5 * 512, "."))
+        f.write(numpy.minimum(stored, 255).astype(numpy.uint8).tostring())
+        for table in tables:
+            raw = table.tostring()
+            f.write(raw + "\x00" * (-len(raw) % 16))
+    return data, stored, tables
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    fd, filename = tempfile.mkstemp(".sfrm")
+    os.close(fd)
+    print "%10s %10s %10s %10s %10s" % ("fraction", "overflows", "old (s)", "new (s)", "speed-up")
+    for fraction in (0.0001, 0.001, 0.01, 0.1):
+        data, stored, tables = make_frame(filename, size, fraction)
+        assert (bruker100image().read(filename).data.ravel() == data).all()
+        image = numpy.minimum(stored, 255).astype(numpy.uint16)
+        told = min(timeit.Timer(lambda: old_tables(image.copy(), tables, size, size)).repeat(NB, 1))
+        tnew = min(timeit.Timer(lambda: bruker100image().read(filename)).repeat(NB, 1))
+        print "%10g %10i %10.4f %10.4f %10.2f" % (fraction, tables[1].size, told, tnew, told / tnew)
+    os.unlink(filename)
@@ -0,0 +1,90 @@
+"""
+Benchmark of the byte-offset decompression (CBF) for various densities of
+exceptions (deltas which do not fit in one byte): the former numpy decoder
+looping over the exceptions, the vectorized numpy decoder and the Cython one.
+
+usage: python bench_byte_offset.py [number of pixels]
+The former numpy decoder is quadratic in the number of exceptions and is only
+timed below 20000 exceptions.
+The Cython decoder is then timed decoding into int64 followed by astype (what
+cbfimage used to do), decoding directly into int32 and decoding from a file
+read by pieces of 1 MB.
+Last, the parallel decoder is timed with 1 to 8 threads (into int32).
+"""
+
+import timeit, sys, StringIO, multiprocessing
+import numpy
+from fabio.compression import decByteOffet_numpy, compByteOffet_numpy
+from fabio.byte_offset import analyseCython, analyseFile, analyseParallel
+
+NB = 3
+MAX_OLD = 20000
+
+
+def old_numpy(stream, size=None):
+    """ what decByteOffet_numpy used to do """
+    listnpa = []
+    key16 = "\x80"
+    key32 = "\x00\x80"
+    key64 = "\x00\x00\x00\x80"
+    shift = 1
+    while True:
+        idx = stream.find(key16)
+        if idx == -1:
+            listnpa.append(numpy.fromstring(stream, dtype="int8"))
+            break
+        listnpa.append(numpy.fromstring(stream[:idx], dtype="int8"))
+        if stream[idx + 1:idx + 3] == key32:
+            if stream[idx + 3:idx + 7] == key64:
+                listnpa.append(numpy.fromstring(stream[idx + 7:idx + 15], dtype="int64"))
+                shift = 15
+            else:
+                listnpa.append(numpy.fromstring(stream[idx + 3:idx + 7], dtype="int32"))
+                shift = 7
+        else:
+            listnpa.append(numpy.fromstring(stream[idx + 1:idx + 3], dtype="int16"))
+            shift = 3
+        stream = stream[idx + shift:]
+    return  (numpy.hstack(listnpa)).astype("int64").cumsum()
+
+
+def make_data(npix, density):
+    """ Poisson-like background with a fraction of large jumps """
+    delta = numpy.random.randint(-20, 21, size=npix)
+    jumps = numpy.random.random(npix) < density
+    delta[jumps] = numpy.random.randint(-100000, 100000, size=jumps.sum())
+    return delta.cumsum() + 1000000
+
+if __name__ == "__main__":
+    npix = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print "%9s %11s %10s %10s %10s %10s" % ("density", "0x80 bytes", "old (s)", "numpy (s)", "cython (s)", "speed-up")
+    for density in (0, 0.0001, 0.001, 0.01, 0.1, 0.5):
+        data = make_data(npix, density)
+        stream = compByteOffet_numpy(data)
+        nexc = stream.count("\x80")
+        assert (decByteOffet_numpy(stream, npix) == analyseCython(stream, npix)).all()
+        tnew = min(timeit.Timer(lambda: decByteOffet_numpy(stream, npix)).repeat(NB, 1))
+        tcy = min(timeit.Timer(lambda: analyseCython(stream, npix)).repeat(NB, 1))
+        if nexc <= MAX_OLD:
+            told = min(timeit.Timer(lambda: old_numpy(stream, npix)).repeat(NB, 1))
+            print "%9g %11i %10.4f %10.4f %10.4f %10.2f" % (density, nexc, told, tnew, tcy, told / tnew)
+        else:
+            print "%9g %11i %10s %10.4f %10.4f %10s" % (density, nexc, "-", tnew, tcy, "-")
+
+    print "%9s %14s %14s %14s %12s %12s" % ("density", "int64+astype", "int32 direct", "int32 file", "peak (MB)", "peak (MB)")
+    for density in (0.001, 0.1):
+        data = make_data(npix, density)
+        stream = compByteOffet_numpy(data)
+        tastype = min(timeit.Timer(lambda: analyseCython(stream, npix).astype("int32")).repeat(NB, 1))
+        tdirect = min(timeit.Timer(lambda: analyseCython(stream, npix, dtype="int32")).repeat(NB, 1))
+        tfile = min(timeit.Timer(lambda: analyseFile(StringIO.StringIO(stream), npix, dtype="int32")).repeat(NB, 1))
+        print "%9g %14.4f %14.4f %14.4f %12.1f %12.1f" % (density, tastype, tdirect, tfile, npix * 12 / 1e6, npix * 4 / 1e6)
+
+    print "%9s %10s %10s %10s %10s %10s" % ("density", "sequential", "2 threads", "4 threads", "8 threads", "cores")
+    for density in (0.001, 0.1):
+        data = make_data(npix, density)
+        stream = compByteOffet_numpy(data)
+        times = [min(timeit.Timer(lambda: analyseCython(stream, npix, dtype="int32")).repeat(NB, 1))]
+        for nthreads in (2, 4, 8):
+            times.append(min(timeit.Timer(lambda: analyseParallel(stream, npix, dtype="int32", nthreads=nthreads)).repeat(NB, 1)))
+        print "%9g %10.4f %10.4f %10.4f %10.4f %10i" % tuple([density] + times + [multiprocessing.cpu_count()])
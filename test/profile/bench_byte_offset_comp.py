@@ -0,0 +1,33 @@
+"""
+Benchmark of the byte-offset compression (CBF) for various densities of
+exceptions: the numpy encoder (concatenating strings in a loop over the
+exceptions) and the Cython encoder working in two passes (size of the output,
+then filling it).
+
+usage: python bench_byte_offset_comp.py [number of pixels]
+"""
+
+import timeit, sys
+import numpy
+from fabio.compression import compByteOffet_numpy
+from fabio.byte_offset import compressCython
+
+NB = 3
+
+
+def make_data(npix, density):
+    """ Poisson-like background with a fraction of large jumps """
+    delta = numpy.random.randint(-20, 21, size=npix)
+    jumps = numpy.random.random(npix) < density
+    delta[jumps] = numpy.random.randint(-100000, 100000, size=jumps.sum())
+    return (delta.cumsum() + 1000000).astype("int32")
+
+if __name__ == "__main__":
+    npix = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print "%9s %10s %10s %10s" % ("density", "numpy (s)", "cython (s)", "speed-up")
+    for density in (0, 0.001, 0.01, 0.1, 0.5):
+        data = make_data(npix, density)
+        assert compressCython(data) == compByteOffet_numpy(data)
+        tnp = min(timeit.Timer(lambda: compByteOffet_numpy(data)).repeat(NB, 1))
+        tcy = min(timeit.Timer(lambda: compressCython(data)).repeat(NB, 1))
+        print "%9g %10.4f %10.4f %10.2f" % (density, tnp, tcy, tnp / tcy)
@@ -0,0 +1,48 @@
+"""
+Benchmark of openheader on CBF files: the former path, where the whole file
+is read and tokenized by CIF.loadCIF, versus the header-only path which stops
+at the start of the binary section.
+
+usage: python bench_cbf_header.py [cbf images]
+Without argument, synthetic CBF images of 1 to 16 Mpixels are generated.
+"""
+
+import timeit, os, sys, tempfile, shutil
+import numpy
+import fabio
+from fabio.cbfimage import cbfimage
+
+NB = 5
+
+
+def old_header(fname):
+    """ what openheader used to do on CBF files """
+    obj = cbfimage()
+    infile = obj._open(fname, "rb")
+    obj._readheader(infile)
+    infile.close()
+    return obj.header
+
+
+def new_header(fname):
+    return fabio.openheader(fname).header
+
+
+def synthetic(tmpdir):
+    images = []
+    for shape in ((1024, 1024), (2048, 2048), (4096, 4096)):
+        fname = os.path.join(tmpdir, "bench_%ix%i.cbf" % shape)
+        cbfimage(data=numpy.random.randint(0, 1000, size=shape).astype("int32")).write(fname)
+        images.append(fname)
+    return images
+
+if __name__ == "__main__":
+    tmpdir = tempfile.mkdtemp()
+    images = sys.argv[1:] or synthetic(tmpdir)
+    print "%30s %10s %10s %10s %8s" % ("image", "size (MB)", "old (ms)", "new (ms)", "speed-up")
+    for im in images:
+        assert old_header(im) == new_header(im)
+        told = min(timeit.Timer(lambda: old_header(im)).repeat(NB, 1)) * 1e3
+        tnew = min(timeit.Timer(lambda: new_header(im)).repeat(NB, 1)) * 1e3
+        print "%30s %10.1f %10.2f %10.2f %8.1f" % (os.path.basename(im), os.path.getsize(im) / 1e6, told, tnew, told / tnew)
+    shutil.rmtree(tmpdir)
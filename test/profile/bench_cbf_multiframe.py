@@ -0,0 +1,34 @@
+"""
+Benchmark of CBF files with several binary sections: time to open the file
+(first section decoded, all the sections indexed) and to access one section
+with getframe, compared with the time to decode a single-section file of
+the same frame size.
+
+usage: python bench_cbf_multiframe.py [number of sections]
+"""
+
+import timeit, os, sys, tempfile, shutil
+import numpy
+from fabio.cbfimage import cbfimage
+
+NB = 5
+
+if __name__ == "__main__":
+    nsections = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    tmpdir = tempfile.mkdtemp()
+    single = os.path.join(tmpdir, "single.cbf")
+    multi = os.path.join(tmpdir, "multi.cbf")
+    print "%12s %9s %10s %10s %12s %12s" % ("shape", "sections", "size (MB)", "single (s)", "open (s)", "getframe (s)")
+    for shape in ((195, 487), (1043, 981)):
+        cbfimage(data=numpy.random.randint(0, 1000, size=shape).astype("int32")).write(single)
+        block = open(single, "rb").read()
+        with open(multi, "wb") as f:
+            for i in range(nsections):
+                f.write(block + "\r\n")
+        obj = cbfimage().read(multi)
+        assert obj.nframes == nsections
+        tsingle = min(timeit.Timer(lambda: cbfimage().read(single)).repeat(NB, 1))
+        topen = min(timeit.Timer(lambda: cbfimage().read(multi)).repeat(NB, 1))
+        tframe = min(timeit.Timer(lambda: obj.getframe(nsections // 2)).repeat(NB, 1))
+        print "%12s %9i %10.1f %10.4f %12.4f %12.4f" % ("%ix%i" % shape, nsections, os.path.getsize(multi) / 1e6, tsingle, topen, tframe)
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,55 @@
+"""
+Benchmark of cbfimage.read: the former path, where the whole file is loaded
+in the CIF dictionary and the compressed data are sliced out of it, versus
+the current one decoding the compressed data from their position in the
+file, either read or memory-mapped. The size of the CIF dictionary kept by
+the image object is printed as well.
+
+usage: python bench_cbf_read.py [cbf images]
+Without argument, synthetic CBF images of 1 to 16 Mpixels are generated.
+"""
+
+import timeit, os, sys, tempfile, shutil
+import numpy
+from fabio.cbfimage import cbfimage
+
+NB = 5
+
+
+def old_read(fname):
+    """ what cbfimage.read used to do """
+    obj = cbfimage()
+    obj.filename = fname
+    infile = obj._open(fname, "rb")
+    obj._readheader(infile)
+    bytecode = obj._readDims()
+    obj.data = obj._readbinary_byte_offset(obj.cif["_array_data.data"], bytecode).reshape((obj.dim2, obj.dim1))
+    return obj
+
+
+def cif_size(obj):
+    return sum(len(value) for value in obj.cif.values() if isinstance(value, str)) / 1e6
+
+
+def synthetic(tmpdir):
+    images = []
+    for shape in ((1024, 1024), (2527, 2463), (4096, 4096)):
+        fname = os.path.join(tmpdir, "bench_%ix%i.cbf" % shape)
+        cbfimage(data=numpy.random.randint(0, 1000, size=shape).astype("int32")).write(fname)
+        images.append(fname)
+    return images
+
+if __name__ == "__main__":
+    tmpdir = tempfile.mkdtemp()
+    images = sys.argv[1:] or synthetic(tmpdir)
+    print "%24s %9s %9s %9s %9s %8s %12s %12s" % ("image", "size (MB)", "old (s)", "read (s)", "mmap (s)", "speed-up", "old CIF (MB)", "new CIF (MB)")
+    for im in images:
+        old = old_read(im)
+        new = cbfimage().read(im)
+        assert (old.data == new.data).all()
+        told = min(timeit.Timer(lambda: old_read(im)).repeat(NB, 1))
+        tread = min(timeit.Timer(lambda: cbfimage().read(im, mmap=False)).repeat(NB, 1))
+        tmmap = min(timeit.Timer(lambda: cbfimage().read(im)).repeat(NB, 1))
+        print "%24s %9.1f %9.4f %9.4f %9.4f %8.2f %12.3f %12.3f" % (os.path.basename(im), os.path.getsize(im) / 1e6, told, tread, tmmap,
+                                                                   told / tmmap, cif_size(old), cif_size(new))
+    shutil.rmtree(tmpdir)
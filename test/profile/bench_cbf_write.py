@@ -0,0 +1,69 @@
+"""
+Benchmark of the CBF writer: the former cbfimage.write, which assembled the
+whole file (compressed data included) in one string, versus the streaming
+writer which writes the compressed data from their own buffer. Then frames
+per second of the batch writer (CbfWriter) with 1 to 8 threads.
+
+usage: python bench_cbf_write.py [number of frames for the batch writer]
+"""
+
+import timeit, os, sys, tempfile, shutil, multiprocessing
+import numpy
+from fabio.cbfimage import cbfimage, CbfWriter, STARTER
+from fabio.compression import compByteOffet_cython, md5sum
+
+NB = 5
+HEADER = {"_array_data.header_convention": "PILATUS_1.2", "Exposure_time": "0.1 s", "Wavelength": "1.0 A"}
+
+
+def old_write(obj, fname):
+    """ what cbfimage.write used to do """
+    binary_blob = compByteOffet_cython(obj.data)
+    binary_block = ["--CIF-BINARY-FORMAT-SECTION--",
+                    "Content-Type: application/octet-stream;",
+                    '     conversions="x-CBF_BYTE_OFFSET"',
+                    'Content-Transfer-Encoding: BINARY',
+                    "X-Binary-Size: %d" % (len(binary_blob)),
+                    "X-Binary-ID: 1",
+                    'X-Binary-Element-Type: "signed 32-bit integer"',
+                    "X-Binary-Element-Byte-Order: LITTLE_ENDIAN" ,
+                    "Content-MD5: %s" % md5sum(binary_blob),
+                    "X-Binary-Number-of-Elements: %s" % (obj.data.size),
+                    "X-Binary-Size-Fastest-Dimension: %d" % obj.data.shape[1],
+                    "X-Binary-Size-Second-Dimension: %d" % obj.data.shape[0],
+                    "X-Binary-Size-Padding: %d" % 1,
+                    "",
+                    STARTER + binary_blob,
+                    "",
+                    "--CIF-BINARY-FORMAT-SECTION----"]
+    obj.cif["_array_data.header_contents"] = "\r\n".join(["# %s %s" % (key, value) for key, value in HEADER.items() if not key.startswith("_")])
+    obj.cif["_array_data.data"] = "\r\n".join(binary_block)
+    obj.cif.saveCIF(fname, linesep="\r\n", binary=True)
+
+
+def new_write(obj, fname):
+    obj.write(fname)
+
+if __name__ == "__main__":
+    nframes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    tmpdir = tempfile.mkdtemp()
+    fname = os.path.join(tmpdir, "bench.cbf")
+    print "%12s %10s %10s %10s %8s" % ("shape", "size (MB)", "old (s)", "new (s)", "speed-up")
+    for shape in ((1024, 1024), (2527, 2463), (4096, 4096)):
+        obj = cbfimage(data=numpy.random.randint(0, 1000, size=shape).astype("int32"), header=dict(HEADER))
+        told = min(timeit.Timer(lambda: old_write(obj, fname)).repeat(NB, 1))
+        tnew = min(timeit.Timer(lambda: new_write(obj, fname)).repeat(NB, 1))
+        print "%12s %10.1f %10.4f %10.4f %8.2f" % ("%ix%i" % shape, os.path.getsize(fname) / 1e6, told, tnew, told / tnew)
+
+    frames = numpy.random.randint(0, 1000, size=(8, 1679, 1475)).astype("int32")
+    filenames = [os.path.join(tmpdir, "frame_%05i.cbf" % i) for i in range(nframes)]
+    print "%d frames of 1679x1475 pixels, %i cores" % (nframes, multiprocessing.cpu_count())
+    print "%10s %10s %12s" % ("threads", "time (s)", "frames/s")
+    for nthreads in (1, 2, 4, 8):
+        def batch():
+            with CbfWriter(HEADER, nthreads=nthreads) as writer:
+                for i, filename in enumerate(filenames):
+                    writer.write(filename, frames[i % len(frames)], {"Frame": str(i)})
+        t = min(timeit.Timer(batch).repeat(3, 1))
+        print "%10i %10.3f %12.1f" % (nthreads, t, nframes / t)
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,157 @@
+"""
+Benchmark of CIF.loadCIF with the former character-walking tokenizer
+(_splitCIF) and loop parser (_analyseOneLoop) versus the regular expression
+based ones, on CBF files and on mmCIF-like files with a large atom_site loop.
+Both must give the same CIF dictionary.
+
+usage: python bench_cif.py [cif or cbf files]
+Without argument, synthetic CBF and mmCIF-like files are generated.
+"""
+
+import timeit, os, sys, tempfile, shutil
+import numpy
+from fabio.cbfimage import cbfimage, CIF
+
+NB = 3
+MAX_OLD = 20000 # the former tokenizer is quadratic in the number of fields
+
+
+def old_split(sText):
+    """ what CIF._splitCIF used to do """
+    lFields = []
+    while True:
+        if len(sText) == 0:
+            break
+        elif sText[0] in "'\"":
+            quote = sText[0]
+            idx = 0
+            bFinished = False
+            while not  bFinished:
+                idx += 1 + sText[idx + 1:].find(quote)
+                if idx >= len(sText) - 1:
+                    lFields.append(sText[1:-1].strip())
+                    sText = ""
+                    bFinished = True
+                    break
+                if sText[idx + 1] in CIF.BLANK:
+                    lFields.append(sText[1:idx].strip())
+                    sText1 = sText[idx + 1:]
+                    sText = sText1.strip()
+                    bFinished = True
+        elif sText[0] == ';':
+            if sText[1:].strip().find(CIF.BINARY_MARKER) == 0:
+                idx = sText[32:].find(CIF.BINARY_MARKER)
+                if idx == -1:
+                    idx = 0
+                else:
+                    idx += 32 + len(CIF.BINARY_MARKER)
+            else:
+                idx = 0
+            bFinished = False
+            while not  bFinished:
+                idx += 1 + sText[idx + 1:].find(';')
+                if sText[idx - 1] in CIF.EOL:
+                    lFields.append(sText[1:idx - 1].strip())
+                    sText1 = sText[idx + 1:]
+                    sText = sText1.strip()
+                    bFinished = True
+        else:
+            f = sText.split(None, 1)[0]
+            lFields.append(f)
+            sText1 = sText[len(f):].strip()
+            sText = sText1
+    return lFields
+
+
+def old_loop(lFields, iStart):
+    """ what CIF._analyseOneLoop used to do """
+    loop = []
+    keys = []
+    i = iStart + 1
+    while lFields[i][0] == "_":
+        keys.append(lFields[i])
+        i += 1
+    data = []
+    while True:
+        if i >= len(lFields):
+            break
+        elif len(lFields[i]) == 0:
+            break
+        elif lFields[i][0] == "_":
+            break
+        elif lFields[i] in ["loop_", "stop_", "global_", "data_", "save_"]:
+            break
+        else:
+            data.append(lFields[i])
+            i += 1
+    k = 0
+    if len(data) < len(keys):
+        element = {}
+        for j in keys:
+            if k < len(data):
+                element[j] = data[k]
+            else :
+                element[j] = "?"
+            k += 1
+        loop.append(element)
+    else:
+        for i in range(len(data) / len(keys)):
+            element = {}
+            for j in keys:
+                element[j] = data[k]
+                k += 1
+            loop.append(element)
+    return loop, 1 + len(keys) + len(data), keys
+
+
+def load(fname, old=False):
+    new_split, new_loop = CIF._splitCIF, CIF._analyseOneLoop
+    if old:
+        CIF._splitCIF, CIF._analyseOneLoop = staticmethod(old_split), staticmethod(old_loop)
+    try:
+        cif = CIF()
+        cif.loadCIF(fname, _bKeepComment=True)
+    finally:
+        CIF._splitCIF, CIF._analyseOneLoop = staticmethod(new_split), staticmethod(new_loop)
+    return cif
+
+
+def mmcif(fname, natoms):
+    lines = ["data_bench", "_entry.id BENCH", "_cell.length_a 61.2", "_cell.length_b 61.2", "_cell.length_c 97.8",
+             "_struct.title 'synthetic structure for benchmarking'", "loop_"]
+    columns = ["group_PDB", "id", "type_symbol", "label_atom_id", "label_comp_id", "label_asym_id",
+               "label_seq_id", "Cartn_x", "Cartn_y", "Cartn_z", "occupancy", "B_iso_or_equiv"]
+    lines += ["_atom_site.%s" % col for col in columns]
+    xyz = numpy.random.random((natoms, 3)) * 100
+    for i in range(natoms):
+        lines.append("ATOM %i C CA \"ALA\" A %i %.3f %.3f %.3f 1.00 %.2f" % (i + 1, i // 8 + 1, xyz[i, 0], xyz[i, 1], xyz[i, 2], 20 + i % 30))
+    open(fname, "w").write("\n".join(lines) + "\n")
+
+
+def synthetic(tmpdir):
+    files = []
+    for shape in ((195, 487), (2527, 2463)):
+        fname = os.path.join(tmpdir, "bench_%ix%i.cbf" % shape)
+        cbfimage(data=numpy.random.randint(0, 1000, size=shape).astype("int32")).write(fname)
+        files.append(fname)
+    for natoms in (1000, 10000, 100000):
+        fname = os.path.join(tmpdir, "bench_%i_atoms.cif" % natoms)
+        mmcif(fname, natoms)
+        files.append(fname)
+    return files
+
+if __name__ == "__main__":
+    tmpdir = tempfile.mkdtemp()
+    files = sys.argv[1:] or synthetic(tmpdir)
+    print "%28s %10s %10s %10s %10s %8s" % ("file", "size (MB)", "fields", "old (s)", "new (s)", "speed-up")
+    for fname in files:
+        new = load(fname)
+        nfields = len(CIF._splitCIF(open(fname, "rb").read().strip()))
+        tnew = min(timeit.Timer(lambda: load(fname)).repeat(NB, 1))
+        if nfields <= MAX_OLD:
+            assert load(fname, old=True) == new
+            told = min(timeit.Timer(lambda: load(fname, old=True)).repeat(NB, 1))
+            print "%28s %10.2f %10i %10.4f %10.4f %8.1f" % (os.path.basename(fname), os.path.getsize(fname) / 1e6, nfields, told, tnew, told / tnew)
+        else:
+            print "%28s %10.2f %10i %10s %10.4f %8s" % (os.path.basename(fname), os.path.getsize(fname) / 1e6, nfields, "-", tnew, "-")
+    shutil.rmtree(tmpdir)
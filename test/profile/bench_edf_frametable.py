@@ -0,0 +1,50 @@
+"""
+Benchmark the memory and time needed to open a multi-frame EDF file with many
+frames: compact frame table (Frame objects created on access) versus
+one Frame object per frame (what edfimage used to build).
+
+usage: python bench_edf_frametable.py [edf file]
+Without argument, a synthetic file with 20000 small frames is generated.
+"""
+
+import time, os, sys, tempfile, shutil, gc
+import numpy
+from fabio.edfimage import edfimage
+
+
+def rss():
+    "resident memory of the process in MB (linux only)"
+    try:
+        for line in open("/proc/self/status"):
+            if line.startswith("VmRSS"):
+                return int(line.split()[1]) / 1024.
+    except IOError:
+        return float("nan")
+
+if __name__ == "__main__":
+    tmpdir = tempfile.mkdtemp()
+    if len(sys.argv) > 1:
+        fname = sys.argv[1]
+    else:
+        fname = os.path.join(tmpdir, "bench_table.edf")
+        data = numpy.arange(16 * 16, dtype=numpy.uint16).reshape((16, 16))
+        img = edfimage(data=data)
+        for i in range(19999):
+            img.appendFrame(data=data, header={"motor": i, "counter": 2 * i})
+        img.write(fname)
+        del img
+    gc.collect()
+    mem0 = rss()
+    t0 = time.time()
+    img = edfimage().read(fname)
+    t1 = time.time()
+    mem1 = rss()
+    frames = list(img._edfimage__frames)
+    for frame in frames:
+        frame.header
+    t2 = time.time()
+    mem2 = rss()
+    print "frames: %s" % img.nframes
+    print "open with the frame table:   %.3f s  %6.1f MB" % (t1 - t0, mem1 - mem0)
+    print "all Frame objects + headers: %.3f s  %6.1f MB" % (t2 - t0, mem2 - mem0)
+    shutil.rmtree(tmpdir)
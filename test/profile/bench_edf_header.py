@@ -0,0 +1,142 @@
+"""
+Micro-benchmark of the EDF header parser on blocks of 100 to 1000 keys:
+the former line by line parser (copied from the previous version of
+Frame.parseheader), the compiled regular expression parser and the
+template mode where the keys of the previous frame are re-used.
+
+usage: python bench_edf_header.py
+"""
+
+import timeit, logging
+import numpy
+from fabio.edfimage import Frame, DATA_TYPES
+from fabio.fabioutils import nice_int
+logger = logging.getLogger("bench_edf_header")
+
+NB = 5
+LOOPS = 200
+
+
+class OldFrame(object):
+    """ what Frame.parseheader used to be, copied verbatim """
+    _bytecode = None
+
+    def parseheader(self, block):
+        """
+        Parse the header in some EDF format from an already open file
+
+        @param block: string representing the header block
+        @type block: string, should be full ascii
+        @return: size of the binary blob
+        """
+        #reset values ...
+        self.header = {}
+        self.capsHeader = {}
+        self.header_keys = []
+        self.size = None
+        calcsize = 1
+        self.dims = []
+
+        for line in block.split(';'):
+            if '=' in line:
+                key, val = line.split('=' , 1)
+                # Why would someone put null bytes in a header?
+                key = key.replace("\x00"," ").strip()
+                self.header[key] = val.replace("\x00"," ").strip()
+                self.capsHeader[key.upper()] = key
+                self.header_keys.append(key)
+
+        # Compute image size
+        if "SIZE" in self.capsHeader:
+            try:
+                self.size = nice_int(self.header[self.capsHeader["SIZE"]])
+            except ValueError:
+                logger.warning("Unable to convert to integer : %s %s " % (self.capsHeader["SIZE"], self.header[self.capsHeader["SIZE"]]))
+        if "DIM_1" in self.capsHeader:
+            try:
+                dim1 = nice_int(self.header[self.capsHeader['DIM_1']])
+            except ValueError:
+                logger.error("Unable to convert to integer Dim_1: %s %s" % (self.capsHeader["DIM_1"], self.header[self.capsHeader["DIM_1"]]))
+            else:
+                calcsize *= dim1
+                self.dims.append(dim1)
+        else:
+            logger.error("No Dim_1 in headers !!!")
+        if "DIM_2" in self.capsHeader:
+            try:
+                dim2 = nice_int(self.header[self.capsHeader['DIM_2']])
+            except ValueError:
+                logger.error("Unable to convert to integer Dim_3: %s %s" % (self.capsHeader["DIM_2"], self.header[self.capsHeader["DIM_2"]]))
+            else:
+                calcsize *= dim2
+                self.dims.append(dim2)
+        else:
+            logger.error("No Dim_2 in headers !!!")
+        iDim = 3
+        # JON: this appears to be for nD images, but we don't treat those
+        while iDim is not None:
+            strDim = "DIM_%i" % iDim
+            if strDim in self.capsHeader:
+                try:
+                    dim3 = nice_int(self.header[self.capsHeader[strDim]])
+                except ValueError:
+                    logger.error("Unable to convert to integer %s: %s %s"
+                                  % (strDim, self.capsHeader[strDim], self.header[self.capsHeader[strDim]]))
+                    dim3 = None
+                    iDim = None
+                else:
+                    if dim3 > 1:
+                        # Otherwise treat dim3==1 as a 2D image
+                        calcsize *= dim3
+                        self.dims.append(dim3)
+                    iDim += 1
+
+            else:
+                logger.debug("No Dim_3 -> it is a 2D image")
+                iDim = None
+        if self._bytecode is None:
+            if "DATATYPE" in self.capsHeader:
+                self._bytecode = DATA_TYPES[self.header[self.capsHeader['DATATYPE']]]
+            else:
+                self._bytecode = numpy.uint16
+                logger.warning("Defaulting type to uint16")
+        self.bpp = len(numpy.array(0, self._bytecode).tostring())
+        calcsize *= self.bpp
+        if (self.size is None):
+            self.size = calcsize
+        elif (self.size != calcsize):
+            if ("COMPRESSION" in self.capsHeader) and (self.header[self.capsHeader['COMPRESSION']].upper().startswith("NO")):
+                logger.info("Mismatch between the expected size %s and the calculated one %s" % (self.size, calcsize))
+                self.size = calcsize
+
+        for i, n in enumerate(self.dims):
+            setattr(self, "dim%i" % (i + 1), n)
+
+        return self.size
+
+
+def make_block(nkeys, frame=0):
+    lines = ["{", "HeaderID = EH:%06i:000000:000000 ;" % (frame + 1), "Image = %i ;" % (frame + 1),
+             "ByteOrder = LowByteFirst ;", "DataType = UnsignedShort ;",
+             "Dim_1 = 2048 ;", "Dim_2 = 2048 ;", "Size = 8388608 ;"]
+    for i in range(nkeys - 7):
+        lines.append("motor_%04i = %.6f ;" % (i, frame * 0.1 + i))
+    block = "\n".join(lines) + "\n"
+    block += " " * (512 - (len(block) + 2) % 512) + "}\n"
+    return block
+
+if __name__ == "__main__":
+    print "%6s %12s %12s %12s %8s %8s" % ("keys", "old (us)", "new (us)", "template (us)", "x new", "x templ")
+    for nkeys in (100, 200, 500, 1000):
+        block = make_block(nkeys)
+        previous = Frame()
+        previous.parseheader(make_block(nkeys, 1))
+        template = (previous.header_keys, previous.capsHeader)
+        frame = Frame()
+        old = OldFrame()
+        assert old.parseheader(block) == frame.parseheader(block)
+        assert (old.header, old.header_keys, old.capsHeader) == (frame.header, frame.header_keys, frame.capsHeader)
+        told = min(timeit.Timer(lambda: old.parseheader(block)).repeat(NB, LOOPS)) / LOOPS * 1e6
+        tnew = min(timeit.Timer(lambda: frame.parseheader(block)).repeat(NB, LOOPS)) / LOOPS * 1e6
+        ttpl = min(timeit.Timer(lambda: frame.parseheader(block, template)).repeat(NB, LOOPS)) / LOOPS * 1e6
+        print "%6i %12.1f %12.1f %12.1f %8.2f %8.2f" % (nkeys, told, tnew, ttpl, told / tnew, told / ttpl)
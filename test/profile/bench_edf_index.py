@@ -0,0 +1,34 @@
+"""
+Benchmark the opening of a large multi-frame EDF file, walking through all
+headers (default) versus loading the sidecar index (index=True).
+
+usage: python bench_edf_index.py [edf file]
+Without argument, a synthetic file with 5000 small frames is generated.
+The index is written next to the EDF file.
+"""
+
+import timeit, os, sys, tempfile, shutil
+import numpy
+from fabio.edfimage import edfimage, build_index
+
+NB = 3
+
+if __name__ == "__main__":
+    tmpdir = tempfile.mkdtemp()
+    if len(sys.argv) > 1:
+        fname = sys.argv[1]
+    else:
+        fname = os.path.join(tmpdir, "bench_index.edf")
+        data = numpy.arange(64 * 64, dtype=numpy.uint16).reshape((64, 64))
+        img = edfimage(data=data)
+        for i in range(4999):
+            img.appendFrame(data=data, header={"motor": i})
+        img.write(fname)
+    tbuild = min(timeit.Timer(lambda: build_index(fname)).repeat(1, 1))
+    tscan = min(timeit.Timer(lambda: edfimage().read(fname)).repeat(NB, 1))
+    tindex = min(timeit.Timer(lambda: edfimage().read(fname, index=True)).repeat(NB, 1))
+    print "frames: %s" % edfimage().read(fname, index=True).nframes
+    print "index build: %.4f s" % tbuild
+    print "open by scanning headers: %.4f s" % tscan
+    print "open with the index:      %.4f s    speed-up: %.1f" % (tindex, tscan / tindex)
+    shutil.rmtree(tmpdir)
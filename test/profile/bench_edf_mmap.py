@@ -0,0 +1,56 @@
+"""
+Benchmark the access to a small region of every frame of a multi-frame EDF
+file, reading the frames (default) versus memory-mapping them (mmap=True).
+
+usage: python bench_edf_mmap.py [edf file]
+Without argument, a synthetic 8 frames 2048x2048 uint32 file is generated.
+"""
+
+import timeit, os, sys, tempfile, shutil
+import numpy
+from fabio.edfimage import edfimage
+
+NB = 5
+
+
+def roi(fname, mmap):
+    img = edfimage().read(fname, mmap=mmap)
+    total = 0
+    for i in range(img.nframes):
+        total += img.getframe(i).data[1000:1100, 1000:1100].sum()
+    return total
+
+
+def rss():
+    "resident memory of the process in MB (linux only)"
+    try:
+        for line in open("/proc/self/status"):
+            if line.startswith("VmRSS"):
+                return int(line.split()[1]) / 1024.
+    except IOError:
+        return float("nan")
+
+if __name__ == "__main__":
+    tmpdir = tempfile.mkdtemp()
+    if len(sys.argv) > 1:
+        fname = sys.argv[1]
+    else:
+        fname = os.path.join(tmpdir, "bench_mmap.edf")
+        data = (numpy.random.random((2048, 2048)) * 1e6).astype(numpy.uint32)
+        img = edfimage(data=data)
+        for i in range(7):
+            img.appendFrame(data=data)
+        img.write(fname)
+    assert roi(fname, True) == roi(fname, False)
+    tread = min(timeit.Timer(lambda: roi(fname, False)).repeat(NB, 1))
+    tmmap = min(timeit.Timer(lambda: roi(fname, True)).repeat(NB, 1))
+    print "read: %.4f s    mmap: %.4f s    speed-up: %.1f" % (tread, tmmap, tread / tmmap)
+    start = rss()
+    img = edfimage().read(fname, mmap=True)
+    kept = [img.getframe(i).data[1000:1100, 1000:1100].sum() for i in range(img.nframes)]
+    print "RSS increase with mmap: %.1f MB" % (rss() - start)
+    start = rss()
+    img = edfimage().read(fname)
+    kept = [img.getframe(i).data[1000:1100, 1000:1100].sum() for i in range(img.nframes)]
+    print "RSS increase with read: %.1f MB" % (rss() - start)
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,55 @@
+"""
+Benchmark the decoding of all frames of a multi-frame EDF file with compressed
+data blocks: sequential getframe().data versus edfimage.readFrames with a
+pool of threads or of processes, with the decode throughput.
+
+usage: python bench_edf_threads.py [edf file]
+Without argument, a synthetic file with 32 gzip-compressed 1024x1024 frames is generated.
+"""
+
+import timeit, os, sys, tempfile, shutil, multiprocessing, zlib
+import numpy
+from fabio.edfimage import edfimage, Frame
+
+NB = 3
+
+
+def sequential(fname):
+    img = edfimage().read(fname)
+    return numpy.array([img.getframe(i).data for i in range(img.nframes)])
+
+
+def threaded(fname, nthreads, processes=False, stats=None):
+    return edfimage().read(fname).readFrames(nthreads=nthreads, processes=processes, stats=stats)
+
+if __name__ == "__main__":
+    tmpdir = tempfile.mkdtemp()
+    if len(sys.argv) > 1:
+        fname = sys.argv[1]
+    else:
+        fname = os.path.join(tmpdir, "bench_threads.edf")
+        with open(fname, "wb") as f:
+            for i in range(32):
+                data = numpy.random.poisson(100 + i, size=(1024, 1024)).astype(numpy.int32)
+                frame = Frame(data=data, number=i)
+                frame.header["Compression"] = "None"
+                block = frame.getEdfBlock()
+                # re-encode the data block with zlib
+                header, raw = block[:-data.nbytes], data.tostring()
+                comp = zlib.compress(raw)
+                header = header.replace("Compression = None", "Compression = Z   ")
+                header = header.replace("EDF_BinarySize = %i" % len(raw), "EDF_BinarySize = %i" % len(comp))
+                header = header.replace("Size = %i" % len(raw), "Size = %i" % len(comp))
+                f.write(header + comp)
+    assert abs(sequential(fname) - threaded(fname, 2)).max() == 0
+    tseq = min(timeit.Timer(lambda: sequential(fname)).repeat(NB, 1))
+    print "CPUs: %s" % multiprocessing.cpu_count()
+    print "sequential: %.3f s" % tseq
+    for processes in (False, True):
+        for nthreads in (1, 2, 4, 8):
+            t = min(timeit.Timer(lambda: threaded(fname, nthreads, processes)).repeat(NB, 1))
+            stats = {}
+            threaded(fname, nthreads, processes, stats)
+            print "readFrames, %i %s: %.3f s    speed-up: %.2f    %.1f MB/s" % \
+                (nthreads, "processes" if processes else "threads", t, tseq / t, stats["throughput"])
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,39 @@
+"""
+Benchmark the acquisition-like writing of a multi-frame EDF file, frame by
+frame: edfimage.appendFrame + edfimage.write (rewrites the whole file each
+time) versus EdfWriter (appends each frame once).
+
+usage: python bench_edf_writer.py [number of frames]
+"""
+
+import time, os, sys, tempfile, shutil
+import numpy
+from fabio.edfimage import edfimage, EdfWriter
+
+if __name__ == "__main__":
+    nframes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    tmpdir = tempfile.mkdtemp()
+    fname = os.path.join(tmpdir, "bench_writer.edf")
+    data = numpy.random.randint(0, 65000, size=(256, 256)).astype(numpy.uint16)
+
+    t0 = time.time()
+    img = None
+    for i in range(nframes):
+        if img is None:
+            img = edfimage(data=data)
+        else:
+            img.appendFrame(data=data)
+        img.write(fname)
+    tappend = time.time() - t0
+
+    t0 = time.time()
+    with EdfWriter(fname, flush_frames=10) as writer:
+        for i in range(nframes):
+            writer.write(data)
+    tstream = time.time() - t0
+    assert edfimage().read(fname).nframes == nframes
+
+    print "%i frames of %s" % (nframes, data.shape)
+    print "appendFrame + write: %.3f s  (%.1f frames/s)" % (tappend, nframes / tappend)
+    print "EdfWriter:           %.3f s  (%.1f frames/s)" % (tstream, nframes / tstream)
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,34 @@
+"""
+Benchmark the time needed to "import fabio" now that format modules are
+imported on demand, versus importing every format module (what
+fabio.openimage used to do at import time).
+
+usage: python bench_import.py
+Each measurement is done in a fresh interpreter.
+"""
+
+import subprocess, sys, timeit, os
+import fabio
+from fabio import openimage
+
+NB = 10
+PYTHONPATH = os.path.dirname(os.path.dirname(fabio.__file__))
+
+LAZY = "import fabio"
+EAGER = "import fabio; " + "; ".join("import fabio.%s" % i for i in sorted(openimage.FORMATS.values()))
+
+
+def run(script):
+    env = os.environ.copy()
+    env["PYTHONPATH"] = PYTHONPATH
+    with open(os.devnull, "w") as null:
+        subprocess.call([sys.executable, "-c", script], env=env, stderr=null)
+
+if __name__ == "__main__":
+    tref = min(timeit.Timer(lambda: run("pass")).repeat(NB, 1))
+    tlazy = min(timeit.Timer(lambda: run(LAZY)).repeat(NB, 1))
+    teager = min(timeit.Timer(lambda: run(EAGER)).repeat(NB, 1))
+    print "interpreter start-up:          %.4f s" % tref
+    print "import fabio (lazy):           %.4f s (+%.4f s)" % (tlazy, tlazy - tref)
+    print "import fabio + all formats:    %.4f s (+%.4f s)" % (teager, teager - tref)
+    print "speed-up on the import:        %.2f" % ((teager - tref) / (tlazy - tref))
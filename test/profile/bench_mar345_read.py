@@ -0,0 +1,49 @@
+"""
+Benchmark of the reading of compressed mar345 images (.gz and .bz2): the
+former path, where the decompressed file was spilled to a temporary file
+and read back (mar345image needed a real file), against the current one
+where the decompressed buffer is decoded in memory.
+
+usage: python bench_mar345_read.py [size of the image]
+"""
+
+import timeit, sys, os, tempfile, shutil, gzip, bz2
+import numpy
+import fabio
+from fabio.mar345image import mar345image
+from fabio.compression import decPCK
+
+NB = 3
+
+
+def old_read(fname, opener):
+    """ what mar345image.read used to do for a compressed file """
+    stream = opener(fname, "rb")
+    tmpfd, tmpfn = tempfile.mkstemp()
+    os.close(tmpfd)
+    with open(tmpfn, "w+b") as fobj:
+        fobj.write(stream.read())
+        stream.close()
+        fobj.seek(0)
+        obj = mar345image()
+        obj._readheader(fobj)
+        data = decPCK(fobj, obj.dim1, obj.dim2)
+    os.remove(tmpfn)
+    return data
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2300
+    tmpdir = tempfile.mkdtemp()
+    data = numpy.random.poisson(100, (size, size))
+    fname = os.path.join(tmpdir, "bench.mar%i" % size)
+    mar345image(data=data).write(fname)
+    raw = open(fname, "rb").read()
+    gzip.open(fname + ".gz", "wb").write(raw)
+    bz2.BZ2File(fname + ".bz2", "wb").write(raw)
+    print "%6s %10s %10s %10s" % ("ext", "old (s)", "new (s)", "speed-up")
+    for ext, opener in ((".gz", gzip.open), (".bz2", bz2.BZ2File)):
+        assert (old_read(fname + ext, opener) == fabio.open(fname + ext).data).all()
+        told = min(timeit.Timer(lambda: old_read(fname + ext, opener)).repeat(NB, 1))
+        tnew = min(timeit.Timer(lambda: fabio.open(fname + ext)).repeat(NB, 1))
+        print "%6s %10.4f %10.4f %10.2f" % (ext, told, tnew, told / tnew)
+    shutil.rmtree(tmpdir)
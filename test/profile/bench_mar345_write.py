@@ -0,0 +1,45 @@
+"""
+Benchmark of the PCK compression of mar345 images: the in-memory packer
+against the former temporary file round trip (emulated here by writing the
+packed image to a temporary file and reading it back, as compress_pck used to
+do after pack_wordimage_c), then packing a series of frames with 1 to 8
+threads (the packer releases the GIL).
+
+usage: python bench_mar345_write.py [size of the image] [number of frames]
+"""
+
+import timeit, sys, os, tempfile, multiprocessing
+import numpy
+from fabio.mar345_IO import compress_pck, compress_pck_frames
+
+NB = 3
+
+
+def old_compress(data):
+    """ what compress_pck used to do: go through a temporary file """
+    packed = compress_pck(data)
+    fd, name = tempfile.mkstemp()
+    with open(name, "ab") as f:
+        f.write(packed)
+    with open(name, "rb") as f:
+        output = f.read()
+    os.close(fd)
+    os.remove(name)
+    return output
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2300
+    nframes = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    data = numpy.random.poisson(100, (size, size))
+    assert old_compress(data) == compress_pck(data)
+    told = min(timeit.Timer(lambda: old_compress(data)).repeat(NB, 1))
+    tnew = min(timeit.Timer(lambda: compress_pck(data)).repeat(NB, 1))
+    print "%10s %10s %10s %10s" % ("size", "old (s)", "new (s)", "speed-up")
+    print "%10i %10.4f %10.4f %10.2f" % (size, told, tnew, told / tnew)
+
+    frames = [numpy.random.poisson(100, (size, size)) for i in range(nframes)]
+    times = []
+    for nthreads in (1, 2, 4, 8):
+        times.append(min(timeit.Timer(lambda: compress_pck_frames(frames, nthreads)).repeat(NB, 1)))
+    print "%10s %10s %10s %10s %10s %10s" % ("frames", "1 thread", "2 threads", "4 threads", "8 threads", "cores")
+    print "%10i %10.4f %10.4f %10.4f %10.4f %10i" % tuple([nframes] + times + [multiprocessing.cpu_count()])
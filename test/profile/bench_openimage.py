@@ -0,0 +1,63 @@
+"""
+Benchmark openimage on compressed files: the former path (sniff the magic
+bytes on one stream, then let the class re-open and decompress the file) versus
+the single-open path where the sniffing stream is handed over to the class.
+
+usage: python bench_openimage.py [compressed images]
+Without argument, synthetic edf and tif images are generated together with
+the compressed images found in testimages.
+"""
+
+import timeit, os, sys, tempfile, shutil, bz2, gzip
+import numpy
+import fabio
+from fabio import openimage
+from fabio.edfimage import edfimage
+from fabio.tifimage import tifimage
+
+NB = 5
+
+
+def old_open(fname):
+    """ what openimage used to do: sniff, then re-open the same file """
+    klass = openimage._openimage(fname).__class__
+    return klass().read(fname).data
+
+
+def new_open(fname):
+    return openimage.openimage(fname).data
+
+
+def synthetic(tmpdir):
+    data = (numpy.random.random((2048, 2048)) * 1000).astype(numpy.uint16)
+    images = []
+    for obj, name in ((edfimage(data=data), "bench.edf"),
+                      (tifimage(data=data), "bench.tif")):
+        fname = os.path.join(tmpdir, name)
+        obj.write(fname)
+        raw = open(fname, "rb").read()
+        bz2.BZ2File(fname + ".bz2", "wb").write(raw)
+        gzip.open(fname + ".gz", "wb").write(raw)
+        images += [fname + ".bz2", fname + ".gz"]
+    return images
+
+if __name__ == "__main__":
+    tmpdir = tempfile.mkdtemp()
+    if len(sys.argv) > 1:
+        images = sys.argv[1:]
+    else:
+        images = synthetic(tmpdir)
+        if os.path.isdir("testimages"):
+            images += [os.path.join("testimages", i) for i in sorted(os.listdir("testimages"))
+                       if os.path.splitext(i)[1] in (".bz2", ".gz")]
+    print "%40s %10s %10s %8s" % ("image", "old (s)", "new (s)", "speed-up")
+    for im in images:
+        try:
+            fabio.open(im)
+        except Exception, error:
+            print "%40s skipped: %s" % (os.path.basename(im), error)
+            continue
+        told = min(timeit.Timer(lambda: old_open(im)).repeat(NB, 1))
+        tnew = min(timeit.Timer(lambda: new_open(im)).repeat(NB, 1))
+        print "%40s %10.4f %10.4f %8.2f" % (os.path.basename(im), told, tnew, told / tnew)
+    shutil.rmtree(tmpdir)
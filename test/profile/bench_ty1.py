@@ -0,0 +1,44 @@
+"""
+Benchmark of the TY1 codec of Oxford Diffraction (Agilent) images: numpy
+implementation versus the Cython one, on synthetic 2k x 2k
+frames (background, Bragg peaks and a few saturated pixels) or on the data
+of the images given on the command line.
+
+usage: python bench_ty1.py [OXD images]
+"""
+
+import timeit, sys, os
+import numpy
+import fabio
+from fabio.compression import decTY1, decTY1_numpy, compTY1, compTY1_numpy
+
+NB = 5
+
+
+def synthetic(npeaks):
+    data = numpy.random.poisson(30, size=(2048, 2048)).astype("int64")
+    y = numpy.random.randint(5, 2043, npeaks)
+    x = numpy.random.randint(5, 2043, npeaks)
+    intensity = numpy.random.randint(200, 60000, npeaks)
+    for dy in range(-2, 3):
+        for dx in range(-2, 3):
+            data[y + dy, x + dx] += intensity // (1 + dx * dx + dy * dy)
+    data[y[:npeaks // 50], x[:npeaks // 50]] = 2 ** 20 # saturated
+    return data
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        frames = [(os.path.basename(i), fabio.open(i).data.astype("int64")) for i in sys.argv[1:]]
+    else:
+        frames = [("2k peaks=%i" % n, synthetic(n)) for n in (100, 1000, 10000)]
+    print "%20s %8s %8s %10s %10s %8s %10s %10s %8s" % ("frame", "OI", "OL", "dec np (s)", "dec cy (s)", "x", "comp np (s)", "comp cy (s)", "x")
+    for name, data in frames:
+        raw = compTY1(data)
+        assert raw == compTY1_numpy(data)
+        assert (decTY1(*raw) == data.ravel()).all()
+        tdecn = min(timeit.Timer(lambda: decTY1_numpy(*raw)).repeat(NB, 1))
+        tdecc = min(timeit.Timer(lambda: decTY1(*raw)).repeat(NB, 1))
+        tcompn = min(timeit.Timer(lambda: compTY1_numpy(data)).repeat(NB, 1))
+        tcompc = min(timeit.Timer(lambda: compTY1(data)).repeat(NB, 1))
+        print "%20s %8i %8i %10.4f %10.4f %8.1f %10.4f %10.4f %8.1f" % (name, len(raw[1]) // 2, len(raw[2]) // 4,
+                                                                     tdecn, tdecc, tdecn / tdecc, tcompn, tcompc, tcompn / tcompc)
@@ -47,6 +47,8 @@ from testGEimage            import test_suite_all_GE
 from testheadernotsingleton import test_suite_all_header
 from testmar345image        import test_suite_all_mar345
 from testbrukerimage        import test_suite_all_bruker
+from testbruker100image     import test_suite_all_bruker100
+from testcompression        import test_suite_all_compression
 from testmccdimage          import test_suite_all_mccd
 from testopenheader         import test_suite_all_openheader
 from testopenimage          import test_suite_all_openimage
@@ -70,6 +72,8 @@ def test_suite_all():
     testSuite.addTest(test_suite_all_header())
     testSuite.addTest(test_suite_all_mar345())
     testSuite.addTest(test_suite_all_bruker())
+    testSuite.addTest(test_suite_all_bruker100())
+    testSuite.addTest(test_suite_all_compression())
     testSuite.addTest(test_suite_all_mccd())
     testSuite.addTest(test_suite_all_openheader())
     testSuite.addTest(test_suite_all_openimage())
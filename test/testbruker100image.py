@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+#bruker100 Unit tests
+
+#built on testbrukerimage, with synthetic frames
+"""
+
+import unittest, sys, os, logging, tempfile
+logger = logging.getLogger("testbruker100image")
+force_build = False
+
+for opts in sys.argv[:]:
+    if opts in ["-d", "--debug"]:
+        logging.basicConfig(level=logging.DEBUG)
+        sys.argv.pop(sys.argv.index(opts))
+    elif opts in ["-i", "--info"]:
+        logging.basicConfig(level=logging.INFO)
+        sys.argv.pop(sys.argv.index(opts))
+    elif opts in ["-f", "--force"]:
+        force_build = True
+        sys.argv.pop(sys.argv.index(opts))
+try:
+    logger.debug("Tests loaded from file: %s" % __file__)
+except:
+    __file__ = os.getcwd()
+
+from utilstest import UtilsTest
+if force_build:
+    UtilsTest.forceBuild()
+import fabio
+from fabio.bruker100image import bruker100image
+import numpy
+import bz2
+
+
+def pad16(table):
+    """ table as a string padded to 16 bytes """
+    raw = table.tostring()
+    return raw + "\x00" * (-len(raw) % 16)
+
+
+def make_frame(filename, data, npixelb=1, npixelb_under=1, baseline=0, underflow=True):
+    """
+    Write a synthetic format 100 frame holding the (int64) data
+
+    @return: number of entries in the underflow, 1-byte and 2-byte tables
+    """
+    flat = data.ravel()
+    if underflow:
+        stored = flat - baseline
+        under = numpy.flatnonzero(stored <= 0)
+        stored[under] = 0
+        tables = [flat[under].astype({1: numpy.uint8, 2: numpy.uint16}[npixelb_under])]
+    else:
+        stored = flat.copy()
+        tables = [None]
+    if npixelb == 1:
+        over1 = stored >= 255
+        tables.append(numpy.minimum(stored[over1], 65535).astype(numpy.uint16))
+    else:
+        tables.append(None)
+    tables.append(stored[stored >= 65535].astype(numpy.uint32))
+    image = numpy.minimum(stored, 2 ** (8 * npixelb) - 1).astype({1: numpy.uint8, 2: numpy.uint16}[npixelb])
+    noverfl = [-1 if tables[0] is None else tables[0].size] + [0 if t is None else t.size for t in tables[1:]]
+    lines = ["FORMAT :100", "VERSION:18", "HDRBLKS:5",
+             "NPIXELB:%i %i" % (npixelb, npixelb_under),
+             "NOVERFL:%i %i %i" % tuple(noverfl),
+             "NEXP   :1 0 %i 0 0" % baseline,
+             "NROWS  :%i" % data.shape[0], "NCOLS  :%i" % data.shape[1]]
+    header = "".join(line.ljust(80) for line in lines)
+    header += ("\x1a\x04" + "." * 78) * ((5 * 512 - len(header)) // 80)
+    with open(filename, "wb") as f:
+        f.write(header.ljust(5 * 512, "."))
+        f.write(image.tostring())
+        for table in tables:
+            if table is not None and table.size:
+                f.write(pad16(table))
+    return noverfl
+
+
+class testbruker100(unittest.TestCase):
+    """ read synthetic frames stressing each table """
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(".sfrm", "bruker100")
+        os.close(fd)
+        numpy.random.seed(0)
+        self.data = numpy.random.poisson(100, (128, 96)).astype(numpy.int64)
+
+    def tearDown(self):
+        for name in (self.filename, self.filename + ".bz2"):
+            if os.path.exists(name):
+                os.unlink(name)
+
+    def read(self, name=None):
+        obj = bruker100image()
+        obj.read(name or self.filename)
+        self.assertEqual(obj.data.shape, self.data.shape, "shape")
+        self.assertEqual(abs(obj.data.astype(numpy.int64) - self.data).max(), 0, "data are the same")
+        return obj
+
+    def test_no_table(self):
+        """ 2 bytes per pixel, no underflow table, no overflow """
+        self.data *= 10
+        self.assertEqual(make_frame(self.filename, self.data, npixelb=2, underflow=False), [-1, 0, 0])
+        self.assertEqual(self.read().data.dtype, numpy.uint16)
+
+    def test_overflow(self):
+        """ 1 byte per pixel with both overflow tables """
+        self.data[::7, ::5] = 1000
+        self.data[3, 4] = 70000
+        self.data[100, 50] = 65535
+        self.data[-1, -1] = 2 ** 31
+        noverfl = make_frame(self.filename, self.data, underflow=False)
+        self.assertTrue(noverfl[1] > 100 and noverfl[2] == 3, "tables are filled: %s" % noverfl)
+        self.assertEqual(self.read().data.dtype, numpy.uint32)
+
+    def test_overflow16(self):
+        """ 2 bytes per pixel with the 2-byte overflow table """
+        self.data *= 1000
+        self.data[5, 6] = 2 ** 20
+        noverfl = make_frame(self.filename, self.data, npixelb=2, underflow=False)
+        self.assertTrue(noverfl[2] > 10, "table is filled: %s" % noverfl)
+        self.read()
+
+    def test_underflow_baseline(self):
+        """ baseline offset with pixels below the baseline in the underflow table """
+        self.data -= 70
+        self.data[self.data < 0] = 0
+        self.data[10, 10] = 500
+        noverfl = make_frame(self.filename, self.data, baseline=32)
+        self.assertTrue(noverfl[0] > 100, "underflows: %s" % noverfl)
+        self.assertEqual(self.read().data.dtype, numpy.uint16)
+
+    def test_all_tables(self):
+        """ 2-byte underflows, baseline and both overflow tables, compressed file """
+        self.data[::3, ::4] = 0
+        self.data[::11, ::2] = 5000
+        self.data[50:52, 60:62] = 123456
+        noverfl = make_frame(self.filename, self.data, npixelb_under=2, baseline=64)
+        self.assertTrue(min(noverfl) > 0, "all tables are filled: %s" % noverfl)
+        self.read()
+        bz2.BZ2File(self.filename + ".bz2", "wb").write(open(self.filename, "rb").read())
+        self.read(self.filename + ".bz2")
+
+
+def test_suite_all_bruker100():
+    testSuite = unittest.TestSuite()
+    testSuite.addTest(testbruker100("test_no_table"))
+    testSuite.addTest(testbruker100("test_overflow"))
+    testSuite.addTest(testbruker100("test_overflow16"))
+    testSuite.addTest(testbruker100("test_underflow_baseline"))
+    testSuite.addTest(testbruker100("test_all_tables"))
+    return testSuite
+
+if __name__ == '__main__':
+    mysuite = test_suite_all_bruker100()
+    runner = unittest.TextTestRunner()
+    runner.run(mysuite)
@@ -124,6 +124,54 @@ class testbrukerLinear(unittest.TestCase):
         error = abs(new.data - self.data).max()
         self.assert_(error < numpy.finfo(numpy.float32).eps, "Error is %s>1e-7" % error)
 
+class testbrukerOverflow(unittest.TestCase):
+    """test the parsing of the overflow table and of the header"""
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp('0000', "bruker")
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_overflow(self):
+        """ many overflows are read back at their place """
+        data = numpy.random.randint(0, 60000, (300, 400)).astype("uint32")
+        idx = numpy.random.permutation(data.size)[:3000]
+        data.flat[idx] = numpy.random.randint(65535, 10 ** 8, idx.size)
+        obj = brukerimage(data=data)
+        obj.header["NOVERFL"] = str(idx.size)
+        obj.write(self.filename)
+        new = brukerimage()
+        new.read(self.filename)
+        self.assertEqual(new.data.shape, (300, 400))
+        self.assertEqual(abs(new.data - data).max(), 0, "data are the same")
+
+    def test_blank_overflow(self):
+        """ records padded with blanks instead of zeros """
+        raw = "%9i%7i" % (123456, 42) + "%09i%07i" % (4194304, 65535)
+        position, intensity = brukerimage._readoverflow(raw, 2)
+        self.assertEqual(list(position), [42, 65535])
+        self.assertEqual(list(intensity), [123456, 4194304])
+
+    def test_header(self):
+        """ keys repeated on several lines and colons in values """
+        lines = ["FORMAT :86", "VERSION:9", "HDRBLKS:15", "NPIXELB:1", "NOVERFL:0",
+                 "NROWS  :4", "NCOLS  :4", "TITLE  :first line", "TITLE  :second: line",
+                 "CREATED:Mon Oct 12 12:30:00 2026"]
+        header = "".join(i.ljust(80) for i in lines)
+        header += ("\x1a\x04" + "." * 78) * ((15 * 512 - len(header)) // 80)
+        header = header.ljust(15 * 512, ".")
+        with open(self.filename, "wb") as f:
+            f.write(header)
+            f.write(numpy.arange(16, dtype=numpy.uint8).tostring())
+        obj = brukerimage()
+        obj.read(self.filename)
+        self.assertEqual(obj.header["TITLE"], "first line" + os.linesep + "second: line")
+        self.assertEqual(obj.header["CREATED"], "Mon Oct 12 12:30:00 2026")
+        self.assertEqual(obj.header["datastart"], 15 * 512)
+        self.assertEqual(obj.header_keys[:3], ["FORMAT", "VERSION", "HDRBLKS"])
+        self.assertEqual(obj.data.max(), 15)
+
 
 # statistics come from fit2d I think
 # filename dim1 dim2 min max mean stddev
@@ -189,6 +237,9 @@ def test_suite_all_bruker():
     testSuite.addTest(test_real_im("test_read"))
     testSuite.addTest(test_real_im("test_write"))
     testSuite.addTest(testbrukerLinear("test_linear"))
+    testSuite.addTest(testbrukerOverflow("test_overflow"))
+    testSuite.addTest(testbrukerOverflow("test_blank_overflow"))
+    testSuite.addTest(testbrukerOverflow("test_header"))
     return testSuite
 
 if __name__ == '__main__':
@@ -8,7 +8,7 @@ Unit tests for CBF images based on references images taken from:
 http://pilatus.web.psi.ch/DATA/DATASETS/insulin_0.2/
 
 """
-import unittest, sys, os, logging, tempfile
+import unittest, sys, os, logging, tempfile, StringIO
 logger = logging.getLogger("testcbfimage")
 force_build = False
 
@@ -31,9 +31,10 @@ from utilstest import UtilsTest
 if force_build:
     UtilsTest.forceBuild()
 import fabio
-from fabio.cbfimage import cbfimage
-from fabio.compression import decByteOffet_numpy, decByteOffet_cython
+from fabio.cbfimage import cbfimage, CbfWriter
+from fabio.compression import decByteOffet_numpy, decByteOffet_cython, md5sum
 import time
+import numpy
 
 class test_cbfimage_reader(unittest.TestCase):
     """ test cbf image reader """
@@ -86,9 +87,8 @@ class test_cbfimage_reader(unittest.TestCase):
     def test_byte_offset(self):
         """ check byte offset algorythm"""
         cbf = fabio.open(self.cbf_filename)
-        starter = "\x0c\x1a\x04\xd5"
-        startPos = cbf.cif["_array_data.data"].find(starter) + 4
-        data = cbf.cif["_array_data.data"][ startPos: startPos + int(cbf.header["X-Binary-Size"])]
+        startPos = cbf.cif.binary_offset
+        data = open(self.cbf_filename, "rb").read()[ startPos: startPos + int(cbf.header["X-Binary-Size"])]
         startTime = time.time()
         numpyRes = decByteOffet_numpy(data, size=cbf.dim1 * cbf.dim2)
         tNumpy = time.time() - startTime
@@ -163,6 +163,216 @@ class test_cbfimage_reader(unittest.TestCase):
             self.assertEqual(obj.header[key], other.header[key], "value are the same for key %s [%s|%s]" % (key, obj.header[key], other.header[key]))
 
 
+class test_cbfimage_parallel(unittest.TestCase):
+    """ decoding of the byte-offset data in several threads """
+    def setUp(self):
+        import fabio.byte_offset
+        self.byte_offset = fabio.byte_offset
+        self.min_segment = fabio.byte_offset.MIN_SEGMENT
+        fabio.byte_offset.MIN_SEGMENT = 1000 # small enough to cut the test image
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "parallel.cbf")
+        self.data = numpy.random.randint(0, 1000, size=(200, 300)).astype("int32")
+        self.data[::7, ::11] = 2 ** 30
+        cbfimage(data=self.data).write(self.filename)
+
+    def tearDown(self):
+        self.byte_offset.MIN_SEGMENT = self.min_segment
+        UtilsTest.recursive_delete(self.tempdir)
+
+    def test_read(self):
+        for nthreads in (None, 1, 2, 5):
+            cbf = cbfimage().read(self.filename, nthreads=nthreads)
+            self.assertEqual(cbf.data.dtype, numpy.int32, "data type with %s threads" % nthreads)
+            self.assertEqual(abs(cbf.data - self.data).max(), 0, "data with %s threads" % nthreads)
+
+
+class test_cbfimage_header(unittest.TestCase):
+    """ header only reading, the binary data are read afterwards """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "header.cbf")
+        self.data = numpy.random.randint(0, 1000, size=(500, 400)).astype("int32")
+        self.data[::7, ::11] = 2 ** 30
+        cbfimage(data=self.data).write(self.filename)
+
+    def tearDown(self):
+        UtilsTest.recursive_delete(self.tempdir)
+
+    def test_openheader(self):
+        full = fabio.open(self.filename)
+        obj = fabio.openheader(self.filename)
+        self.assertTrue(isinstance(obj, cbfimage), "class is cbfimage")
+        self.assertEqual(obj.data, None, "data are not read")
+        for key in full.header:
+            self.assertEqual(obj.header[key], full.header[key], "value of key %s" % key)
+        raw = open(self.filename, "rb").read()
+        self.assertEqual(raw[obj.cif.binary_offset - 4:obj.cif.binary_offset], "\x0c\x1a\x04\xd5", "offset of the binary data")
+        obj.readData()
+        self.assertEqual(obj.dim1, 400, "dim1")
+        self.assertEqual(obj.dim2, 500, "dim2")
+        self.assertEqual(abs(obj.data - self.data).max(), 0, "data read after the header")
+
+    def test_read(self):
+        """ the compressed data are decoded from the file, mapped or not, and not kept """
+        for mmap in (True, False):
+            obj = cbfimage().read(self.filename, mmap=mmap)
+            self.assertEqual(abs(obj.data - self.data).max(), 0, "data with mmap=%s" % mmap)
+            self.assertFalse("\x0c\x1a\x04\xd5" in obj.cif["_array_data.data"], "compressed data are not in the CIF")
+            self.assertTrue("X-Binary-Size" in obj.header, "MIME header is read")
+        obj = cbfimage().read(self.filename, keepCif=False)
+        self.assertEqual(len(obj.cif), 0, "CIF dictionary is not kept")
+        self.assertEqual(obj.header["X-Binary-Size-Fastest-Dimension"], "400", "header is kept")
+
+    def test_trailer(self):
+        """ CIF items after the binary section """
+        with open(self.filename, "ab") as f:
+            f.write("\r\n_after.binary 'some value'\r\n")
+        obj = cbfimage().read(self.filename)
+        self.assertEqual(obj.header["_after.binary"], "some value", "item after the binary section")
+        self.assertEqual(abs(obj.data - self.data).max(), 0, "data")
+
+    def test_partial_read(self):
+        """ the binary data are not read from the stream """
+        from fabio.cbfimage import CIF
+        raw = open(self.filename, "rb").read()
+        stream = StringIO.StringIO(raw)
+        cif = CIF()
+        cif.loadCIF(stream, _bKeepComment=True, _bHeaderOnly=True)
+        self.assertTrue(stream.tell() < 10000, "read %s bytes out of %s" % (stream.tell(), len(raw)))
+        self.assertTrue("X-Binary-Size" in cif["_array_data.data"], "MIME header is kept")
+
+
+class test_cbfimage_multiframe(unittest.TestCase):
+    """ files with several binary sections """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "multi.cbf")
+        self.frames = [numpy.random.randint(0, 1000, size=(50, 40)).astype("int32"),
+                       numpy.random.randint(-100, 100, size=(30, 60)).astype("int16"),
+                       numpy.random.randint(0, 2 ** 20, size=(20, 20)).astype("int32")]
+        blocks = []
+        for i, data in enumerate(self.frames):
+            name = os.path.join(self.tempdir, "frame%i.cbf" % i)
+            cbfimage(data=data, header={"_diffrn_scan_frame.frame_id": "frame%i" % i}).write(name)
+            blocks.append(open(name, "rb").read())
+        with open(self.filename, "wb") as f:
+            f.write("\r\n".join(blocks) + "\r\n_after.last 'end'\r\n")
+
+    def tearDown(self):
+        UtilsTest.recursive_delete(self.tempdir)
+
+    def test_read(self):
+        obj = fabio.open(self.filename)
+        self.assertEqual(obj.nframes, 3, "number of sections")
+        self.assertEqual(obj.currentframe, 0, "first section")
+        self.assertEqual(abs(obj.data - self.frames[0]).max(), 0, "data of the first section")
+        self.assertEqual(obj.header["_diffrn_scan_frame.frame_id"], "frame0", "header of the first section")
+        for i in (1, 2):
+            other = cbfimage().read(self.filename, frame=i)
+            self.assertEqual(other.currentframe, i, "section read")
+            self.assertEqual(other.data.dtype, self.frames[i].dtype, "type of section %i" % i)
+            self.assertEqual(abs(other.data - self.frames[i]).max(), 0, "data of section %i" % i)
+            self.assertEqual(other.header["_diffrn_scan_frame.frame_id"], "frame%i" % i, "header of section %i" % i)
+        self.assertEqual(other.header["_after.last"], "end", "items after the last section")
+
+    def test_getframe(self):
+        obj = cbfimage().read(self.filename)
+        second = obj.next()
+        self.assertEqual(abs(second.data - self.frames[1]).max(), 0, "next")
+        self.assertEqual(second.header["X-Binary-Size-Fastest-Dimension"], "60", "MIME header of the section")
+        third = obj.getframe(2)
+        self.assertEqual(abs(third.data - self.frames[2]).max(), 0, "getframe")
+        self.assertEqual(third.nframes, 3, "number of frames")
+        self.assertEqual(abs(third.previous().data - self.frames[1]).max(), 0, "previous")
+        self.assertRaises(ValueError, third.next)
+
+
+class test_cbfwriter(unittest.TestCase):
+    """ batch writing of CBF files """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.frames = numpy.random.randint(0, 1000, size=(6, 50, 40)).astype("int32")
+        self.frames[:, ::5, ::7] = 2 ** 20
+
+    def tearDown(self):
+        UtilsTest.recursive_delete(self.tempdir)
+
+    def test_write(self):
+        for nthreads in (1, 3):
+            filenames = [os.path.join(self.tempdir, "frame_%i_%04i.cbf" % (nthreads, i)) for i in range(len(self.frames))]
+            headers = [{"_diffrn_scan_frame.frame_id": str(i)} for i in range(len(self.frames))]
+            with CbfWriter(header={"_diffrn.id": "test"}, nthreads=nthreads, max_pending=2) as writer:
+                writer.writeFrames(filenames[:3], self.frames[:3], headers[:3])
+                for i in range(3, len(self.frames)):
+                    writer.write(filenames[i], self.frames[i], headers[i])
+            self.assertEqual(writer.nframes, len(self.frames), "number of frames")
+            for i, filename in enumerate(filenames):
+                obj = cbfimage().read(filename)
+                self.assertEqual(abs(obj.data - self.frames[i]).max(), 0, "data of frame %i with %i threads" % (i, nthreads))
+                self.assertEqual(obj.header["_diffrn_scan_frame.frame_id"], str(i), "header of the frame")
+                self.assertEqual(obj.header["_diffrn.id"], "test", "common header")
+                raw = open(filename, "rb").read()
+                blob = raw[obj.cif.binary_offset:obj.cif.binary_offset + int(obj.header["X-Binary-Size"])]
+                self.assertEqual(obj.header["Content-MD5"], md5sum(blob), "MD5 of the compressed data")
+
+
+class test_cif_parser(unittest.TestCase):
+    """ tokenizer and loops of the CIF parser """
+    text = """data_test
+_simple value
+_quoted 'it's a quote'
+_double "a b"
+_word O5'
+_text
+;first line
+second line
+;
+loop_
+_atom.id
+_atom.name
+_atom.x
+1 "C A" 1.5
+2 N' 2.5
+_array_data.data
+;
+--CIF-BINARY-FORMAT-SECTION--
+X-Binary-Size: 4
+
+\x0c\x1a\x04\xd5a\n;b
+--CIF-BINARY-FORMAT-SECTION----
+;
+_last ?
+"""
+
+    def test_split(self):
+        from fabio.cbfimage import CIF
+        fields = CIF._splitCIF(self.text.strip())
+        self.assertEqual(fields[:11], ["data_test", "_simple", "value", "_quoted", "it's a quote", "_double", "a b",
+                                       "_word", "O5'", "_text", "first line\nsecond line"], "fields %s" % fields[:11])
+        self.assertEqual(fields[11:21], ["loop_", "_atom.id", "_atom.name", "_atom.x", "1", "C A", "1.5", "2", "N'", "2.5"], "loop fields")
+        self.assertTrue(fields[22].startswith("--CIF-BINARY-FORMAT-SECTION--") and fields[22].endswith("--CIF-BINARY-FORMAT-SECTION----"), "binary section is one field")
+        self.assertEqual(fields[23:], ["_last", "?"], "fields after the binary section")
+
+    def test_semicolon(self):
+        """ only a semicolon at the beginning of a line starts a text field """
+        from fabio.cbfimage import CIF
+        fields = CIF._splitCIF("_x a ;b\n_y ;\n_text\n;some ; text\n;\n_z 'q' ;c")
+        self.assertEqual(fields, ["_x", "a", ";b", "_y", ";", "_text", "some ; text", "_z", "q", ";c"], "fields %s" % fields)
+
+    def test_parse(self):
+        from fabio.cbfimage import CIF
+        cif = CIF()
+        cif._parseCIF(self.text)
+        self.assertEqual(cif["_quoted"], "it's a quote", "quoted value")
+        self.assertEqual(cif["_text"], "first line\nsecond line", "text field")
+        self.assertEqual(cif["_last"], "?", "value after the binary section")
+        self.assertEqual(cif["loop_"], [[["_atom.id", "_atom.name", "_atom.x"],
+                                         [{"_atom.id": "1", "_atom.name": "C A", "_atom.x": "1.5"},
+                                          {"_atom.id": "2", "_atom.name": "N'", "_atom.x": "2.5"}]]], "loop")
+        self.assertFalse("_atom.id" in cif, "keys of the loop are not in the dictionary")
+
+
 def test_suite_all_cbf():
     testSuite = unittest.TestSuite()
     testSuite.addTest(test_cbfimage_reader("test_read"))
@@ -171,6 +381,17 @@ def test_suite_all_cbf():
     testSuite.addTest(test_cbfimage_reader("test_consitency_manual"))
     testSuite.addTest(test_cbfimage_reader("test_consitency_convert"))
     testSuite.addTest(test_cbfimage_reader("test_unicode"))
+    testSuite.addTest(test_cbfimage_parallel("test_read"))
+    testSuite.addTest(test_cbfimage_header("test_openheader"))
+    testSuite.addTest(test_cbfimage_header("test_read"))
+    testSuite.addTest(test_cbfimage_header("test_trailer"))
+    testSuite.addTest(test_cbfimage_header("test_partial_read"))
+    testSuite.addTest(test_cbfimage_multiframe("test_read"))
+    testSuite.addTest(test_cbfimage_multiframe("test_getframe"))
+    testSuite.addTest(test_cbfwriter("test_write"))
+    testSuite.addTest(test_cif_parser("test_split"))
+    testSuite.addTest(test_cif_parser("test_semicolon"))
+    testSuite.addTest(test_cif_parser("test_parse"))
 
     return testSuite
 
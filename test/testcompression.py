@@ -55,6 +55,22 @@ class testbyteoffset(unittest.TestCase):
         self.assertEqual(ref, compression.compByteOffet_numpy(ds) , "test +10 -128")
         self.assertEqual(self.ref, compression.compByteOffet_numpy(self.ds) , "test larger")
 
+    def testCompCython(self):
+        """test that the cython compression gives the same string as the numpy one"""
+        from fabio.byte_offset import compressCython
+        self.assertEqual(self.ref, compressCython(self.ds), "test larger")
+        self.assertEqual("", compressCython(numpy.zeros(0, dtype="int32")), "empty")
+        numpy.random.seed(0)
+        for dtype in ("int8", "uint8", "int16", "uint16", "int32", "uint32", "int64", "float64"):
+            data = numpy.random.standard_cauchy(5000) * 10 ** numpy.random.randint(0, 12, 5000)
+            if dtype.startswith("int") or dtype.startswith("uint"):
+                data = data.clip(numpy.iinfo(dtype).min, numpy.iinfo(dtype).max)
+            data = data.astype(dtype).reshape(50, 100)
+            self.assertEqual(compressCython(data), compression.compByteOffet_numpy(data), "dtype %s" % dtype)
+            self.assertEqual(compressCython(data.T), compression.compByteOffet_numpy(data.T), "transposed %s" % dtype)
+        data = numpy.arange(-1000, 1000, 7, dtype=">i4")
+        self.assertEqual(compressCython(data), compression.compByteOffet_numpy(data), "big endian")
+
     def testSC(self):
         """test that datasets are unchanged after various comression/decompressions"""
 
@@ -67,14 +83,148 @@ class testbyteoffset(unittest.TestCase):
         obt_we = compression.decByteOffet_weave(compression.compByteOffet_numpy(self.ds), self.ds.size)
         self.assertEqual(abs(self.ds - obt_we).max(), 0.0, "weave algo")
 
+    def testNumpy(self):
+        """test that the numpy decoder gives the same result as the cython one"""
+        from fabio.byte_offset import analyseCython
+        self.assertEqual(compression.decByteOffet_numpy(self.ref).tolist(), self.ds.tolist(), "reference")
+        # markers inside the exceptions
+        for stream in ["", "\x05", "\x80\x80\x80\x01", "\x80\x00\x80\x80\x00\x80\x00\x80\x01",
+                       "\x80\x80\x00\x80\x00\x00\x00\x80\x80\x00\x80\x00\x00\x00\x80\x02\x80\x01\x80\x05"]:
+            for size in (None, 1, 3):
+                self.assertEqual(compression.decByteOffet_numpy(stream, size).tolist(),
+                                 analyseCython(stream, size).tolist(), "stream %r size %s" % (stream, size))
+        numpy.random.seed(0)
+        for i in range(200):
+            stream = numpy.random.choice([0x80, 0x00, 0x01, 0xff], size=60).astype("uint8").tostring() + "\x00" * 15
+            self.assertEqual(compression.decByteOffet_numpy(stream).tolist(),
+                             analyseCython(stream).tolist(), "random stream %r" % stream)
+
+    def testDtype(self):
+        """test the decompression into the final type or into an output array"""
+        from fabio.byte_offset import analyseCython
+        stream = compression.compByteOffet_numpy(self.ds[:30])
+        for decoder in (analyseCython, compression.decByteOffet_numpy):
+            for dtype in ("int64", "uint32", "float64"):
+                obt = decoder(stream, dtype=dtype)
+                self.assertEqual(obt.dtype, numpy.dtype(dtype), "%s dtype %s" % (decoder.__name__, dtype))
+                self.assertEqual(obt.tolist(), self.ds[:30].tolist(), "%s values in %s" % (decoder.__name__, dtype))
+            out = numpy.zeros((4, 5), dtype="int32")
+            obt = decoder(stream, out=out)
+            self.assertTrue(obt.base is out or obt.base is out.base, "%s decodes into out" % decoder.__name__)
+            self.assertEqual(out.ravel().tolist(), self.ds[:20].tolist(), "%s values in out" % decoder.__name__)
+            self.assertRaises(OverflowError, decoder, stream, dtype="int16")
+            self.assertRaises(OverflowError, decoder, compression.compByteOffet_numpy(numpy.array([1, -1])), dtype="uint8")
+            self.assertRaises(ValueError, decoder, stream, out=numpy.zeros((6, 5), dtype="int32").T)
+
+    def testChunked(self):
+        """test the decompression of a stream fed in pieces, or read from a file"""
+        import StringIO
+        from fabio.byte_offset import analyseCython, analyseFile, ByteOffsetDecoder
+        stream = compression.compByteOffet_numpy(self.ds)
+        # truncated exceptions are completed with zeros, as in the numpy decoder
+        for truncated in (stream[:-3], stream[:-13]):
+            self.assertEqual(analyseCython(truncated).tolist(), compression.decByteOffet_numpy(truncated).tolist(), "truncated stream")
+        for piece in (1, 2, 5, 16, 1000):
+            decoder = ByteOffsetDecoder(self.ds.size, dtype="int64")
+            for start in range(0, len(stream), piece):
+                decoder.feed(stream[start:start + piece])
+            self.assertEqual(decoder.feed("", final=True).result().tolist(), self.ds.tolist(), "pieces of %s bytes" % piece)
+            obt = analyseFile(StringIO.StringIO(stream + "\x05" * 10), self.ds.size, chunk=piece)
+            self.assertEqual(obt.tolist(), self.ds.tolist(), "file read by %s bytes" % piece)
+            infile = StringIO.StringIO(stream[:-13] + "\x05" * 10)
+            obt = analyseFile(infile, self.ds.size + 10, nbytes=len(stream) - 13, chunk=piece)
+            self.assertEqual(obt.tolist(), analyseCython(stream[:-13]).tolist(), "nbytes of the file read by %s bytes" % piece)
+        self.assertRaises(ValueError, analyseFile, StringIO.StringIO(stream))
+
+    def testParallel(self):
+        """test that the decompression in several threads gives the same result"""
+        import fabio.byte_offset
+        min_segment = fabio.byte_offset.MIN_SEGMENT
+        fabio.byte_offset.MIN_SEGMENT = 16 # cut even small streams
+        try:
+            numpy.random.seed(0)
+            for i in range(50):
+                stream = numpy.random.choice([0x80, 0x00, 0x01, 0xff], size=2000).astype("uint8").tostring()
+                ref = fabio.byte_offset.analyseCython(stream)
+                for nthreads in (2, 7):
+                    obt = compression.decByteOffet_cython(stream, nthreads=nthreads)
+                    self.assertEqual(obt.tolist(), ref.tolist(), "random stream with %s threads" % nthreads)
+                    obt = compression.decByteOffet_cython(stream, size=ref.size // 2, nthreads=nthreads)
+                    self.assertEqual(obt.tolist(), ref[:ref.size // 2].tolist(), "limited size with %s threads" % nthreads)
+            stream = compression.compByteOffet_numpy(numpy.concatenate((numpy.arange(100), self.ds)))
+            self.assertRaises(OverflowError, compression.decByteOffet_cython, stream, dtype="int16", nthreads=3)
+        finally:
+            fabio.byte_offset.MIN_SEGMENT = min_segment
+
+
+class testgzip(unittest.TestCase):
+    """
+    test the decompression of gzip streams
+    """
+    def setUp(self):
+        import gzip, StringIO
+        self.raw = numpy.arange(10000, dtype="int32").tostring()
+        buf = StringIO.StringIO()
+        gz = gzip.GzipFile(fileobj=buf, mode="wb")
+        gz.write(self.raw)
+        gz.close()
+        self.stream = buf.getvalue()
 
+    def testDec(self):
+        self.assertEqual(compression.decGzip(self.stream), self.raw, "single member")
+        self.assertEqual(compression.decGzip(self.stream + self.stream), self.raw + self.raw, "concatenated members")
+        self.assertEqual(compression.decGzip(self.stream + "\x00" * 10), self.raw, "trailing garbage")
 
 
+class testTY1(unittest.TestCase):
+    """
+    test the TY1 codec of Oxford Diffraction images (Cython versus numpy)
+    """
+    def setUp(self):
+        self.data = numpy.random.randint(0, 200, size=(64, 80)).astype("int64")
+        self.data[::3, ::7] += 5000     # 16 bits exceptions
+        self.data[::11, ::5] = 100000   # 32 bits exceptions
+
+    def testComp(self):
+        for data in (self.data, self.data.astype("int32"), self.data % 100):
+            self.assertEqual(compression.compTY1(data), compression.compTY1_numpy(data), "same streams for %s" % data.dtype)
+
+    def testDec(self):
+        for data, dtype in ((self.data, "int32"), (self.data % 3000, "int16"), (self.data % 100, "int8")):
+            raw_8, raw_16, raw_32 = compression.compTY1_numpy(data)
+            obt = compression.decTY1(raw_8, raw_16, raw_32)
+            self.assertEqual(obt.dtype, numpy.dtype(dtype), "smallest type")
+            self.assertEqual(abs(obt - data.ravel()).max(), 0, "round trip")
+            self.assertEqual(obt.tolist(), compression.decTY1_numpy(raw_8, raw_16, raw_32).tolist(), "same as numpy")
+        raw_8, raw_16, raw_32 = compression.compTY1(self.data)
+        # without overflow tables the markers are plain deltas, as in the numpy decoder
+        self.assertEqual(compression.decTY1(raw_8).tolist(), compression.decTY1_numpy(raw_8).tolist(), "no overflow tables")
+        self.assertRaises(ValueError, compression.decTY1, raw_8, raw_16[:10], raw_32)
+
+    def testNegative(self):
+        "negative values: the type holds the minimum as well, for both decoders"
+        for data, dtype in ((self.data % 100 - 200, "int16"), (self.data % 100 - 50, "int8"),
+                            (self.data % 3000 - 40000, "int32")):
+            raw_8, raw_16, raw_32 = compression.compTY1_numpy(data)
+            for decoder in (compression.decTY1, compression.decTY1_numpy):
+                obt = decoder(raw_8, raw_16, raw_32)
+                self.assertEqual(obt.dtype, numpy.dtype(dtype), "smallest type with %s" % decoder.__name__)
+                self.assertEqual(abs(obt - data.ravel()).max(), 0, "round trip with %s" % decoder.__name__)
+
 
 def test_suite_all_compression():
     testSuite = unittest.TestSuite()
+    testSuite.addTest(testbyteoffset("testComp"))
     testSuite.addTest(testbyteoffset("testSC"))
-    testSuite.addTest(testbyteoffset("testSC"))
+    testSuite.addTest(testbyteoffset("testCompCython"))
+    testSuite.addTest(testbyteoffset("testNumpy"))
+    testSuite.addTest(testbyteoffset("testDtype"))
+    testSuite.addTest(testbyteoffset("testChunked"))
+    testSuite.addTest(testbyteoffset("testParallel"))
+    testSuite.addTest(testTY1("testComp"))
+    testSuite.addTest(testTY1("testDec"))
+    testSuite.addTest(testTY1("testNegative"))
+    testSuite.addTest(testgzip("testDec"))
     return testSuite
 
 if __name__ == '__main__':
@@ -6,7 +6,7 @@
 
 # builds on stuff from ImageD11.test.testpeaksearch
 """
-import unittest, sys, os, logging, tempfile
+import unittest, sys, os, logging, tempfile, threading
 logger = logging.getLogger("testedfimage")
 force_build = False
 
@@ -29,9 +29,10 @@ from utilstest import UtilsTest
 if force_build:
     UtilsTest.forceBuild()
 import fabio
-from fabio.edfimage import edfimage
+from fabio.edfimage import edfimage, Frame, FrameTable, EdfWriter
+from fabio.compression import compByteOffet_numpy
 import numpy
-import gzip, bz2
+import gzip, bz2, zlib
 
 
 
@@ -309,6 +310,438 @@ class testedfwrite(unittest.TestCase):
     def tearDown(self):
         os.unlink(self.filename)
         os.rmdir(self.tmpdir)
+class testedfmmap(unittest.TestCase):
+    """
+    Memory-mapped access to uncompressed frames
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="testedfmmap")
+        self.data = numpy.arange(120 * 100, dtype="uint16").reshape((100, 120))
+        self.filename = os.path.join(self.tmpdir, "mmap.edf")
+        e = edfimage(data=self.data)
+        e.appendFrame(data=self.data[::-1].copy())
+        e.write(self.filename)
+
+    def tearDown(self):
+        UtilsTest.recursive_delete(self.tmpdir)
+
+    def test_read(self):
+        e = edfimage().read(self.filename, mmap=True)
+        self.assertTrue(isinstance(e.data, numpy.memmap), "data are mapped")
+        self.assertFalse(e.data.flags.writeable, "mapped data are read-only")
+        self.assertEqual(abs(e.data - self.data).max(), 0, "frame 0 is OK")
+        self.assertEqual(abs(e.getframe(1).data - self.data[::-1]).max(), 0, "frame 1 is OK")
+        plain = edfimage().read(self.filename)
+        self.assertFalse(isinstance(plain.data, numpy.memmap), "mmap is opt-in")
+
+    def test_byteorder(self):
+        """ swapped data are viewed with a non-native dtype, not copied """
+        block = Frame(data=self.data.byteswap()).getEdfBlock()
+        if numpy.little_endian:
+            block = block.replace("LowByteFirst ;", "HighByteFirst;")
+        else:
+            block = block.replace("HighByteFirst ;", "LowByteFirst  ;")
+        with open(self.filename, "wb") as f:
+            f.write(block)
+        e = edfimage().read(self.filename, mmap=True)
+        self.assertFalse(e.data.dtype.isnative, "dtype view on the byte order")
+        self.assertEqual(abs(e.data - self.data).max(), 0, "data are OK")
+        e.write(self.filename + "2")
+        self.assertEqual(abs(fabio.open(self.filename + "2").data - self.data).max(), 0, "written back OK")
+
+    def test_compressed(self):
+        """ compressed files are read as usual """
+        raw = open(self.filename, "rb").read()
+        gzip.open(self.filename + ".gz", "wb").write(raw)
+        e = edfimage().read(self.filename + ".gz", mmap=True)
+        self.assertFalse(isinstance(e.data, numpy.memmap), "no mapping of compressed files")
+        self.assertEqual(abs(e.data - self.data).max(), 0, "data are OK")
+
+
+class testedfindex(unittest.TestCase):
+    """
+    Sidecar index with the position of the frames of a multi-frame file
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="testedfindex")
+        self.filename = os.path.join(self.tmpdir, "index.edf")
+        self.indexname = self.filename + fabio.edfimage.INDEX_EXTENSION
+        self.data = [numpy.random.randint(0, 1000, size=(50, 60)).astype("int32") for i in range(3)]
+        e = edfimage(data=self.data[0], header={"frame": 0})
+        for i, data in enumerate(self.data[1:]):
+            e.appendFrame(data=data, header={"frame": i + 1})
+        e.write(self.filename)
+
+    def tearDown(self):
+        UtilsTest.recursive_delete(self.tmpdir)
+
+    def check(self, e):
+        self.assertEqual(e.nframes, len(self.data), "number of frames")
+        for i, data in enumerate(self.data):
+            frame = e.getframe(i)
+            self.assertEqual(abs(frame.data - data).max(), 0, "data of frame %s" % i)
+            self.assertEqual(int(frame.header["frame"]), i, "header of frame %s" % i)
+
+    def test_index(self):
+        self.check(edfimage().read(self.filename, index=True))
+        self.assertTrue(os.path.isfile(self.indexname), "index written")
+        e = edfimage().read(self.filename, index=True)
+        self.assertNotEqual(e._edfimage__frames[2]._block, None, "headers parsed on demand")
+        self.assertEqual(e.getframe(2).dims, [60, 50], "dims from the index")
+        self.check(e)
+
+    def test_outdated(self):
+        fabio.edfimage.build_index(self.filename)
+        self.data = self.data[:2]
+        e = edfimage(data=self.data[0], header={"frame": 0})
+        e.appendFrame(data=self.data[1], header={"frame": 1})
+        e.write(self.filename)
+        self.check(edfimage().read(self.filename, index=True))
+        self.check(edfimage().read(self.filename, index=True))
+
+    def test_background(self):
+        done = []
+        thread = fabio.edfimage.build_index_background(self.filename, lambda fname, nb: done.append(nb))
+        thread.join()
+        self.assertEqual(done, [len(self.data)], "callback called")
+        self.assertTrue(os.path.isfile(self.indexname), "index written")
+        self.check(edfimage().read(self.filename, index=True))
+
+
+class testedfframetable(unittest.TestCase):
+    """
+    Frames of a multi-frame file are described by a compact table,
+    Frame objects being created only on access
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="testedfframetable")
+        self.filename = os.path.join(self.tmpdir, "table.edf")
+        self.data = [numpy.zeros((20, 30), dtype="uint16") + i for i in range(5)]
+        e = edfimage(data=self.data[0], header={"frame": 0})
+        for i, data in enumerate(self.data[1:]):
+            e.appendFrame(data=data, header={"frame": i + 1})
+        e.write(self.filename)
+
+    def tearDown(self):
+        UtilsTest.recursive_delete(self.tmpdir)
+
+    def test_lazy(self):
+        parsed_headers = FrameTable.PARSED_HEADERS
+        FrameTable.PARSED_HEADERS = 1
+        try:
+            e = edfimage().read(self.filename)
+        finally:
+            FrameTable.PARSED_HEADERS = parsed_headers
+        table = e._edfimage__frames
+        self.assertTrue(isinstance(table, FrameTable), "frames in a table")
+        self.assertEqual(len(table), 5, "number of frames")
+        self.assertEqual(table._frames.keys(), [0], "only the first frame object created by read")
+        f3 = e.getframe(3)
+        self.assertEqual(f3.data.max(), 3, "data of frame 3")
+        self.assertEqual(f3.header["frame"], "3", "header of frame 3")
+        self.assertEqual(f3.next().data.max(), 4, "next")
+        self.assertEqual(f3.previous().data.max(), 2, "previous")
+        self.assertEqual(sorted(table._frames.keys()), [0, 2, 3, 4], "only accessed frames are created")
+
+    def test_template(self):
+        "headers parsed on demand re-use the keys of the file"
+        parsed_headers = FrameTable.PARSED_HEADERS
+        FrameTable.PARSED_HEADERS = 1
+        try:
+            e = edfimage().read(self.filename)
+        finally:
+            FrameTable.PARSED_HEADERS = parsed_headers
+        table = e._edfimage__frames
+        keys = table._template[0][0]
+        f3 = e.getframe(3)
+        self.assertEqual(f3.header["frame"], "3", "header of frame 3")
+        self.assertEqual(f3.header_keys, keys, "same keys as the frames read")
+        self.assertTrue(all(a is b for a, b in zip(f3.header_keys, keys)), "keys from the template")
+        self.assertFalse(f3.header_keys is keys, "key list copied")
+
+    def test_parsed_once(self):
+        "the headers of the first frames are kept as parsed by read"
+        calls = []
+        parseheader = Frame.parseheader
+        def counting(frame, block, template=None):
+            calls.append(block)
+            return parseheader(frame, block, template)
+        Frame.parseheader = counting
+        try:
+            e = edfimage().read(self.filename)
+            headers = [e.getframe(i).header["frame"] for i in range(5)]
+        finally:
+            Frame.parseheader = parseheader
+        self.assertEqual(headers, [str(i) for i in range(5)], "headers")
+        self.assertEqual(len(calls), 5, "each header parsed once")
+
+    def test_columns(self):
+        "columns are only converted to arrays when used"
+        e = edfimage().read(self.filename)
+        table = e._edfimage__frames
+        self.assertEqual(e.getframe(4).data.max(), 4, "frames kept parsed")
+        self.assertFalse(table._columns is None, "columns not converted")
+        self.assertEqual(len(table), 5, "number of frames")
+        self.assertEqual(table.dims.tolist(), [[30, 20]] * 5, "dims")
+        self.assertTrue(table._columns is None, "columns converted")
+        self.assertEqual(table.start.dtype, numpy.int64, "start")
+        self.assertEqual(len(table), 5, "number of frames")
+
+    def test_modify(self):
+        e = edfimage().read(self.filename)
+        e.deleteFrame(1)
+        e.appendFrame(data=self.data[0] + 10, header={"frame": 10})
+        e.write(self.filename + "2")
+        r = edfimage().read(self.filename + "2")
+        self.assertEqual(r.nframes, 5, "number of frames")
+        self.assertEqual([int(r.getframe(i).header["frame"]) for i in range(5)], [0, 2, 3, 4, 10], "frames order")
+        self.assertEqual([r.getframe(i).data.max() for i in range(5)], [0, 2, 3, 4, 10], "frames data")
+
+    def test_empty(self):
+        "files without any frame give an empty table, as before"
+        for name, content in (("empty.edf", ""), ("noheader.edf", "no EDF header\n" * 10)):
+            filename = os.path.join(self.tmpdir, name)
+            with open(filename, "wb") as f:
+                f.write(content)
+            e = edfimage().read(filename)
+            self.assertEqual(e.nframes, 0, "no frame in %s" % name)
+            self.assertEqual(len(e._edfimage__frames), 0, "empty table for %s" % name)
+
+
+class testedfconcurrent(unittest.TestCase):
+    """
+    Concurrent reads of the frames of a multi-frame file
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="testedfconcurrent")
+        self.filename = os.path.join(self.tmpdir, "concurrent.edf")
+        self.data = numpy.random.randint(0, 60000, size=(8, 40, 30)).astype("uint16")
+        e = edfimage(data=self.data[0])
+        for data in self.data[1:]:
+            e.appendFrame(data=data)
+        e.write(self.filename)
+
+    def tearDown(self):
+        UtilsTest.recursive_delete(self.tmpdir)
+
+    def test_pread(self):
+        f = fabio.fabioutils.File(self.filename)
+        raw = open(self.filename, "rb").read()
+        results = {}
+        def read(offset):
+            results[offset] = f.pread(offset, 1000)
+        threads = [threading.Thread(target=read, args=(offset,)) for offset in range(0, 8000, 500)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for offset, value in results.items():
+            self.assertEqual(value, raw[offset:offset + 1000], "pread at %s" % offset)
+        self.assertEqual(f.tell(), 0, "file position unchanged")
+        f.close()
+
+    def test_pread_handles(self):
+        "without os.pread, one handle per thread, closed with the file"
+        pread = getattr(os, "pread", None)
+        if pread is not None:
+            del os.pread
+        try:
+            f = fabio.fabioutils.File(self.filename)
+            threads = [threading.Thread(target=f.pread, args=(offset, 10)) for offset in (0, 100, 200)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            handles = f._File__handles.values()
+            f.close()
+        finally:
+            if pread is not None:
+                os.pread = pread
+        self.assertTrue(1 <= len(handles) <= 3, "at most one handle per thread")
+        self.assertTrue(all(handle.closed for handle in handles), "handles closed with the file")
+
+    def test_readFrames(self):
+        e = edfimage().read(self.filename)
+        stack = e.readFrames(nthreads=4)
+        self.assertEqual(abs(stack - self.data).max(), 0, "all frames")
+        self.assertTrue(e._edfimage__frames[1]._data is None, "data not cached in the frames")
+        out = numpy.zeros((3, 40, 30), dtype="uint16")
+        res = e.readFrames([5, 1, 7], out=out, nthreads=2)
+        self.assertTrue(res is out, "output array re-used")
+        self.assertEqual(abs(out - self.data[[5, 1, 7]]).max(), 0, "selected frames")
+        self.assertRaises(ValueError, e.readFrames, [1, 2], numpy.zeros((3, 40, 30)))
+
+    def test_compressed(self):
+        raw = open(self.filename, "rb").read()
+        gzip.open(self.filename + ".gz", "wb").write(raw)
+        e = edfimage().read(self.filename + ".gz")
+        self.assertEqual(abs(e.readFrames(nthreads=3) - self.data).max(), 0, "gzipped file")
+
+
+class testedfwriter(unittest.TestCase):
+    """
+    Streaming writer, appending frames to a file
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="testedfwriter")
+        self.filename = os.path.join(self.tmpdir, "stream.edf")
+        self.data = numpy.random.randint(0, 1000, size=(6, 10, 12)).astype("int32")
+
+    def tearDown(self):
+        UtilsTest.recursive_delete(self.tmpdir)
+
+    def test_write(self):
+        with EdfWriter(self.filename) as writer:
+            for i, data in enumerate(self.data[:4]):
+                self.assertEqual(writer.write(data, {"frame": i}), i, "frame number")
+        with EdfWriter(self.filename, append=True) as writer:
+            for i, data in enumerate(self.data[4:]):
+                self.assertEqual(writer.write(data, {"frame": i + 4}), i + 4, "frame number when appending")
+        e = edfimage().read(self.filename)
+        self.assertEqual(e.nframes, 6, "number of frames")
+        for i, data in enumerate(self.data):
+            frame = e.getframe(i)
+            self.assertEqual(abs(frame.data - data).max(), 0, "data of frame %s" % i)
+            self.assertEqual(int(frame.header["frame"]), i, "header of frame %s" % i)
+            self.assertEqual(int(frame.header["Image"]), i, "image number of frame %s" % i)
+
+    def test_flush(self):
+        writer = EdfWriter(self.filename, flush_frames=2)
+        writer.write(self.data[0])
+        self.assertEqual(os.path.getsize(self.filename), 0, "not flushed after one frame")
+        writer.write(self.data[1])
+        self.assertTrue(os.path.getsize(self.filename) > 0, "flushed after two frames")
+        writer.close()
+
+    def test_in_progress(self):
+        writer = EdfWriter(self.filename)
+        for data in self.data[:3]:
+            writer.write(data)
+        block = Frame(data=self.data[3], number=3).getEdfBlock()
+        for partial in (block[:100], block[:600]):
+            writer.file.write(partial)
+            writer.flush()
+            e = edfimage().read(self.filename)
+            last = e.getLastCompleteFrame()
+            self.assertEqual(abs(last.data - self.data[2]).max(), 0, "last complete frame")
+            writer.file.seek(-len(partial), os.SEEK_END)
+            writer.file.truncate()
+        writer.close()
+
+    def test_append_interrupted(self):
+        "appending after an interrupted writer drops the torn frame"
+        block = Frame(data=self.data[2], number=2).getEdfBlock()
+        for partial in (block[:100], block[:-10]):
+            with EdfWriter(self.filename) as writer:
+                for data in self.data[:2]:
+                    writer.write(data)
+                writer.file.write(partial)
+            with EdfWriter(self.filename, append=True) as writer:
+                self.assertEqual(writer.nframes, 2, "complete frames counted")
+                for data in self.data[2:4]:
+                    writer.write(data)
+            e = edfimage().read(self.filename)
+            self.assertEqual(e.nframes, 4, "number of frames")
+            for i, data in enumerate(self.data[:4]):
+                self.assertEqual(abs(e.getframe(i).data - data).max(), 0, "data of frame %s" % i)
+
+
+class testedfcompressedstack(unittest.TestCase):
+    """
+    Batch decompression of multi-frame files with compressed data blocks
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="testedfcompressedstack")
+        self.filename = os.path.join(self.tmpdir, "compressed.edf")
+        self.data = numpy.random.randint(0, 60000, size=(6, 40, 30)).astype("uint16")
+        compressors = {"Z": zlib.compress, "BZ2": bz2.compress, "GZIP": self.gzip,
+                       "BYTE_OFFSET": lambda raw: compByteOffet_numpy(numpy.fromstring(raw, "uint16"))}
+        with open(self.filename, "wb") as f:
+            for i, data in enumerate(self.data):
+                compression = ["Z", "BZ2", "GZIP", "BYTE_OFFSET"][i % 4]
+                raw = data.tostring()
+                comp = compressors[compression](raw)
+                header = {"Compression": compression, "Size": len(comp)}
+                block = Frame(data=data, header=header, number=i).getEdfBlock()
+                f.write(block[:-len(raw)].replace("Size = %i ;" % len(raw), "Size = %i ;" % len(comp)) + comp)
+
+    @staticmethod
+    def gzip(raw):
+        import StringIO
+        buf = StringIO.StringIO()
+        gz = gzip.GzipFile(fileobj=buf, mode="wb")
+        gz.write(raw)
+        gz.close()
+        return buf.getvalue()
+
+    def tearDown(self):
+        UtilsTest.recursive_delete(self.tmpdir)
+
+    def test_threads(self):
+        e = edfimage().read(self.filename)
+        self.assertEqual(e.getframe(1).header["Compression"], "BZ2", "compressed frames")
+        stats = {}
+        out = numpy.zeros(self.data.shape, dtype="uint16")
+        e.readFrames(out=out, nthreads=3, stats=stats)
+        self.assertEqual(abs(out - self.data).max(), 0, "decompressed data")
+        self.assertEqual(stats["frames"], 6, "frames reported")
+        self.assertEqual(stats["bytes_decoded"], self.data.nbytes, "bytes reported")
+        self.assertTrue(stats["throughput"] > 0, "throughput reported")
+
+    def test_processes(self):
+        e = edfimage().read(self.filename)
+        out = e.readFrames([5, 0, 3], nthreads=2, processes=True)
+        self.assertEqual(abs(out - self.data[[5, 0, 3]]).max(), 0, "decompressed data")
+
+    def test_byteoffset(self):
+        e = edfimage().read(self.filename)
+        frame = e.getframe(3)
+        self.assertEqual(frame.header["Compression"], "BYTE_OFFSET", "byte offset frame")
+        self.assertEqual(frame.data.dtype, numpy.uint16, "decoded in the type of the dataset")
+        self.assertEqual(abs(frame.data - self.data[3]).max(), 0, "decompressed data")
+        out = numpy.zeros((40, 30), dtype="uint16")
+        self.assertTrue(e._edfimage__frames[3]._decode(out) is out, "decoded into out")
+        self.assertEqual(abs(out - self.data[3]).max(), 0, "data decoded into out")
+
+
+class testedfheaderparser(unittest.TestCase):
+    """
+    Header blocks are parsed in a single pass,
+    keys of the previous frame being re-used as template
+    """
+    block = "\nHeaderID = EH:000001:000000:000000 ;\nImage = 1 ;\nByteOrder = LowByteFirst ;\n" \
+            "DataType = UnsignedShort ;\nDim_1 = 30 ;\nDim_2 = 20 ;\nSize = 1200 ;\n" \
+            "title = a = b ;\nempty = ;\n no equal sign ;\ncount\x00 = 1\x00 ;\n" + " " * 10 + "\n"
+
+    def test_parse(self):
+        f = Frame()
+        self.assertEqual(f.parseheader(self.block), 1200, "size")
+        self.assertEqual(f.header_keys, ["HeaderID", "Image", "ByteOrder", "DataType", "Dim_1", "Dim_2",
+                                         "Size", "title", "empty", "count"], "keys in order")
+        self.assertEqual(f.header["title"], "a = b", "value containing =")
+        self.assertEqual(f.header["empty"], "", "empty value")
+        self.assertEqual(f.header["count"], "1", "null bytes")
+        self.assertEqual(f.capsHeader["DIM_1"], "Dim_1", "caps header")
+        self.assertEqual(f.dims, [30, 20], "dims")
+        f.parseheader(self.block + "last = 5")
+        self.assertEqual(f.header["last"], "5", "last item without ;")
+
+    def test_template(self):
+        f = Frame()
+        f.parseheader(self.block)
+        template = (f.header_keys, f.capsHeader)
+        g = Frame()
+        g.parseheader(self.block.replace("Image = 1 ;", "Image = 2 ;"), template)
+        self.assertEqual(g.header_keys, f.header_keys, "same keys")
+        self.assertTrue(g.header_keys[1] is f.header_keys[1], "keys re-used from template")
+        self.assertFalse(g.capsHeader is f.capsHeader, "caps header copied")
+        self.assertEqual(g.header["Image"], "2", "value updated")
+        # a different set of keys does not use the template
+        g.parseheader(self.block.replace("Image = 1 ;", "Other = 2 ;"), template)
+        self.assertEqual(g.header_keys[1], "Other", "new key")
+        self.assertFalse("IMAGE" in g.capsHeader, "caps header rebuilt")
+        self.assertEqual(g.capsHeader["OTHER"], "Other", "caps header rebuilt")
+
 
 def test_suite_all_edf():
     testSuite = unittest.TestSuite()
@@ -331,6 +764,31 @@ def test_suite_all_edf():
     testSuite.addTest(testedfwrite("testFlat"))
     testSuite.addTest(testedfwrite("testGzip"))
     testSuite.addTest(testedfwrite("testBzip2"))
+    testSuite.addTest(testedfmmap("test_read"))
+    testSuite.addTest(testedfmmap("test_byteorder"))
+    testSuite.addTest(testedfmmap("test_compressed"))
+    testSuite.addTest(testedfindex("test_index"))
+    testSuite.addTest(testedfindex("test_outdated"))
+    testSuite.addTest(testedfindex("test_background"))
+    testSuite.addTest(testedfframetable("test_lazy"))
+    testSuite.addTest(testedfframetable("test_modify"))
+    testSuite.addTest(testedfframetable("test_empty"))
+    testSuite.addTest(testedfframetable("test_parsed_once"))
+    testSuite.addTest(testedfframetable("test_columns"))
+    testSuite.addTest(testedfframetable("test_template"))
+    testSuite.addTest(testedfconcurrent("test_pread"))
+    testSuite.addTest(testedfconcurrent("test_pread_handles"))
+    testSuite.addTest(testedfconcurrent("test_readFrames"))
+    testSuite.addTest(testedfconcurrent("test_compressed"))
+    testSuite.addTest(testedfwriter("test_write"))
+    testSuite.addTest(testedfwriter("test_flush"))
+    testSuite.addTest(testedfwriter("test_in_progress"))
+    testSuite.addTest(testedfwriter("test_append_interrupted"))
+    testSuite.addTest(testedfcompressedstack("test_threads"))
+    testSuite.addTest(testedfcompressedstack("test_processes"))
+    testSuite.addTest(testedfcompressedstack("test_byteoffset"))
+    testSuite.addTest(testedfheaderparser("test_parse"))
+    testSuite.addTest(testedfheaderparser("test_template"))
 
     return testSuite
 
@@ -5,7 +5,8 @@
 
 # builds on stuff from ImageD11.test.testpeaksearch
 """
-import unittest, sys, os, logging, tempfile
+import unittest, sys, os, logging, tempfile, gzip, bz2
+import numpy
 logger = logging.getLogger("testmar345image")
 force_build = False
 
@@ -28,7 +29,8 @@ from utilstest import UtilsTest
 if force_build:
     UtilsTest.forceBuild()
 import fabio
-from fabio.mar345image import mar345image
+from fabio.mar345image import mar345image, writeFrames
+from fabio.mar345_IO import compress_pck, compress_pck_frames
 
 # filename dim1 dim2 min max mean stddev
 TESTIMAGES = """example.mar2300     2300 2300 0 999999 180.15 4122.67
@@ -92,12 +94,69 @@ class testMAR345(unittest.TestCase):
                 print i
 
 
+class testPCK(unittest.TestCase):
+    """
+    Test the in-memory PCK compression on synthetic images
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        numpy.random.seed(0)
+        self.frames = [numpy.random.poisson(100 * (i + 1), (300, 300)).astype(numpy.int32) for i in range(3)]
+        self.frames[1][10, 20] = 100000
+        self.frames[2][:5] = 0
+
+    def tearDown(self):
+        UtilsTest.recursive_delete(self.tempdir)
+
+    def test_compress(self):
+        "packed stream starts with the CCP4 line and is the same for each call"
+        for data in self.frames:
+            packed = compress_pck(data)
+            self.assertTrue(packed.startswith("\nCCP4 packed image, X: 0300, Y: 0300\n"), "identifier")
+            self.assertEqual(packed, compress_pck(data), "stable")
+        self.assertEqual(compress_pck_frames(self.frames, nthreads=3), [compress_pck(i) for i in self.frames], "parallel")
+
+    def test_write_frames(self):
+        "frames written in parallel are read back unchanged"
+        filenames = [os.path.join(self.tempdir, "frame%i.mar2300" % i) for i in range(len(self.frames))]
+        writeFrames(filenames, self.frames, nthreads=3)
+        for filename, data in zip(filenames, self.frames):
+            other = mar345image()
+            other.read(filename)
+            self.assertEqual(abs(other.data - data).max(), 0, "data are the same for %s" % filename)
+
+    def test_read_buffer(self):
+        "compressed files and buffers are decoded in memory, without temporary file"
+        data = self.frames[1]
+        filename = os.path.join(self.tempdir, "frame.mar2300")
+        mar345image(data=data).write(filename)
+        raw = open(filename, "rb").read()
+        gzip.open(filename + ".gz", "wb").write(raw)
+        bz2.BZ2File(filename + ".bz2", "wb").write(raw)
+        mkstemp = tempfile.mkstemp
+        def no_tempfile(*args, **kwargs):
+            raise AssertionError("temporary file created")
+        tempfile.mkstemp = no_tempfile
+        try:
+            for name in (filename, filename + ".gz", filename + ".bz2"):
+                obj = fabio.open(name)
+                self.assertEqual(abs(obj.data - data).max(), 0, "data are the same for %s" % name)
+                self.assertEqual(obj.header["NumHigh"], 1, "overflow pixel in %s" % name)
+        finally:
+            tempfile.mkstemp = mkstemp
+        for buf in (raw, bytearray(raw), memoryview(raw), numpy.frombuffer(raw, dtype=numpy.uint8)):
+            obj = mar345image().readBuffer(buf)
+            self.assertEqual(abs(obj.data - data).max(), 0, "data are the same for %s" % type(buf))
+
 
 def test_suite_all_mar345():
     testSuite = unittest.TestSuite()
     testSuite.addTest(testMAR345("test_read"))
     testSuite.addTest(testMAR345("test_write"))
     testSuite.addTest(testMAR345("test_memoryleak"))
+    testSuite.addTest(testPCK("test_compress"))
+    testSuite.addTest(testPCK("test_write_frames"))
+    testSuite.addTest(testPCK("test_read_buffer"))
 
     return testSuite
 
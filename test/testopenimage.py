@@ -37,6 +37,9 @@ from fabio.fit2dmaskimage import fit2dmaskimage
 from fabio.OXDimage import OXDimage
 from fabio.brukerimage import brukerimage
 from fabio.adscimage import adscimage
+from fabio.tifimage import tifimage
+import fabio.fabioutils
+import numpy, tempfile, bz2, gzip
 
 class testopenedf(unittest.TestCase):
     """openimage opening edf"""
@@ -201,6 +204,152 @@ class testOXDUNC(testOXD):
         self.fname = UtilsTest.getimage(self.__class__.fname)[:-4]
 
 
+class testsingleopen(unittest.TestCase):
+    """openimage opens compressed files only once"""
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="testsingleopen")
+        self.data = numpy.arange(120 * 100, dtype="uint16").reshape((100, 120))
+        self.opened = []
+        self.BZ2File = fabio.fabioutils.BZ2File
+        self.GzipFile = fabio.fabioutils.GzipFile
+        opened = self.opened
+        BZ2File, GzipFile = self.BZ2File, self.GzipFile
+        class CountedBZ2File(BZ2File):
+            def __init__(self, *args, **kwargs):
+                opened.append(args[0])
+                BZ2File.__init__(self, *args, **kwargs)
+        class CountedGzipFile(GzipFile):
+            def __init__(self, *args, **kwargs):
+                opened.append(args[0])
+                GzipFile.__init__(self, *args, **kwargs)
+        fabio.fabioutils.BZ2File = CountedBZ2File
+        fabio.fabioutils.GzipFile = CountedGzipFile
+
+    def tearDown(self):
+        fabio.fabioutils.BZ2File = self.BZ2File
+        fabio.fabioutils.GzipFile = self.GzipFile
+        UtilsTest.recursive_delete(self.tmpdir)
+
+    def compressed(self, obj, name):
+        "write obj in the temporary directory, with a gzipped and a bzipped copy"
+        fname = os.path.join(self.tmpdir, name)
+        obj.write(fname)
+        raw = open(fname, "rb").read()
+        bz2.BZ2File(fname + ".bz2", "wb").write(raw)
+        gzip.open(fname + ".gz", "wb").write(raw)
+        return [fname + ".bz2", fname + ".gz"]
+
+    def test_stream(self):
+        """ streamed format (edf) """
+        for fname in self.compressed(edfimage(data=self.data), "single.edf"):
+            del self.opened[:]
+            obj = openimage(fname)
+            self.assertEqual(type(obj), edfimage)
+            self.assertEqual(abs(obj.data - self.data).max(), 0, "data are the same")
+            self.assertEqual(len(self.opened), 1, "%s opened only once" % fname)
+
+    def test_seek(self):
+        """ format needing a seek to read (tif) """
+        for fname in self.compressed(tifimage(data=self.data), "single.tif"):
+            del self.opened[:]
+            obj = openimage(fname)
+            self.assertEqual(type(obj), tifimage)
+            self.assertEqual(abs(obj.data - self.data).max(), 0, "data are the same")
+            self.assertEqual(len(self.opened), 1, "%s opened only once" % fname)
+            del self.opened[:]
+            obj = fabio.openheader(fname)
+            self.assertEqual(obj.dim1, 120, "header read")
+            self.assertEqual(len(self.opened), 1, "%s header opened only once" % fname)
+
+    def test_unused(self):
+        """ the stream is closed when the class opens the file by itself (hdf5...) """
+        fname = os.path.join(self.tmpdir, "unused.edf")
+        edfimage(data=self.data).write(fname)
+        streams = []
+        class ownimage(edfimage):
+            def _prefetch(self, fname, stream, head=""):
+                streams.append(stream)
+                edfimage._prefetch(self, fname, stream, head)
+            def read(self, fname, frame=None):
+                return self
+            def readheader(self, fname):
+                return self
+        get_klass = fabio.openimage.get_klass
+        fabio.openimage.get_klass = lambda filetype: ownimage
+        try:
+            openimage(fname)
+            fabio.openheader(fname)
+        finally:
+            fabio.openimage.get_klass = get_klass
+        self.assertEqual(len(streams), 2, "stream handed over")
+        self.assertTrue(all(stream.closed for stream in streams), "unused streams closed")
+        obj = openimage(fname)
+        self.assertEqual(abs(obj.data - self.data).max(), 0, "used stream still readable")
+
+
+class testlazyimport(unittest.TestCase):
+    """format modules are imported only when needed"""
+    def test_import(self):
+        import subprocess
+        env = os.environ.copy()
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(fabio.__file__))
+        script = "import sys, fabio; print sorted(i for i in fabio.openimage.FORMATS.values() if 'fabio.' + i in sys.modules)"
+        out = subprocess.Popen([sys.executable, "-c", script], env=env,
+                               stdout=subprocess.PIPE).communicate()[0]
+        self.assertEqual(out.strip(), "[]", "no format module imported by 'import fabio'")
+
+    def test_get_klass(self):
+        self.assertEqual(fabio.openimage.get_klass("edf"), edfimage)
+        self.assertEqual(fabio.openimage.get_klass("tif"), tifimage)
+        self.assertEqual(fabio.openimage.get_klass("unknown"), None)
+        obj = edfimage(data=numpy.zeros((10, 10))).convert("tif")
+        self.assertEqual(type(obj), tifimage)
+
+
+class testmagic(unittest.TestCase):
+    """format detection from the first bytes of the file"""
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="testmagic")
+        self.data = numpy.arange(120 * 100, dtype="uint16").reshape((100, 120))
+
+    def tearDown(self):
+        UtilsTest.recursive_delete(self.tmpdir)
+
+    def test_prefix(self):
+        """ the most specific signature wins, whatever the order of MAGIC_NUMBERS """
+        self.assertEqual(fabio.openimage.do_magic("{\nHEADER_BYTES=  512;"), "adsc")
+        self.assertEqual(fabio.openimage.do_magic("{\nHeaderID = EH:000"), "edf")
+        self.assertEqual(fabio.openimage.do_magic("FORMAT :        86"), "bruker")
+        self.assertRaises(Exception, fabio.openimage.do_magic, "\xff\xfe")
+
+    def test_tiff(self):
+        """ TIFF flavours told apart by the tags of the first IFD """
+        from fabio.TiffIO import TiffIO
+        for software, name, expected in (("fabio.tifimage", "plain.tif", "tif"),
+                                          ("Camserver", "pilatus.tif", "pilatus"),
+                                          ("marccd", "marccd.tif", "marccd")):
+            fname = os.path.join(self.tmpdir, name)
+            tiff = TiffIO(fname, mode="w")
+            tiff.writeImage(self.data, software=software)
+            tiff = None
+            head = open(fname, "rb").read()
+            self.assertEqual(fabio.openimage.detect_format(head, filename=fname)[0], expected, name)
+
+    def test_cache_tiff(self):
+        """ TIFF files sharing directory, extension and first bytes are each validated """
+        from fabio.TiffIO import TiffIO
+        from fabio.pilatusimage import pilatusimage
+        for names in (("pilatus.tif", "plain.tif"), ("plain2.tif", "pilatus2.tif")):
+            for name in names:
+                tiff = TiffIO(os.path.join(self.tmpdir, name), mode="w")
+                tiff.writeImage(self.data, software="Camserver" if "pilatus" in name else "fabio.tifimage")
+                tiff = None
+            for name in names:
+                obj = openimage(os.path.join(self.tmpdir, name))
+                expected = pilatusimage if "pilatus" in name else tifimage
+                self.assertEqual(type(obj), expected, name)
+
+
 def test_suite_all_openimage():
     testSuite = unittest.TestSuite()
     testSuite.addTest(testedfbz2("testcase"))
@@ -226,6 +375,17 @@ def test_suite_all_openimage():
     testSuite.addTest(testOXD("testcase"))
     testSuite.addTest(testOXDUNC("testcase"))
 
+    testSuite.addTest(testsingleopen("test_stream"))
+    testSuite.addTest(testsingleopen("test_seek"))
+    testSuite.addTest(testsingleopen("test_unused"))
+
+    testSuite.addTest(testlazyimport("test_import"))
+    testSuite.addTest(testlazyimport("test_get_klass"))
+
+    testSuite.addTest(testmagic("test_prefix"))
+    testSuite.addTest(testmagic("test_tiff"))
+    testSuite.addTest(testmagic("test_cache_tiff"))
+
     return testSuite
 
 if __name__ == '__main__':